@@ -0,0 +1,192 @@
+"""Servidor local que imita la API de bots de Telegram para probar los envíos del bot.
+
+Responde a getMe, sendMessage, sendDocument y editMessageText con el mismo
+formato que la API real y aplica sus límites de envío: uno global por bot y
+otro por chat (más bajo en grupos, que tienen id negativo). Un envío que los
+supera recibe un 429 con `retry_after`, como en Telegram. Registra cada
+petición para poder comprobar después qué ha llegado y cuándo.
+
+Uso con python-telegram-bot:
+  with FakeBotApi() as api:
+      bot = Bot("123:TEST", base_url=api.base_url)
+"""
+import json
+import math
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+
+class _Bucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Gasta una ficha. Devuelve 0 si la había o los segundos hasta la siguiente"""
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+def _parse_body(headers, body):
+    """Parámetros de la petición: JSON, formulario o multipart (los ficheros, como (nombre, bytes))"""
+    content_type = headers.get("Content-Type", "")
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    if content_type.startswith("multipart/form-data"):
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode("latin-1") + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True)
+            filename = part.get_filename()
+            params[name] = (filename, payload) if filename else payload.decode("utf-8")
+        return params
+    return {key: values[0] for key, values in parse_qs(body.decode("utf-8")).items()}
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    server_version = "FakeBotApi/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self.do_POST()
+
+    def do_POST(self):
+        # /bot<token>/<método>
+        method = self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+        length = int(self.headers.get("Content-Length", 0))
+        params = _parse_body(self.headers, self.rfile.read(length))
+        time.sleep(self.server.latency)
+
+        if method == "getMe":
+            self._reply(200, {"ok": True, "result": {
+                "id": 123, "is_bot": True, "first_name": "Wallapop", "username": "wallapop_test_bot",
+            }})
+            return
+        if method not in ("sendMessage", "sendDocument", "editMessageText"):
+            self._reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+
+        chat_id = int(params.get("chat_id", 0))
+        retry_after = self.server.check_limits(chat_id)
+        if retry_after:
+            self._reply(429, {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            })
+            return
+        self._reply(200, {"ok": True, "result": self.server.record(method, chat_id, params)})
+
+
+class FakeBotApi(ThreadingHTTPServer):
+    """API de bots de Telegram de pruebas con los límites de envío de la real.
+
+    `global_rate` y `chat_rate` son mensajes por segundo (por bot y por chat
+    privado), `chat_burst` la ráfaga que admite un chat, `group_rate` el
+    límite de los grupos y `latency` los segundos que tarda cada respuesta.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, global_rate=30, chat_rate=1.0, chat_burst=3,
+                 group_rate=20 / 60, latency=0.02, verbose=False):
+        super().__init__((host, port), FakeBotApiHandler)
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.latency = latency
+        self.verbose = verbose
+        self.messages = []  # (instante, método, chat_id, texto)
+        self.rate_limited = 0  # Respuestas 429
+        self._lock = threading.Lock()
+        self._global = _Bucket(global_rate, global_rate)
+        self._chats = {}
+        self._message_ids = {}
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def check_limits(self, chat_id):
+        """Segundos de retry_after si el envío supera algún límite; 0 si se acepta"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                if chat_id < 0:
+                    bucket = _Bucket(self.group_rate, 1)
+                else:
+                    bucket = _Bucket(self.chat_rate, self.chat_burst)
+                self._chats[chat_id] = bucket
+            wait = max(bucket.take(now), self._global.take(now))
+            if wait:
+                self.rate_limited += 1
+                return max(1, math.ceil(wait))
+            return 0
+
+    def record(self, method, chat_id, params):
+        """Guarda el envío y devuelve el Message que respondería Telegram"""
+        with self._lock:
+            if method == "editMessageText":
+                message_id = int(params["message_id"])
+            else:
+                message_id = self._message_ids.get(chat_id, 0) + 1
+                self._message_ids[chat_id] = message_id
+            text = params.get("text") or params.get("caption") or ""
+            self.messages.append((time.monotonic(), method, chat_id, text))
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+        }
+        if method == "sendDocument":
+            message["document"] = {"file_id": f"doc{message_id}", "file_unique_id": f"u{message_id}",
+                                   "file_name": params["document"][0]}
+            if params.get("caption"):
+                message["caption"] = params["caption"]
+        else:
+            message["text"] = text
+        return message
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
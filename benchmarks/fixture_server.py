@@ -0,0 +1,368 @@
+"""Servidor local que imita las páginas de búsqueda de Wallapop para los benchmarks.
+
+Sirve tarjetas con el mismo marcado que la web real (`tsl-public-item-card
+.ItemCard`), el diálogo de cookies de OneTrust, el botón `#btn-load-more`,
+scroll infinito tras pulsarlo, productos reservados (con las tres variantes
+que detecta el scraper), la API JSON de búsqueda para el backend http y
+páginas de detalle con Last-Modified/ETag que responden 304 si no cambian.
+Con `order_by=newest` los productos salen del más reciente (el de índice
+más alto) al más antiguo, así que subir `items` entre dos ejecuciones
+simula anuncios publicados entretanto; con `order_by=price_low_to_high`,
+del más barato al más caro. Cada latitud desplaza el rango de productos,
+de modo que ciudades distintas comparten sólo parte de los anuncios.
+
+Uso independiente:
+  python benchmarks/fixture_server.py --items 500 --delay 0.2 --port 8000
+  python wallapop_tracker.py "ps5" --base-url http://127.0.0.1:8000 --max-scrolls 20
+"""
+import argparse
+import functools
+import html
+import json
+import os
+import re
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wallapop_item import format_cents
+
+CITIES = ["Madrid", "Barcelona", "Valencia", "Sevilla", "Zaragoza", "Málaga", "Bilbao"]
+
+COOKIE_DIALOG = """
+<div id="onetrust-consent-sdk">
+  <div id="onetrust-banner-sdk" style="position:fixed;bottom:0;left:0;right:0;z-index:1000;background:#fff;padding:16px">
+    <p>Usamos cookies para mejorar tu experiencia.</p>
+    <button id="onetrust-accept-btn-handler"
+            onclick="document.cookie = 'OptanonAlertBoxClosed=1; path=/';
+                     document.getElementById('onetrust-consent-sdk').remove()">Aceptar todo</button>
+  </div>
+</div>
+"""
+
+PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="es">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+  body {{ margin: 0; font-family: sans-serif; }}
+  .ItemCard {{ display: block; height: 280px; border-bottom: 1px solid #ddd; }}
+  #btn-load-more {{ display: block; margin: 24px auto; padding: 12px 24px; }}
+</style>
+</head>
+<body>
+{cookies}
+{body}
+</body>
+</html>
+"""
+
+SEARCH_SCRIPT = """
+<script>
+(function () {
+  const total = %(total)d;
+  const pageSize = %(page_size)d;
+  const keywords = %(keywords)s;
+  const order = %(order)s;
+  const offset = %(offset)d;
+  const grid = document.getElementById('search-results');
+  let loaded = grid.querySelectorAll('tsl-public-item-card').length;
+  let loading = false;
+  let infinite = false;
+
+  function loadNext() {
+    if (loading || loaded >= total) { return Promise.resolve(); }
+    loading = true;
+    const params = new URLSearchParams({keywords: keywords, start: loaded, count: pageSize, order_by: order, offset: offset});
+    return fetch('/fixture/cards?' + params).then(r => r.text()).then(fragment => {
+      grid.insertAdjacentHTML('beforeend', fragment);
+      loaded = grid.querySelectorAll('tsl-public-item-card').length;
+      loading = false;
+    });
+  }
+
+  const button = document.getElementById('btn-load-more');
+  if (button) {
+    button.addEventListener('click', () => {
+      button.remove();
+      infinite = true;
+      loadNext();
+    });
+  }
+
+  window.addEventListener('scroll', () => {
+    if (!infinite) { return; }
+    const bottom = window.scrollY + window.innerHeight;
+    if (bottom >= document.documentElement.scrollHeight - 600) { loadNext(); }
+  });
+})();
+</script>
+"""
+
+
+def fixture_item(keywords, index, reserved_every=7):
+    """Producto determinista número `index` de una búsqueda"""
+    slug = re.sub(r'[^a-z0-9]+', '-', keywords.lower()).strip('-') or "producto"
+    price_cents = 500 + (index * 7919) % 250000
+    if index % 5 == 0:
+        price_cents -= price_cents % 100  # Algunos precios sin céntimos
+    return {
+        "id": f"{slug}{index}",
+        "title": f"{keywords} {index}",
+        "price_cents": price_cents,
+        "location": CITIES[index % len(CITIES)],
+        "slug": f"{slug}-{index}",
+        "reserved": reserved_every > 0 and index % reserved_every == reserved_every - 1,
+        "modified_at": 1700000000000 + index * 60000,
+    }
+
+
+@functools.lru_cache(maxsize=64)
+def _price_order(offset, total):
+    """Índices [offset, offset + total) ordenados de menor a mayor precio"""
+    return sorted(range(offset, offset + total), key=lambda i: (fixture_item("", i)["price_cents"], i))
+
+
+def detail_html(keywords, index, reserved_every=7):
+    """Página de detalle con los datos del anuncio en __NEXT_DATA__, como la web"""
+    item = fixture_item(keywords, index, reserved_every)
+    data = {"props": {"pageProps": {"item": {
+        "id": item["id"],
+        "title": {"original": item["title"]},
+        "description": {"original": f"Descripción de {item['title']}. Buen estado."},
+        "creationDate": item["modified_at"] - 86400000,
+        "modifiedDate": item["modified_at"],
+        "userId": f"user{index % 13}",
+        "shipping": {"isItemShippable": index % 2 == 0, "isShippingAllowedByUser": True},
+    }}}}
+    body = (f'<h1>{html.escape(item["title"])}</h1>'
+            f'<script id="__NEXT_DATA__" type="application/json">{json.dumps(data)}</script>')
+    return PAGE_TEMPLATE.format(title=html.escape(item["title"]), cookies="", body=body), item["modified_at"]
+
+
+def card_html(item, index):
+    """Tarjeta con el marcado de la web; alterna las tres formas de marcar un reservado"""
+    reserved = ""
+    if item["reserved"]:
+        variant = index % 3
+        if variant == 0:
+            reserved = '<div class="ItemCard__badge"><wallapop-badge badge-type="reserved">Reservado</wallapop-badge></div>'
+        elif variant == 1:
+            reserved = '<div class="ItemCard__status"><walla-icon icon="reserved"></walla-icon><span>Reservado</span></div>'
+        else:
+            reserved = '<div class="ItemCard__extra">Reservado</div>'
+    return (
+        f'<a href="/item/{item["slug"]}" class="ItemCardList__item">'
+        f'<tsl-public-item-card><div class="ItemCard">'
+        f'<p class="ItemCard__title">{html.escape(item["title"])}</p>'
+        f'<span class="ItemCard__price">{format_cents(item["price_cents"])} €</span>'
+        f'<span class="ItemCard__location">{html.escape(item["location"])}</span>'
+        f'{reserved}'
+        f'</div></tsl-public-item-card></a>'
+    )
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    server_version = "WallapopFixture/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, body, content_type="text/html; charset=utf-8", headers=None):
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _cookie_dialog(self):
+        """El diálogo sólo aparece mientras no se hayan aceptado las cookies"""
+        return "" if "OptanonAlertBoxClosed" in self.headers.get("Cookie", "") else COOKIE_DIALOG
+
+    def _offset(self, query):
+        """Primer índice de la búsqueda según la latitud: cada ciudad ve un rango distinto"""
+        try:
+            latitude = float(query.get("latitude", 0))
+        except ValueError:
+            return 0
+        return int(abs(latitude) * 10) % max(self.server.items, 1)
+
+    def _indexes(self, start, count, order, offset=0):
+        """Índices de los productos en las posiciones [start, start + count) según el orden"""
+        total = self.server.items
+        end = min(start + count, total)
+        if order == "newest":
+            return [offset + total - 1 - position for position in range(start, end)]
+        if order == "price_low_to_high":
+            return _price_order(offset, total)[start:end]
+        return list(range(offset + start, offset + end))
+
+    def _cards(self, keywords, start, count, order="", offset=0):
+        return "".join(
+            card_html(fixture_item(keywords, i, self.server.reserved_every), i)
+            for i in self._indexes(start, count, order, offset)
+        )
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.server.requests += 1
+
+        if url.path == "/":
+            self._send(PAGE_TEMPLATE.format(title="Wallapop", cookies=self._cookie_dialog(), body="<h1>Wallapop</h1>"))
+        elif url.path == "/app/search":
+            time.sleep(self.server.delay)
+            self._send(self._search_page(query.get("keywords", ""), query.get("order_by", ""),
+                                         self._offset(query)))
+        elif url.path == "/fixture/cards":
+            time.sleep(self.server.delay)
+            self._send(self._cards(query.get("keywords", ""), int(query.get("start", 0)),
+                                   int(query.get("count", self.server.page_size)), query.get("order_by", ""),
+                                   int(query.get("offset", 0))))
+        elif url.path == "/api/v3/search":
+            time.sleep(self.server.delay)
+            self._api_search(query)
+        elif url.path.startswith("/item/"):
+            self._item_page(url.path[len("/item/"):])
+        else:
+            self.send_error(404)
+
+    def _item_page(self, slug):
+        """Detalle de un anuncio; responde 304 si el cliente ya tiene la versión actual"""
+        keywords, _, index = slug.rpartition("-")
+        if not index.isdigit():
+            self.send_error(404)
+            return
+        time.sleep(self.server.delay)
+        page, modified_at = detail_html(keywords.replace("-", " "), int(index), self.server.reserved_every)
+        etag = f'"{slug}-{modified_at}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.server.not_modified += 1
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self._send(page, headers={"ETag": etag, "Last-Modified": formatdate(modified_at / 1000, usegmt=True)})
+
+    def _search_page(self, keywords, order="", offset=0):
+        page_size = self.server.page_size
+        body = f'<main><div id="search-results">{self._cards(keywords, 0, page_size, order, offset)}</div>'
+        if self.server.items > page_size:
+            body += '<button id="btn-load-more" type="button">Ver más productos</button>'
+        body += "</main>"
+        body += SEARCH_SCRIPT % {
+            "total": self.server.items,
+            "page_size": page_size,
+            "keywords": json.dumps(keywords),
+            "order": json.dumps(order),
+            "offset": offset,
+        }
+        return PAGE_TEMPLATE.format(title=f"{html.escape(keywords)} | Wallapop", cookies=self._cookie_dialog(),
+                                     body=body)
+
+    def _api_search(self, query):
+        """Respuesta con el formato de la API v3; el cursor es "keywords|orden|desplazamiento|posición" """
+        if "next_page" in query:
+            keywords, order, offset, start = query["next_page"].rsplit("|", 3)
+            offset, start = int(offset), int(start)
+        else:
+            keywords, order, start = query.get("keywords", ""), query.get("order_by", ""), 0
+            offset = self._offset(query)
+        end = min(start + self.server.page_size, self.server.items)
+        items = []
+        for i in self._indexes(start, self.server.page_size, order, offset):
+            item = fixture_item(keywords, i, self.server.reserved_every)
+            items.append({
+                "id": item["id"],
+                "title": item["title"],
+                "web_slug": item["slug"],
+                "price": {"amount": item["price_cents"] / 100, "currency": "EUR"},
+                "location": {"city": item["location"]},
+                "reserved": {"flag": item["reserved"]},
+                "modified_at": item["modified_at"],
+            })
+        payload = {
+            "data": {"section": {"payload": {"items": items}}},
+            "meta": {"next_page": f"{keywords}|{order}|{offset}|{end}" if end < self.server.items else None},
+        }
+        self._send(json.dumps(payload), content_type="application/json")
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """Servidor de fixtures en un hilo propio.
+
+    `items` es el total de productos de cada búsqueda, `page_size` los que
+    se cargan por página o por scroll y `delay` los segundos que tarda cada
+    respuesta de búsqueda.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, items=200, page_size=40, delay=0.0,
+                 reserved_every=7, verbose=False):
+        super().__init__((host, port), FixtureHandler)
+        self.items = items
+        self.page_size = page_size
+        self.delay = delay
+        self.reserved_every = reserved_every
+        self.verbose = verbose
+        self.requests = 0
+        self.not_modified = 0
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def api_url(self):
+        return f"{self.base_url}/api/v3/search"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local que imita las búsquedas de Wallapop")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--items", type=int, default=200, help="Productos por búsqueda (default: 200)")
+    parser.add_argument("--page-size", type=int, default=40, help="Productos por carga (default: 40)")
+    parser.add_argument("--delay", type=float, default=0.0, help="Segundos de retardo por respuesta")
+    parser.add_argument("--reserved-every", type=int, default=7, help="Uno de cada N productos reservado (0: ninguno)")
+    args = parser.parse_args()
+
+    server = FixtureServer(port=args.port, items=args.items, page_size=args.page_size,
+                           delay=args.delay, reserved_every=args.reserved_every, verbose=True)
+    print(f"→ Sirviendo fixtures en {server.base_url} (API: {server.api_url})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Benchmarks de extremo a extremo de WallapopScraper contra el servidor de fixtures.
+
+Mide productos por segundo, tiempo hasta el primer producto, comandos
+WebDriver y memoria del navegador (RSS del árbol de procesos de Chromium):
+la máxima y cuánto crece entre el primer scroll y el último, que con
+--items grande y el escenario browser-prune debería quedarse casi plana.
+Los resultados se guardan como líneas base JSON en
+benchmarks/baselines/ y las ejecuciones siguientes se comparan con ellas.
+
+Ejemplos:
+  python benchmarks/run_benchmarks.py                      # comparar con las líneas base
+  python benchmarks/run_benchmarks.py --save-baseline      # registrar nuevas líneas base
+  python benchmarks/run_benchmarks.py --scenario http --items 2000 --delay 0.05
+  python benchmarks/run_benchmarks.py --scenario browser-bulk --scenario browser-prune --items 3000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fixture_server import FixtureServer
+from wallapop_tracker import WallapopScraper
+from wallapop_pool import DriverPool, browser_pids, process_tree_rss
+from wallapop_blocking import BlockProfile
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+# backend, modo de extracción, si se usa un navegador precalentado del pool y
+# si se vacían las tarjetas ya extraídas
+SCENARIOS = {
+    "browser-bulk": ("browser", "bulk", False, False),
+    "browser-element": ("browser", "element", False, False),
+    "browser-pool": ("browser", "bulk", True, False),
+    "browser-prune": ("browser", "bulk", False, True),
+    "http": ("http", "bulk", False, False),
+}
+
+# Métrica -> True si un valor mayor es mejor
+METRICS = {
+    "items_per_sec": True,
+    "ttfi_s": False,
+    "webdriver_commands": False,
+    "peak_rss_mb": False,
+    "rss_growth_mb": False,
+}
+
+
+class RssSampler(threading.Thread):
+    """Muestrea en segundo plano la memoria del navegador que esté usando el scraper"""
+
+    def __init__(self, scraper, interval=0.1):
+        super().__init__(daemon=True)
+        self.scraper = scraper
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            driver = self.scraper.driver
+            if driver is not None:
+                rss = process_tree_rss(browser_pids(driver))
+                if rss:
+                    self.peak = max(self.peak, rss)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def run_once(server, scenario, pool=None, verbose=False):
+    """Ejecuta una búsqueda completa y devuelve sus métricas"""
+    backend, extraction, _, prune = SCENARIOS[scenario]
+    scraper = WallapopScraper("benchmark", "madrid", pool=pool)
+    scraper.base_url = server.base_url
+    scraper.api_url = server.api_url
+    scraper.backend = backend
+    scraper.extraction_mode = extraction
+    scraper.prune_dom = prune
+    scraper.max_scrolls = None
+    scraper.auto_save = False
+
+    sampler = RssSampler(scraper)
+    sampler.start()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    started = time.perf_counter()
+    first_item = None
+    try:
+        with output:
+            for _ in scraper.iter_scrape():
+                if first_item is None:
+                    first_item = time.perf_counter() - started
+    finally:
+        elapsed = time.perf_counter() - started
+        sampler.stop()
+
+    items = len(scraper.results)
+    # Crecimiento de la memoria del navegador entre el primer scroll y el último
+    samples = [sample[2] for sample in scraper.memory_samples]
+    return {
+        "items": items,
+        "reserved": sum(1 for item in scraper.results if item.reserved),
+        "elapsed_s": round(elapsed, 3),
+        "items_per_sec": round(items / elapsed, 2) if elapsed else 0.0,
+        "ttfi_s": round(first_item, 3) if first_item is not None else None,
+        "webdriver_commands": scraper.command_count if backend == "browser" else 0,
+        "peak_rss_mb": round(sampler.peak / 1024 / 1024, 1) if sampler.peak else None,
+        "rss_growth_mb": round((samples[-1] - samples[0]) / 1024 / 1024, 1) if len(samples) > 1 else None,
+        "scrolls": scraper.total_scrolls,
+    }
+
+
+def run_scenario(server, scenario, repeat, verbose=False):
+    """Repite el escenario y devuelve la mediana de cada métrica"""
+    pool = None
+    if SCENARIOS[scenario][2]:
+        pool = DriverPool(size=1, base_url=server.base_url, block_profile=BlockProfile.from_name("minimal"))
+        pool.start()  # El arranque del navegador queda fuera de la medida
+    try:
+        runs = [run_once(server, scenario, pool, verbose) for _ in range(repeat)]
+    finally:
+        if pool is not None:
+            pool.close()
+
+    metrics = {}
+    for key in runs[0]:
+        values = [run[key] for run in runs if run[key] is not None]
+        metrics[key] = statistics.median(values) if values else None
+    return metrics
+
+
+def baseline_path(scenario):
+    return os.path.join(BASELINE_DIR, f"{scenario}.json")
+
+
+def load_baseline(scenario):
+    try:
+        with open(baseline_path(scenario), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(scenario, config, metrics):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    baseline = {
+        "scenario": scenario,
+        "config": config,
+        "metrics": metrics,
+        "recorded_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+    }
+    with open(baseline_path(scenario), "w", encoding="utf-8") as f:
+        json.dump(baseline, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+
+
+def compare(metrics, baseline, tolerance):
+    """Devuelve la lista de regresiones respecto a la línea base"""
+    regressions = []
+    for key, higher_is_better in METRICS.items():
+        current, previous = metrics.get(key), baseline["metrics"].get(key)
+        if current is None or not previous:
+            continue
+        change = (current - previous) / previous
+        if (change < -tolerance) if higher_is_better else (change > tolerance):
+            regressions.append(f"{key}: {previous} -> {current} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de WallapopScraper con un servidor local")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Escenario a ejecutar (se puede repetir; default: todos)")
+    parser.add_argument("--items", type=int, default=200, help="Productos por búsqueda (default: 200)")
+    parser.add_argument("--page-size", type=int, default=40, help="Productos por carga (default: 40)")
+    parser.add_argument("--delay", type=float, default=0.05, help="Retardo de cada respuesta en segundos (default: 0.05)")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por escenario; se usa la mediana (default: 3)")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Empeoramiento relativo admitido antes de marcar una regresión (default: 0.2)")
+    parser.add_argument("--save-baseline", action="store_true", help="Guardar los resultados como nuevas líneas base")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar la salida del scraper")
+    args = parser.parse_args()
+
+    if args.items <= args.page_size:
+        parser.error("--items debe ser mayor que --page-size para que aparezca 'Ver más productos'")
+
+    config = {"items": args.items, "page_size": args.page_size, "delay": args.delay}
+    reserved_every = 7
+    expected_reserved = args.items // reserved_every
+    failed = False
+
+    with FixtureServer(items=args.items, page_size=args.page_size, delay=args.delay,
+                       reserved_every=reserved_every) as server:
+        for scenario in args.scenario or sorted(SCENARIOS):
+            print(f"→ {scenario}...", flush=True)
+            try:
+                metrics = run_scenario(server, scenario, args.repeat, args.verbose)
+            except Exception as e:
+                print(f"  ✗ Error: {e}")
+                failed = True
+                continue
+
+            print(f"  Productos: {metrics['items']} ({metrics['reserved']} reservados) en {metrics['elapsed_s']:.2f}s")
+            print(f"  Productos/s: {metrics['items_per_sec']:.1f}, primer producto: {metrics['ttfi_s']}s")
+            print(f"  Comandos WebDriver: {metrics['webdriver_commands']}, RSS máximo: {metrics['peak_rss_mb']} MB, "
+                  f"crecimiento entre scrolls: {metrics['rss_growth_mb']} MB")
+
+            if metrics["items"] != args.items or metrics["reserved"] != expected_reserved:
+                print(f"  ✗ Se esperaban {args.items} productos ({expected_reserved} reservados)")
+                failed = True
+
+            if args.save_baseline:
+                save_baseline(scenario, config, metrics)
+                print(f"  ✓ Línea base guardada en {baseline_path(scenario)}")
+                continue
+
+            baseline = load_baseline(scenario)
+            if baseline is None:
+                print("  - Sin línea base (usa --save-baseline)")
+            elif baseline["config"] != config:
+                print("  - La línea base se grabó con otra configuración; no se compara")
+            else:
+                regressions = compare(metrics, baseline, args.tolerance)
+                for regression in regressions:
+                    print(f"  ✗ Regresión en {regression}")
+                if regressions:
+                    failed = True
+                else:
+                    print("  ✓ Sin regresiones respecto a la línea base")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
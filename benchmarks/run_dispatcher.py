@@ -0,0 +1,160 @@
+"""Ráfaga de envíos contra la API de bots de pruebas, con y sin TelegramDispatcher.
+
+Simula varios seguimientos que avisan a la vez en unos cuantos chats (uno de
+ellos un grupo) mientras los usuarios lanzan comandos. Sin dispatcher, cada
+aviso se envía directamente y los que superan los límites reciben un 429 y
+se pierden; con él, los avisos de un chat se agrupan y las respuestas a
+comandos salen primero. Termina con error si con el dispatcher hay algún
+429, algún envío fallido o alguna respuesta en un chat privado que tarde
+más de --max-latency (los grupos admiten 20 mensajes por minuto, así que
+allí las respuestas seguidas esperan por fuerza).
+
+Ejemplos:
+  python benchmarks/run_dispatcher.py
+  python benchmarks/run_dispatcher.py --chats 10 --alerts 30
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Bot
+from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
+
+from fake_bot_api import FakeBotApi
+from wallapop_dispatcher import TelegramDispatcher
+from wallapop_metrics import Metrics
+
+TOKEN = "123:TEST"
+GROUP_CHAT = -100
+
+
+def make_bot(api):
+    # Suficientes conexiones para que el envío directo no se limite por el cliente HTTP
+    return Bot(TOKEN, base_url=api.base_url, request=HTTPXRequest(connection_pool_size=64))
+
+
+def chat_ids(chats):
+    return list(range(1, chats)) + [GROUP_CHAT]
+
+
+def alert_text(chat_id, n):
+    return f"🔔 Novedades en 'búsqueda {chat_id}':\n\n🆕 Anuncio {n} - {100 + n}€\nhttp://localhost/item/{chat_id}-{n}"
+
+
+async def run_direct(api, chats, alerts, commands, command_at):
+    """Cada envío va directo a la API, como hacía el bot antes del dispatcher"""
+    failed = 0
+    latencies = []
+
+    async def send(chat_id, text, interactive=False):
+        nonlocal failed
+        start = time.monotonic()
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, disable_web_page_preview=True)
+        except TelegramError:
+            failed += 1
+            return
+        if interactive and chat_id != GROUP_CHAT:
+            latencies.append(time.monotonic() - start)
+
+    async def command(chat_id, n):
+        await asyncio.sleep(command_at)
+        await send(chat_id, f"Respuesta {n}", interactive=True)
+
+    async with make_bot(api) as bot:
+        tasks = [send(chat_id, alert_text(chat_id, n)) for chat_id in chat_ids(chats) for n in range(alerts)]
+        tasks += [command(chat_id, n) for chat_id in chat_ids(chats) for n in range(commands)]
+        await asyncio.gather(*tasks)
+    return {"failed": failed, "latencies": latencies, "coalesced": 0}
+
+
+async def run_dispatcher(api, chats, alerts, commands, command_at):
+    """Los avisos se encolan sin esperar y las respuestas esperan su turno en el dispatcher"""
+    registry = Metrics()
+    failed = 0
+    latencies = []
+
+    async def command(chat_id, n):
+        nonlocal failed
+        await asyncio.sleep(command_at)
+        start = time.monotonic()
+        try:
+            await dispatcher.send_message(chat_id, f"Respuesta {n}")
+        except TelegramError:
+            failed += 1
+            return
+        if chat_id != GROUP_CHAT:
+            latencies.append(time.monotonic() - start)
+
+    async with make_bot(api) as bot:
+        dispatcher = TelegramDispatcher(bot, registry=registry)
+        futures = [dispatcher.notify(chat_id, alert_text(chat_id, n))
+                   for chat_id in chat_ids(chats) for n in range(alerts)]
+        await asyncio.gather(*(command(chat_id, n) for chat_id in chat_ids(chats) for n in range(commands)))
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        failed += sum(1 for result in results if isinstance(result, Exception))
+        await dispatcher.close()
+    coalesced = registry.value("wallapop_telegram_coalesced_total")
+    return {"failed": failed, "latencies": latencies, "coalesced": int(coalesced)}
+
+
+def run(mode, args):
+    with FakeBotApi(latency=args.latency) as api:
+        runner = run_direct if mode == "direct" else run_dispatcher
+        start = time.monotonic()
+        result = asyncio.run(runner(api, args.chats, args.alerts, args.commands, args.command_at))
+        result["elapsed_s"] = time.monotonic() - start
+        result["sent"] = len(api.messages)
+        result["rate_limited"] = api.rate_limited
+    return result
+
+
+def report(mode, result):
+    latencies = result["latencies"]
+    if latencies:
+        replies = f"p50={statistics.median(latencies):.2f}s máx={max(latencies):.2f}s"
+    else:
+        replies = "ninguna entregada"
+    print(f"{mode:<11} enviados={result['sent']:<4} 429={result['rate_limited']:<4} "
+          f"fallidos={result['failed']:<4} agrupados={result['coalesced']:<4} "
+          f"respuestas {replies}  total={result['elapsed_s']:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ráfaga de envíos a Telegram con y sin dispatcher")
+    parser.add_argument("--chats", type=int, default=6, help="Chats, el último un grupo (default: 6)")
+    parser.add_argument("--alerts", type=int, default=12, help="Avisos por chat (default: 12)")
+    parser.add_argument("--commands", type=int, default=2, help="Respuestas a comandos por chat (default: 2)")
+    parser.add_argument("--command-at", type=float, default=0.5,
+                        help="Segundos tras la ráfaga en que llegan los comandos (default: 0.5)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Latencia de la API en segundos (default: 0.02)")
+    parser.add_argument("--max-latency", type=float, default=5.0,
+                        help="Máximo aceptable para una respuesta en un chat privado (default: 5)")
+    parser.add_argument("--skip-direct", action="store_true", help="No ejecutar la ráfaga sin dispatcher")
+    args = parser.parse_args()
+
+    if not args.skip_direct:
+        report("directo", run("direct", args))
+    result = run("dispatcher", args)
+    report("dispatcher", result)
+
+    problems = []
+    if result["rate_limited"]:
+        problems.append(f"{result['rate_limited']} respuestas 429")
+    if result["failed"]:
+        problems.append(f"{result['failed']} envíos fallidos")
+    if result["latencies"] and max(result["latencies"]) > args.max_latency:
+        problems.append(f"respuestas más lentas de {args.max_latency}s")
+    if problems:
+        print("✗ Dispatcher: " + ", ".join(problems))
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Servidor local que reproduce respuestas grabadas de la API de búsqueda de Wallapop.
+
+Cada fichero .json del directorio de grabaciones tiene la petición
+("request": sus parámetros), las cabeceras de la respuesta ("headers") y su
+cuerpo ("body"). Una petición cuyos parámetros coinciden con los de una
+grabación recibe esa respuesta; cualquier otra, un 404.
+
+Uso:
+  with ApiReplayServer(FIXTURES) as server:
+      client = WallapopApiClient(api_url=server.api_url)
+"""
+import glob
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "api_search")
+
+
+def load_recordings(directory):
+    """Grabaciones del directorio como lista de (parámetros, cabeceras, cuerpo)"""
+    recordings = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path, encoding="utf-8") as f:
+            recording = json.load(f)
+        recordings.append((recording["request"], recording.get("headers") or {}, recording["body"]))
+    return recordings
+
+
+class ApiReplayHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.server.requests.append(params)
+        for request, headers, body in self.server.recordings:
+            if request == params:
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+                return
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class ApiReplayServer(ThreadingHTTPServer):
+    """API de búsqueda de pruebas que responde con las grabaciones de `directory`"""
+
+    daemon_threads = True
+
+    def __init__(self, directory=FIXTURES, host="127.0.0.1", port=0):
+        super().__init__((host, port), ApiReplayHandler)
+        self.recordings = load_recordings(directory)
+        self.requests = []  # Parámetros de cada petición recibida
+        self._thread = None
+
+    @property
+    def api_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/api/v3/search"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,107 @@
+"""Pruebas de WallapopApiClient contra respuestas grabadas de la API de búsqueda.
+
+  python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import requests
+
+from api_replay import ApiReplayServer
+from wallapop_api import WallapopApiClient, get_session
+
+PS5 = {"keywords": "ps5", "latitude": "40.4168", "longitude": "-3.7038", "order_by": "most_relevance"}
+PAGE_2 = "eyJwYWdlIjoyLCJrZXl3b3JkcyI6InBzNSJ9"
+PAGE_3 = "eyJwYWdlIjozLCJrZXl3b3JkcyI6InBzNSJ9"
+
+
+class WallapopApiClientTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ApiReplayServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.requests.clear()
+        # Sin reintentos: un 404 debe fallar en el acto
+        self.client = WallapopApiClient(api_url=self.server.api_url, base_url="https://es.wallapop.com",
+                                        session=get_session(retries=False))
+
+    def slugs(self, pages):
+        return [[raw.get("web_slug") for raw in page] for page in pages]
+
+    def test_follows_cursor_in_body_and_header(self):
+        pages = list(self.client.search_pages(PS5))
+        self.assertEqual(self.slugs(pages), [
+            ["ps5-edicion-digital-1104523001", "mando-dualsense-ps5-1104523002",
+             "ps5-con-lector-y-dos-mandos-1104523003", None],
+            ["ps5-slim-1tb-1104523005", "juego-ps5-spider-man-2-1104523006"],
+            ["soporte-vertical-ps5-1104523007"],
+        ])
+        # La página 1 trae el cursor en meta.next_page y la 2 en la cabecera X-NextPage
+        self.assertEqual(self.server.requests, [PS5, {"next_page": PAGE_2}, {"next_page": PAGE_3}])
+        self.assertEqual(self.client.requests_made, 3)
+        self.assertIsNone(self.client.next_page)
+
+    def test_max_pages_keeps_cursor_to_resume(self):
+        pages = list(self.client.search_pages(PS5, max_pages=1))
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(self.client.next_page, PAGE_2)
+
+        resumed = list(self.client.search_pages(PS5, cursor=self.client.next_page))
+        self.assertEqual(self.slugs(resumed), [
+            ["ps5-slim-1tb-1104523005", "juego-ps5-spider-man-2-1104523006"],
+            ["soporte-vertical-ps5-1104523007"],
+        ])
+        self.assertEqual(self.server.requests[1:], [{"next_page": PAGE_2}, {"next_page": PAGE_3}])
+
+    def test_maps_items(self):
+        raw = [raw for page in self.client.search_pages(PS5) for raw in page]
+        products = [self.client.to_product(item) for item in raw]
+
+        digital = products[0]
+        self.assertEqual(digital.title, "PS5 edición digital")
+        self.assertEqual(digital.price_cents, 34900)
+        self.assertEqual(digital.location, "Madrid")
+        self.assertEqual(digital.link, "https://es.wallapop.com/item/ps5-edicion-digital-1104523001")
+        self.assertFalse(digital.reserved)
+        self.assertEqual(digital.modified_at, 1760600001000)
+
+        mando = products[1]
+        self.assertEqual(mando.title, "Mando DualSense PS5")
+        self.assertEqual(mando.price_cents, 4550)
+        self.assertTrue(mando.reserved)
+
+        self.assertEqual(products[2].price_cents, 42000)
+        self.assertIsNone(products[3])  # Sin web_slug no hay enlace al anuncio
+        self.assertEqual(products[4].price_cents, 39999)
+        self.assertEqual(products[4].location, "Ubicación no disponible")
+
+    def test_legacy_search_objects(self):
+        params = {"keywords": "nintendo switch", "latitude": "40.4168", "longitude": "-3.7038"}
+        pages = list(self.client.search_pages(params))
+        self.assertEqual(len(pages), 1)
+        self.assertIsNone(self.client.next_page)
+
+        oled, lite = [self.client.to_product(raw) for raw in pages[0]]
+        self.assertEqual(oled.price_cents, 25000)
+        self.assertTrue(oled.reserved)
+        self.assertEqual(oled.modified_at, 1700000000000)
+        self.assertIsNone(lite.price_cents)
+        self.assertFalse(lite.reserved)
+        self.assertEqual(lite.location, "Móstoles")
+
+    def test_http_error_raises(self):
+        with self.assertRaises(requests.HTTPError):
+            list(self.client.search_pages({"keywords": "sin grabación"}))
+
+
+if __name__ == "__main__":
+    unittest.main()
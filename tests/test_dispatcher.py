@@ -0,0 +1,178 @@
+"""Pruebas de TelegramDispatcher con un reloj falso y un bot que sólo registra los envíos.
+
+  python -m unittest discover tests
+"""
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.error import RetryAfter
+
+from wallapop_dispatcher import ALERT_SEPARATOR, TelegramDispatcher, TokenBucket
+from wallapop_metrics import Metrics
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeBot:
+    """Registra (chat_id, texto) de cada envío. `fail` da errores a lanzar en los siguientes envíos"""
+
+    def __init__(self):
+        self.sent = []
+        self.fail = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.fail:
+            raise self.fail.pop(0)
+        self.sent.append((chat_id, text))
+        return len(self.sent)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=2, capacity=3, now=0.0)
+        for _ in range(3):
+            self.assertEqual(bucket.wait_time(0.0), 0)
+            bucket.take(0.0)
+        self.assertAlmostEqual(bucket.wait_time(0.0), 0.5)
+        self.assertEqual(bucket.wait_time(0.5), 0)
+
+    def test_refill_is_capped(self):
+        bucket = TokenBucket(rate=1, capacity=2, now=0.0)
+        bucket.take(0.0)
+        bucket.take(0.0)
+        bucket.wait_time(100.0)
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_pause(self):
+        bucket = TokenBucket(rate=1, capacity=3, now=0.0)
+        bucket.pause(5, now=0.0)
+        self.assertAlmostEqual(bucket.wait_time(0.0), 6.0)
+        self.assertAlmostEqual(bucket.wait_time(5.0), 1.0)
+        self.assertEqual(bucket.wait_time(6.0), 0)
+
+
+class DispatcherTest(unittest.IsolatedAsyncioTestCase):
+    def make(self, **kwargs):
+        self.clock = FakeClock()
+        self.bot = FakeBot()
+        self.registry = Metrics()
+        self.dispatcher = TelegramDispatcher(self.bot, registry=self.registry, clock=self.clock, **kwargs)
+        return self.dispatcher
+
+    async def asyncTearDown(self):
+        await self.dispatcher.close(timeout=0)
+
+    async def settle(self):
+        """Deja correr al dispatcher hasta que no pueda enviar nada más con la hora actual"""
+        for _ in range(20):
+            await asyncio.sleep(0)
+            if self.dispatcher._wakeup is not None:
+                self.dispatcher._wakeup.set()
+
+    async def advance(self, seconds):
+        self.clock.now += seconds
+        await self.settle()
+
+    def count(self, name):
+        return self.registry.value(f"wallapop_telegram_{name}_total")
+
+    async def test_chat_bucket_allows_burst_then_rate(self):
+        dispatcher = self.make(chat_rate=1.0, chat_burst=3)
+        futures = [asyncio.ensure_future(dispatcher.send_message(1, f"m{i}")) for i in range(5)]
+        await self.settle()
+        self.assertEqual([text for _, text in self.bot.sent], ["m0", "m1", "m2"])
+        await self.advance(0.5)
+        self.assertEqual(len(self.bot.sent), 3)
+        await self.advance(0.5)
+        self.assertEqual(len(self.bot.sent), 4)
+        await self.advance(1.0)
+        self.assertEqual([text for _, text in self.bot.sent], ["m0", "m1", "m2", "m3", "m4"])
+        self.assertEqual(await asyncio.wait_for(asyncio.gather(*futures), 1), [1, 2, 3, 4, 5])
+
+    async def test_group_rate(self):
+        dispatcher = self.make(group_rate=20 / 60)
+        for i in range(2):
+            asyncio.ensure_future(dispatcher.send_message(-100, f"g{i}"))
+        await self.settle()
+        self.assertEqual(len(self.bot.sent), 1)
+        await self.advance(2.9)
+        self.assertEqual(len(self.bot.sent), 1)
+        await self.advance(0.2)
+        self.assertEqual(len(self.bot.sent), 2)
+
+    async def test_global_bucket_limits_all_chats(self):
+        dispatcher = self.make(global_rate=2)
+        for chat_id in range(1, 6):
+            asyncio.ensure_future(dispatcher.send_message(chat_id, "hola"))
+        await self.settle()
+        self.assertEqual(len(self.bot.sent), 2)
+        await self.advance(0.5)
+        self.assertEqual(len(self.bot.sent), 3)
+        await self.advance(1.0)
+        self.assertEqual(len(self.bot.sent), 5)
+
+    async def test_interactive_before_alerts(self):
+        dispatcher = self.make(chat_rate=1.0, chat_burst=1, alert_delay=0)
+        # La respuesta se encola antes de que el dispatcher arranque, aunque se pida después
+        asyncio.ensure_future(dispatcher.send_message(1, "respuesta"))
+        dispatcher.notify(1, "aviso")
+        await self.settle()
+        self.assertEqual([text for _, text in self.bot.sent], ["respuesta"])
+        await self.advance(1.0)
+        self.assertEqual([text for _, text in self.bot.sent], ["respuesta", "aviso"])
+
+    async def test_alerts_coalesced_per_chat(self):
+        dispatcher = self.make(alert_delay=2.0)
+        futures = [dispatcher.notify(1, f"aviso {i}") for i in range(3)]
+        other = dispatcher.notify(2, "otro chat")
+        await self.settle()
+        self.assertEqual(self.bot.sent, [])
+        await self.advance(2.0)
+        self.assertEqual(sorted(self.bot.sent), [
+            (1, ALERT_SEPARATOR.join(f"aviso {i}" for i in range(3))),
+            (2, "otro chat"),
+        ])
+        results = await asyncio.wait_for(asyncio.gather(*futures), 1)
+        self.assertEqual(len(set(results)), 1)
+        self.assertTrue(other.done())
+        self.assertEqual(self.count("coalesced"), 2)
+
+    async def test_retry_after_pauses_chat_and_retries(self):
+        dispatcher = self.make()
+        self.bot.fail = [RetryAfter(5)]
+        future = asyncio.ensure_future(dispatcher.send_message(1, "hola"))
+        await self.settle()
+        self.assertEqual(self.bot.sent, [])
+        await self.advance(4.0)
+        self.assertEqual(self.bot.sent, [])
+        # Tras el retry_after el chat vuelve a empezar sin fichas: una más a chat_rate
+        await self.advance(2.5)
+        self.assertEqual(self.bot.sent, [(1, "hola")])
+        self.assertEqual(await asyncio.wait_for(future, 1), 1)
+        self.assertEqual(self.count("retry_after"), 1)
+        self.assertEqual(self.count("failed"), 0)
+
+    async def test_retry_after_on_last_attempt_counts_as_failed(self):
+        dispatcher = self.make(max_attempts=2)
+        self.bot.fail = [RetryAfter(1), RetryAfter(1)]
+        future = asyncio.ensure_future(dispatcher.send_message(1, "hola"))
+        await self.settle()
+        await self.advance(3.0)
+        with self.assertRaises(RetryAfter):
+            await asyncio.wait_for(future, 1)
+        self.assertEqual(self.count("retry_after"), 2)
+        self.assertEqual(self.count("failed"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
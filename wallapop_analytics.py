@@ -0,0 +1,195 @@
+import os
+import re
+import threading
+import zlib
+from datetime import datetime
+import numpy as np
+from wallapop_store import normalize_term
+
+# Columnas del histórico de una búsqueda, en el orden de la consulta al almacén
+HISTORY_DTYPE = np.dtype([
+    ("price_cents", np.int64),  # -1 si el anuncio no tenía precio
+    ("reserved", np.int8),
+    ("first_seen", np.float64),
+    ("last_seen", np.float64),
+])
+
+PERIODS = {"day": 86400, "week": 7 * 86400}
+PERIOD_NAMES = {"day": "día", "week": "semana"}
+
+
+def price_summary(prices_cents, reserved=None):
+    """Estadísticas de precios (en euros) de un array de céntimos.
+
+    Ignora los precios negativos (sin precio). Devuelve None si no queda
+    ningún precio.
+    """
+    prices = np.asarray(prices_cents, dtype=np.int64)
+    valid = prices[prices >= 0]
+    if valid.size == 0:
+        return None
+    p10, p25, median, p75, p90 = np.percentile(valid, [10, 25, 50, 75, 90]) / 100
+    summary = {
+        "count": int(valid.size),
+        "mean": float(valid.mean() / 100),
+        "median": float(median),
+        "p10": float(p10),
+        "p25": float(p25),
+        "p75": float(p75),
+        "p90": float(p90),
+        "min": float(valid.min() / 100),
+        "max": float(valid.max() / 100),
+    }
+    if reserved is not None:
+        reserved = np.asarray(reserved, dtype=bool)
+        summary["reserved_ratio"] = float(reserved.mean()) if reserved.size else 0.0
+    return summary
+
+
+def price_histogram(prices_cents, bins=8):
+    """Histograma de precios en euros entre los percentiles 1 y 99.
+
+    Recortar los extremos evita que un anuncio a 99.999€ deje todos los
+    demás en el primer tramo. Devuelve (cuentas, límites).
+    """
+    prices = np.asarray(prices_cents, dtype=np.int64)
+    valid = prices[prices >= 0] / 100
+    if valid.size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    low, high = np.percentile(valid, [1, 99])
+    if high <= low:
+        high = low + 1
+    return np.histogram(np.clip(valid, low, high), bins=bins, range=(low, high))
+
+
+def price_trend(prices_cents, first_seen, period="day", last=14):
+    """Mediana de precio y número de anuncios nuevos por periodo (día o semana).
+
+    Devuelve una lista de (inicio del periodo, anuncios, mediana en euros)
+    con los `last` periodos más recientes.
+    """
+    prices = np.asarray(prices_cents, dtype=np.int64)
+    seen = np.asarray(first_seen, dtype=np.float64)
+    mask = prices >= 0
+    prices, seen = prices[mask], seen[mask]
+    if prices.size == 0:
+        return []
+    seconds = PERIODS[period]
+    buckets = (seen // seconds).astype(np.int64)
+    order = np.argsort(buckets, kind="stable")
+    buckets, prices = buckets[order], prices[order]
+    starts, first_index, counts = np.unique(buckets, return_index=True, return_counts=True)
+    trend = []
+    for bucket, index, count in list(zip(starts, first_index, counts))[-last:]:
+        median = np.median(prices[index:index + count]) / 100
+        trend.append((float(bucket * seconds), int(count), float(median)))
+    return trend
+
+
+class PriceHistory:
+    """Histórico de precios por búsqueda como arrays de NumPy.
+
+    Los anuncios de una búsqueda son todos los que ha encontrado ese término
+    (item_terms), no sólo los que encontró primero. Se leen del ItemStore una
+    sola vez y se guardan en una caché columnar (un .npz por búsqueda) junto
+    a la versión de los datos: la última vez que se vio alguno de ellos.
+    Mientras ninguna ejecución los vuelva a ver, las consultas se resuelven
+    desde memoria o desde el .npz sin leer los anuncios de SQLite.
+    """
+
+    def __init__(self, store, cache_dir="analytics_cache"):
+        self.store = store
+        self.cache_dir = cache_dir
+        self._memory = {}  # término -> (versión, array)
+        self._reports = {}  # (término, periodo) -> (versión, informe)
+        self._lock = threading.Lock()
+
+    def _cache_path(self, search_term):
+        # El CRC distingue términos que dan el mismo slug ("PS5" y "ps5")
+        slug = re.sub(r'[^a-z0-9]+', '_', search_term.lower()).strip('_') or "busqueda"
+        digest = zlib.crc32(search_term.encode('utf-8'))
+        return os.path.join(self.cache_dir, f"{slug}_{digest:08x}.npz")
+
+    def load(self, search_term):
+        """Devuelve el array estructurado (HISTORY_DTYPE) con el histórico de la búsqueda"""
+        search_term = normalize_term(search_term)
+        version = self.store.data_version(search_term)
+        with self._lock:
+            cached = self._memory.get(search_term)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        path = self._cache_path(search_term)
+        data = None
+        try:
+            with np.load(path) as npz:
+                if float(npz["version"]) == version:
+                    data = npz["data"]
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            pass
+
+        if data is None:
+            data = np.fromiter(self.store.history_rows(search_term), dtype=HISTORY_DTYPE)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{path}.tmp.npz"
+            np.savez(tmp_path, data=data, version=np.float64(version))
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            self._memory[search_term] = (version, data)
+        return data
+
+    def report(self, search_term, period="day"):
+        """Resumen, histograma y tendencia de una búsqueda. None si no hay histórico.
+
+        El informe se recalcula sólo cuando cambia la versión de los datos.
+        """
+        search_term = normalize_term(search_term)
+        version = self.store.data_version(search_term)
+        with self._lock:
+            cached = self._reports.get((search_term, period))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        data = self.load(search_term)
+        summary = price_summary(data["price_cents"], data["reserved"])
+        report = None
+        if summary is not None:
+            report = {
+                "summary": summary,
+                "histogram": price_histogram(data["price_cents"]),
+                "trend": price_trend(data["price_cents"], data["first_seen"], period),
+                "period": period,
+            }
+        with self._lock:
+            self._reports[(search_term, period)] = (version, report)
+        return report
+
+
+def format_report(search_term, report, width=12):
+    """Texto del informe para mostrar en consola o en Telegram"""
+    summary = report["summary"]
+    lines = [
+        f"📊 Estadísticas de '{search_term}' ({summary['count']} anuncios)",
+        f"Mediana: {summary['median']:.2f}€ · Media: {summary['mean']:.2f}€",
+        f"P10–P90: {summary['p10']:.2f}€ – {summary['p90']:.2f}€",
+        f"P25–P75: {summary['p25']:.2f}€ – {summary['p75']:.2f}€",
+        f"Mínimo: {summary['min']:.2f}€ · Máximo: {summary['max']:.2f}€",
+        f"Reservados: {summary.get('reserved_ratio', 0):.0%}",
+    ]
+
+    counts, edges = report["histogram"]
+    if len(counts):
+        lines.append("")
+        lines.append("Distribución de precios:")
+        peak = max(int(counts.max()), 1)
+        for count, low, high in zip(counts, edges[:-1], edges[1:]):
+            bar = "█" * int(round(count / peak * width))
+            lines.append(f"{low:>8.0f}–{high:<8.0f}€ {bar} {count}")
+
+    if report["trend"]:
+        lines.append("")
+        lines.append(f"Anuncios nuevos y mediana por {PERIOD_NAMES[report['period']]}:")
+        for start, count, median in report["trend"]:
+            lines.append(f"{datetime.fromtimestamp(start).strftime('%d/%m')}: {count} · {median:.2f}€")
+    return "\n".join(lines)
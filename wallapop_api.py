@@ -0,0 +1,117 @@
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from wallapop_item import Item
+
+API_URL = "https://api.wallapop.com/api/v3/search"
+
+# Cabeceras que envía la web de Wallapop a su API de búsqueda
+API_HEADERS = {
+    "Accept": "application/json, text/plain, */*",
+    "Accept-Language": "es-ES,es;q=0.9",
+    "X-DeviceOS": "0",
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0 Safari/537.36",
+}
+
+_sessions = {}  # Con reintentos (True) y sin ellos (False)
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=None, retries=True):
+    """Devuelve la sesión HTTP compartida, con pool de conexiones y reintentos.
+
+    Con `retries=False` devuelve otra sesión compartida sin reintentos, para
+    peticiones con un tiempo máximo que la espera entre reintentos rebasaría.
+    """
+    with _session_lock:
+        if retries not in _sessions:
+            pool_size = pool_size or int(os.getenv('HTTP_POOL_SIZE', '32'))
+            retry = Retry(total=3 if retries else 0, backoff_factor=0.5,
+                          status_forcelist=(429, 500, 502, 503, 504))
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+            session = requests.Session()
+            session.headers.update(API_HEADERS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[retries] = session
+        return _sessions[retries]
+
+
+class WallapopApiClient:
+    """Cliente de la API JSON de búsqueda de Wallapop (sin navegador)"""
+
+    def __init__(self, api_url=None, base_url="https://es.wallapop.com", session=None, timeout=15):
+        self.api_url = api_url or os.getenv('WALLAPOP_API_URL', API_URL)
+        self.base_url = base_url
+        self.session = session or get_session()
+        self.timeout = timeout
+        self.requests_made = 0
+        self.next_page = None  # Cursor de la página siguiente a la última devuelta
+
+    def _get(self, params):
+        response = self.session.get(self.api_url, params=params, timeout=self.timeout)
+        self.requests_made += 1
+        response.raise_for_status()
+        return response
+
+    def search_pages(self, params, max_pages=None, cursor=None):
+        """Recorre las páginas de resultados siguiendo el cursor de paginación.
+
+        Devuelve un generador de listas de items en bruto, una por página. Con
+        `cursor` continúa desde esa página en lugar de empezar desde el principio.
+        """
+        response = self._get({"next_page": cursor} if cursor else params)
+        pages = 0
+        while True:
+            payload = response.json()
+            self.next_page = self._next_page(payload, response)
+            yield self._items(payload)
+            pages += 1
+
+            if not self.next_page or (max_pages is not None and pages >= max_pages):
+                return
+            response = self._get({"next_page": self.next_page})
+
+    def _items(self, payload):
+        """Extrae los items de la respuesta (formato actual y formato antiguo)"""
+        if "search_objects" in payload:
+            return payload["search_objects"] or []
+        data = payload.get("data") or {}
+        section = data.get("section") or {}
+        return (section.get("payload") or {}).get("items") or []
+
+    def _next_page(self, payload, response):
+        """Devuelve el cursor de la página siguiente, si lo hay"""
+        meta = payload.get("meta") or {}
+        return meta.get("next_page") or response.headers.get("X-NextPage")
+
+    def to_product(self, raw):
+        """Convierte un item de la API en un Item, como extract_product_info"""
+        title = (raw.get("title") or "").strip()
+        slug = raw.get("web_slug")
+        if not title or not slug:
+            return None
+
+        price = raw.get("price")
+        if isinstance(price, dict):
+            price = price.get("amount")
+
+        location = raw.get("location") or {}
+        city = location.get("city") or "Ubicación no disponible"
+
+        reserved = raw.get("reserved")
+        if isinstance(reserved, dict):
+            reserved = reserved.get("flag")
+        if reserved is None:
+            reserved = (raw.get("flags") or {}).get("reserved", False)
+
+        return Item(
+            title=title,
+            price_cents=round(float(price) * 100) if price is not None else None,
+            location=city,
+            link=f"{self.base_url}/item/{slug}",
+            reserved=bool(reserved),
+            modified_at=raw.get("modified_at") or raw.get("modification_date")
+        )
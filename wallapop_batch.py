@@ -0,0 +1,140 @@
+import copy
+import csv
+import json
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from multiprocessing.util import Finalize
+from wallapop_tracker import build_scraper
+from wallapop_pool import DriverPool
+from wallapop_blocking import BlockProfile
+from wallapop_item import CSV_FIELDS, DETAIL_FIELDS, SEARCH_LOCATION_FIELD
+from wallapop_output import FORMATS, to_buffer
+from wallapop_locations import split_locations
+
+# Navegador propio de cada proceso trabajador, reutilizado entre sus consultas
+_worker_pool = None
+
+
+def load_queries(path):
+    """Lee las consultas de un fichero CSV, JSONL o de texto (un término por línea).
+
+    Cada consulta es un diccionario con search_term y, opcionalmente,
+    location, price_min y price_max.
+    """
+    with open(path, encoding='utf-8') as f:
+        if path.endswith('.jsonl'):
+            queries = [json.loads(line) for line in f if line.strip()]
+        elif path.endswith('.csv'):
+            queries = list(csv.DictReader(f))
+        else:
+            queries = [{"search_term": line.strip()} for line in f
+                       if line.strip() and not line.startswith('#')]
+
+    for query in queries:
+        query.setdefault("search_term", query.pop("term", None))
+        for field in ("price_min", "price_max"):
+            value = query.get(field)
+            query[field] = float(value) if value not in (None, "") else None
+        if not query.get("location"):
+            query["location"] = None
+    return [query for query in queries if query["search_term"]]
+
+
+def _init_worker(block_profile, allowed_domains):
+    """Crea el pool de un solo navegador del proceso trabajador"""
+    global _worker_pool
+    # Ctrl+C lo gestiona el proceso principal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_pool = DriverPool(size=1, block_profile=BlockProfile.from_name(block_profile, allowed_domains))
+    # Los procesos de multiprocessing no ejecutan atexit; Finalize sí se ejecuta al salir
+    Finalize(_worker_pool, _worker_pool.close, exitpriority=10)
+
+
+def _run_query(args, query):
+    """Ejecuta una consulta en el proceso trabajador. Devuelve (consulta, items, segundos, error)"""
+    query_args = copy.copy(args)
+    query_args.search_term = query["search_term"]
+    query_args.location = query["location"] or args.location
+    query_args.price_min = query["price_min"] if query["price_min"] is not None else args.price_min
+    query_args.price_max = query["price_max"] if query["price_max"] is not None else args.price_max
+    query_args.stream = None
+
+    started = time.monotonic()
+    scraper = build_scraper(query_args)
+    scraper.pool = _worker_pool
+    try:
+        for _ in scraper.iter_scrape():
+            pass
+        if scraper.enrich:
+            scraper.enrich_results()
+        error = None
+    except Exception as e:
+        error = str(e)
+    return query, scraper.results, time.monotonic() - started, error
+
+
+def run_batch(args):
+    """Ejecuta en paralelo todas las consultas del fichero de lote, un navegador por proceso"""
+    queries = load_queries(args.batch)
+    if not queries:
+        print("No hay consultas en el fichero de lote")
+        return
+
+    workers = max(1, min(args.workers, len(queries)))
+    os.makedirs(args.save_dir, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    print(f"→ Lote de {len(queries)} consultas con {workers} procesos")
+
+    combined = None
+    combined_writer = None
+    if args.batch_output == "combined":
+        path = os.path.join(args.save_dir, f"wallapop_lote_{timestamp}.csv")
+        combined = open(path, 'w', newline='', encoding='utf-8')
+        combined_writer = csv.writer(combined)
+        combined_writer.writerow(
+            ("query", SEARCH_LOCATION_FIELD) + CSV_FIELDS + (DETAIL_FIELDS if args.enrich else ())
+        )
+
+    started = time.monotonic()
+    total_items = 0
+    failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(args.block_profile, args.allow_domain)) as executor:
+            futures = [executor.submit(_run_query, args, query) for query in queries]
+            for done, future in enumerate(as_completed(futures), 1):
+                query, items, elapsed, error = future.result()
+                location = query["location"] or args.location
+                total_items += len(items)
+                if error:
+                    failed += 1
+                    print(f"\n✗ [{done}/{len(queries)}] '{query['search_term']}': {error}")
+                else:
+                    print(f"\n✓ [{done}/{len(queries)}] '{query['search_term']}': {len(items)} productos en {elapsed:.1f}s")
+
+                if combined_writer is not None:
+                    # Con varias ubicaciones en la consulta, cada producto lleva la suya
+                    combined_writer.writerows(
+                        (query["search_term"], item.search_location or location) + item.as_row()
+                        + (item.detail_row() if args.enrich else ())
+                        for item in items
+                    )
+                    combined.flush()
+                elif items:
+                    locations = "-".join(split_locations(location))
+                    name = f"wallapop_{query['search_term']}_{locations}_{timestamp}.{FORMATS[args.format]}"
+                    with open(os.path.join(args.save_dir, name), 'wb') as f:
+                        f.write(to_buffer(items, args.format).getvalue())
+    finally:
+        if combined is not None:
+            combined.close()
+            print(f"\n✓ Resultados guardados en: {combined.name}")
+
+    elapsed = time.monotonic() - started
+    print(f"\n✓ Lote completado en {elapsed:.1f}s")
+    print(f"  - Consultas: {len(queries)} ({failed} con error)")
+    print(f"  - Productos: {total_items}")
+    print(f"  - Rendimiento: {total_items / elapsed:.1f} productos/s, {len(queries) / elapsed * 60:.1f} consultas/min")
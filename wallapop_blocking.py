@@ -0,0 +1,126 @@
+import json
+from collections import Counter
+
+# Patrones de URL por tipo de recurso (comodines de Network.setBlockedURLs).
+# El '*' final cubre las URLs con parámetros ("foto.jpg?w=300").
+RESOURCE_PATTERNS = {
+    "images": ["*.png*", "*.jpg*", "*.jpeg*", "*.gif*", "*.webp*", "*.avif*", "*.svg*", "*.ico*"],
+    "fonts": ["*.woff*", "*.woff2*", "*.ttf*", "*.otf*", "*.eot*"],
+    "media": ["*.mp4*", "*.webm*", "*.mp3*", "*.m3u8*", "*.ogg*"],
+}
+
+# Dominios de analítica, publicidad y seguimiento que no aportan nada al scraping
+TRACKING_DOMAINS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googletagservices.com",
+    "doubleclick.net",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "adservice.google.com",
+    "connect.facebook.net",
+    "facebook.com/tr",
+    "analytics.tiktok.com",
+    "bat.bing.com",
+    "hotjar.com",
+    "segment.io",
+    "criteo.com",
+    "criteo.net",
+    "taboola.com",
+    "amazon-adsystem.com",
+    "adnxs.com",
+    "pubmatic.com",
+    "rubiconproject.com",
+    "smartadserver.com",
+    "scorecardresearch.com",
+    "quantserve.com",
+    "branch.io",
+]
+
+# Nunca bloquear por dominio el diálogo de cookies: sin él no se puede aceptar el consentimiento
+DEFAULT_ALLOWED = ["cookielaw.org", "onetrust.com"]
+
+PROFILES = {
+    "none": ([], False),
+    "minimal": (["images", "fonts", "media"], False),
+    "aggressive": (["images", "fonts", "media"], True),
+}
+
+
+class BlockProfile:
+    """Perfil de bloqueo de recursos aplicado al navegador mediante CDP.
+
+    Bloquea por tipo de recurso (según la extensión de la URL) y por dominio.
+    La lista de permitidos sólo exime dominios del bloqueo por dominio:
+    Network.setBlockedURLs no admite excepciones, así que los patrones por
+    tipo (imágenes, fuentes, vídeo) se siguen aplicando a los dominios
+    permitidos.
+    """
+
+    def __init__(self, resource_types=(), block_tracking=False, extra_domains=(), allowed_domains=()):
+        self.resource_types = list(resource_types)
+        self.block_tracking = block_tracking
+        self.extra_domains = list(extra_domains)
+        self.allowed_domains = DEFAULT_ALLOWED + list(allowed_domains)
+
+    @classmethod
+    def from_name(cls, name, allowed_domains=()):
+        resource_types, block_tracking = PROFILES[name]
+        return cls(resource_types, block_tracking, allowed_domains=allowed_domains)
+
+    def _allowed(self, domain):
+        return any(domain == allowed or domain.endswith("." + allowed) for allowed in self.allowed_domains)
+
+    def url_patterns(self):
+        """Patrones para Network.setBlockedURLs"""
+        patterns = []
+        for resource_type in self.resource_types:
+            patterns.extend(RESOURCE_PATTERNS[resource_type])
+        domains = (TRACKING_DOMAINS if self.block_tracking else []) + self.extra_domains
+        for domain in domains:
+            if not self._allowed(domain.split("/")[0]):
+                patterns.append(f"*://*.{domain}*")
+                patterns.append(f"*://{domain}*")
+        return patterns
+
+    def apply(self, driver):
+        """Activa el bloqueo en el navegador (persiste entre navegaciones)"""
+        patterns = self.url_patterns()
+        if not patterns:
+            return
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+
+
+def drain_network_log(driver):
+    """Descarta el registro de red acumulado (p. ej. de un uso anterior del navegador)"""
+    try:
+        driver.get_log("performance")
+    except Exception:
+        pass
+
+
+def network_stats(driver):
+    """Resume el registro de red desde la última lectura.
+
+    Devuelve peticiones totales, peticiones bloqueadas (total y por tipo) y
+    bytes transferidos. El tamaño de lo bloqueado no se puede conocer porque
+    nunca llega a descargarse.
+    """
+    stats = {"requests": 0, "blocked": 0, "blocked_by_type": Counter(), "bytes": 0}
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return stats
+    for entry in entries:
+        message = json.loads(entry["message"])["message"]
+        method = message.get("method")
+        params = message.get("params", {})
+        if method == "Network.requestWillBeSent":
+            stats["requests"] += 1
+        elif method == "Network.loadingFinished":
+            stats["bytes"] += int(params.get("encodedDataLength", 0))
+        elif method == "Network.loadingFailed" and params.get("blockedReason"):
+            stats["blocked"] += 1
+            stats["blocked_by_type"][params.get("type", "Other")] += 1
+    return stats
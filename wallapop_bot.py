@@ -1,11 +1,26 @@
 import os
+import re
 import logging
 from telegram import Update
 from telegram.constants import ParseMode
+from telegram.error import TelegramError
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackContext
 from dotenv import load_dotenv
 from wallapop_tracker import WallapopScraper
+from wallapop_pool import DriverPool
+from wallapop_blocking import BlockProfile
+from wallapop_store import ItemStore
+from wallapop_cache import SearchCache, search_key
+from wallapop_watch import Watch, WatchManager
+from wallapop_item import format_cents
+from wallapop_locations import resolve_location, split_locations
+from wallapop_metrics import REGISTRY, serve_metrics
+from wallapop_output import FORMATS, to_buffer
+from wallapop_analytics import PriceHistory, format_report
+from wallapop_dispatcher import TelegramDispatcher, INTERACTIVE, PROGRESS
+from wallapop_scheduler import SearchScheduler, QueueFullError, JobCancelledError, JobTimeoutError, max_concurrent_for_memory
 import asyncio
+import threading
 from datetime import datetime
 
 # Configurar logging
@@ -18,10 +33,68 @@ logger = logging.getLogger(__name__)
 # Cargar variables de entorno
 load_dotenv()
 TOKEN = os.getenv('TELEGRAM_TOKEN')
+DRIVER_POOL_SIZE = int(os.getenv('DRIVER_POOL_SIZE', '2'))
+DRIVER_MAX_USES = int(os.getenv('DRIVER_MAX_USES', '20'))
+SEARCH_BACKEND = os.getenv('SEARCH_BACKEND', 'browser')
+BLOCK_PROFILE = os.getenv('BLOCK_PROFILE', 'aggressive')
+MAX_SEARCHES_PER_USER = int(os.getenv('MAX_SEARCHES_PER_USER', '2'))
+SEARCH_TIMEOUT = int(os.getenv('SEARCH_TIMEOUT', '300'))
+# El scraping se corta un poco antes del timeout del planificador para entregar lo reunido
+SEARCH_DEADLINE = SEARCH_TIMEOUT * 0.9
+PHASE_TIMEOUT = float(os.getenv('PHASE_TIMEOUT', '30'))  # Máximo por carga de página, espera o petición
+BROWSER_MEMORY_MB = int(os.getenv('BROWSER_MEMORY_MB', '400'))
+# Vaciar las tarjetas ya extraídas para que la memoria del navegador no crezca en búsquedas largas
+PRUNE_DOM = os.getenv('PRUNE_DOM', 'false').lower() in ('1', 'true', 'yes')
+CACHE_TTL = int(os.getenv('CACHE_TTL', '600'))
+CACHE_SIZE = int(os.getenv('CACHE_SIZE', '256'))
+WALLAPOP_DB = os.getenv('WALLAPOP_DB', 'wallapop.db')
+ANALYTICS_CACHE_DIR = os.getenv('ANALYTICS_CACHE_DIR', 'analytics_cache')
+ENRICH_DETAILS = os.getenv('ENRICH_DETAILS', 'false').lower() in ('1', 'true', 'yes')  # Páginas de detalle
+ENRICH_WORKERS = int(os.getenv('ENRICH_WORKERS', '8'))
+DETAILS_DB = os.getenv('DETAILS_DB', 'wallapop_details.db')
+WATCH_INTERVAL = int(os.getenv('WATCH_INTERVAL', '900'))
+WATCH_JITTER = float(os.getenv('WATCH_JITTER', '0.2'))
+WATCH_MAX_SCROLLS = int(os.getenv('WATCH_MAX_SCROLLS', '2'))
+# Seguimientos por novedad: paran al llegar a anuncios ya vistos por el grupo. Son más baratos,
+# pero no vuelven a ver los anuncios antiguos y se pierden sus bajadas de precio
+WATCH_NEWEST_FIRST = os.getenv('WATCH_NEWEST_FIRST', 'false').lower() in ('1', 'true', 'yes')
+WATCH_MAX_ITEMS = 10  # Máximo de anuncios por notificación
+FILTER_MAX_RESULTS = 15  # Anuncios por respuesta de /filtrar
+PROGRESS_INTERVAL = 3  # Segundos entre actualizaciones del progreso de una búsqueda
+FIRST_MATCHES = 5  # Resultados que se adelantan mientras la búsqueda sigue en marcha
+RESULT_FORMAT = os.getenv('RESULT_FORMAT', 'csv')  # csv, csv.gz, jsonl o parquet
+SAVE_RESULTS = os.getenv('SAVE_RESULTS', 'false').lower() in ('1', 'true', 'yes')  # Guardar también en disco
+RESULTS_DIR = os.getenv('RESULTS_DIR', 'resultados')
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))  # 0 desactiva el endpoint /metrics
+# Límites de envío a Telegram: mensajes por segundo en total y por chat privado
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', '25'))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', '0.9'))
+
+# Pool de navegadores compartido entre búsquedas
+driver_pool = None
+# Planificador que limita y reparte las búsquedas entre usuarios
+scheduler = None
+# Caché de resultados compartida entre usuarios
+search_cache = SearchCache(ttl=CACHE_TTL, max_entries=CACHE_SIZE)
+# Almacén persistente de anuncios vistos
+item_store = None
+# Seguimientos periódicos de búsquedas
+watch_manager = None
+# Histórico de precios por búsqueda para /estadisticas
+price_history = None
+# Cola de salida hacia Telegram con los límites de envío
+dispatcher = None
 
 # Diccionario para almacenar las búsquedas activas
 active_searches = {}
 
+async def reply(update, text, priority=INTERACTIVE, **kwargs):
+    """Responde en el chat del mensaje a través del dispatcher, respetando los límites de Telegram"""
+    if update.effective_chat.type != "private":
+        kwargs.setdefault("reply_to_message_id", update.message.message_id)
+    return await dispatcher.send_message(update.effective_chat.id, text, priority=priority, **kwargs)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /start - Introduce el bot"""
     welcome_message = """
@@ -34,7 +107,7 @@ Puedo ayudarte a encontrar productos en Wallapop. Aquí tienes algunos ejemplos
 3. Ver ayuda: /help
 4. Detener bot: /stop
 """
-    await update.message.reply_text(welcome_message)
+    await reply(update, welcome_message)
 
 async def help_command(update: Update, context: CallbackContext) -> None:
     """Envía un mensaje con los comandos disponibles."""
@@ -43,161 +116,577 @@ async def help_command(update: Update, context: CallbackContext) -> None:
 
 /buscar (término) - Busca productos en Wallapop
 /max_scrolls (número) - Configura el número máximo de scrolls (1-10)
+/ubicacion (ciudad, ciudad...) - Una o varias ubicaciones donde buscar
+/modo (browser|http) - Elige el motor de búsqueda
+/formato (csv|csv.gz|jsonl|parquet) - Elige el formato del fichero de resultados
+/seguir (término) - Avisa de anuncios nuevos y bajadas de precio
+/dejar_de_seguir (término) - Deja de seguir una búsqueda
+/seguimientos - Lista tus seguimientos
+/cancelar - Cancela tus búsquedas en cola o en curso
+/estadisticas (término) - Estadísticas de precios del histórico de una búsqueda
+/filtrar (palabras) - Busca en los anuncios de tu última búsqueda, sin volver a buscar en Wallapop (añade "todos" para buscar en todos los guardados)
+/estado - Muestra las búsquedas en curso y el uso de la caché
 /stop - Detiene el bot de forma segura
 /help - Muestra esta ayuda
 
 *Ejemplos:*
 `/buscar iphone 12 max`
 `/max_scrolls 5`
+`/filtrar 256gb -roto <400 disponibles`
     """
-    await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN_V2)
+    await reply(update, help_text, parse_mode=ParseMode.MARKDOWN_V2)
 
 async def set_min_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /precio_min - Establece el precio mínimo"""
     user_id = update.effective_user.id
     if not context.args:
-        await update.message.reply_text("Por favor, especifica un precio mínimo. Ejemplo: /precio_min 100")
+        await reply(update, "Por favor, especifica un precio mínimo. Ejemplo: /precio_min 100")
         return
     
     try:
         price = float(context.args[0])
         if price < 0:
-            await update.message.reply_text("El precio no puede ser negativo.")
+            await reply(update, "El precio no puede ser negativo.")
             return
         
         if user_id not in active_searches:
             active_searches[user_id] = {}
         active_searches[user_id]['price_min'] = price
-        await update.message.reply_text(f"Precio mínimo establecido a {price}€")
+        await reply(update, f"Precio mínimo establecido a {price}€")
     except ValueError:
-        await update.message.reply_text("Por favor, introduce un número válido.")
+        await reply(update, "Por favor, introduce un número válido.")
 
 async def set_max_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /precio_max - Establece el precio máximo"""
     user_id = update.effective_user.id
     if not context.args:
-        await update.message.reply_text("Por favor, especifica un precio máximo. Ejemplo: /precio_max 500")
+        await reply(update, "Por favor, especifica un precio máximo. Ejemplo: /precio_max 500")
         return
     
     try:
         price = float(context.args[0])
         if price < 0:
-            await update.message.reply_text("El precio no puede ser negativo.")
+            await reply(update, "El precio no puede ser negativo.")
             return
         
         if user_id not in active_searches:
             active_searches[user_id] = {}
         active_searches[user_id]['price_max'] = price
-        await update.message.reply_text(f"Precio máximo establecido a {price}€")
+        await reply(update, f"Precio máximo establecido a {price}€")
     except ValueError:
-        await update.message.reply_text("Por favor, introduce un número válido.")
+        await reply(update, "Por favor, introduce un número válido.")
 
 async def set_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /ubicacion - Establece la ubicación"""
     user_id = update.effective_user.id
     if not context.args:
-        await update.message.reply_text("Por favor, especifica una ubicación. Ejemplo: /ubicacion barcelona")
+        await reply(update, "Por favor, especifica una ubicación. Ejemplo: /ubicacion barcelona")
         return
     
     location = ' '.join(context.args)
+    locations = split_locations(location)
+    unknown = [name for name in locations if resolve_location(name) is None]
+    if not locations or unknown:
+        await reply(update,
+            f"⚠️ No conozco la ubicación '{unknown[0] if unknown else location}'. "
+            "Prueba con una ciudad o provincia, o con coordenadas 'lat,lon'."
+        )
+        return
     if user_id not in active_searches:
         active_searches[user_id] = {}
-    active_searches[user_id]['location'] = location
-    await update.message.reply_text(f"Ubicación establecida a: {location}")
+    active_searches[user_id]['location'] = ', '.join(locations)
+    if len(locations) > 1:
+        await reply(update,
+            f"Ubicaciones establecidas: {', '.join(locations)}. Se buscará en todas a la vez y "
+            "los resultados se combinarán ordenados por precio."
+        )
+    else:
+        await reply(update, f"Ubicación establecida a: {location}")
 
 async def set_max_scrolls(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /max_scrolls - Establece el número máximo de scrolls"""
     user_id = update.effective_user.id
     if not context.args:
-        await update.message.reply_text("Por favor, especifica el número máximo de scrolls (1-10). Ejemplo: /max_scrolls 5")
+        await reply(update, "Por favor, especifica el número máximo de scrolls (1-10). Ejemplo: /max_scrolls 5")
         return
     
     try:
         max_scrolls = int(context.args[0])
         if max_scrolls < 1 or max_scrolls > 10:
-            await update.message.reply_text("El número de scrolls debe estar entre 1 y 10.")
+            await reply(update, "El número de scrolls debe estar entre 1 y 10.")
             return
             
         if user_id not in active_searches:
             active_searches[user_id] = {}
         active_searches[user_id]['max_scrolls'] = max_scrolls
-        await update.message.reply_text(f"✅ Número máximo de scrolls establecido en: {max_scrolls}")
+        await reply(update, f"✅ Número máximo de scrolls establecido en: {max_scrolls}")
     except ValueError:
-        await update.message.reply_text("❌ Por favor, introduce un número válido.")
+        await reply(update, "❌ Por favor, introduce un número válido.")
+
+async def set_backend(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /modo - Elige el motor de búsqueda (browser o http)"""
+    user_id = update.effective_user.id
+    if not context.args or context.args[0].lower() not in ('browser', 'http'):
+        await reply(update, "Por favor, especifica un modo: browser o http. Ejemplo: /modo http")
+        return
+
+    backend = context.args[0].lower()
+    if user_id not in active_searches:
+        active_searches[user_id] = {}
+    active_searches[user_id]['backend'] = backend
+    await reply(update, f"✅ Modo de búsqueda establecido a: {backend}")
+
+async def set_format(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /formato - Elige el formato del fichero de resultados"""
+    user_id = update.effective_user.id
+    if not context.args or context.args[0].lower() not in FORMATS:
+        await reply(update,
+            f"Por favor, especifica un formato: {', '.join(FORMATS)}. Ejemplo: /formato jsonl"
+        )
+        return
+
+    fmt = context.args[0].lower()
+    if user_id not in active_searches:
+        active_searches[user_id] = {}
+    active_searches[user_id]['format'] = fmt
+    await reply(update, f"✅ Formato de resultados establecido a: {fmt}")
+
+def persist_results(user_id, search_term, data, fmt):
+    """Guarda en disco una copia de los resultados ya serializados. Devuelve la ruta"""
+    directory = os.path.join(RESULTS_DIR, str(user_id))
+    os.makedirs(directory, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(directory, f"wallapop_{search_term}_{timestamp}.{FORMATS[fmt]}")
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+class SearchProgress:
+    """Informa al usuario del avance de una búsqueda mientras se ejecuta.
+
+    Actualiza periódicamente el mensaje de estado con los productos encontrados
+    y envía los primeros resultados en cuanto aparecen.
+    """
+
+    def __init__(self, update, status_message, search_term):
+        self.update = update
+        self.status_message = status_message
+        self.search_term = search_term
+        self.found = 0
+        self.first_matches = []
+        self._shown = 0
+        self._sent_first = False
+        self._first_found = asyncio.Event()
+
+    def add(self, product):
+        self.found += 1
+        if len(self.first_matches) < FIRST_MATCHES:
+            self.first_matches.append(product)
+        self._first_found.set()
+
+    async def run(self):
+        # Los primeros resultados se envían en cuanto llegan; luego, el progreso cada cierto tiempo
+        await self._first_found.wait()
+        while True:
+            await self.refresh()
+            await asyncio.sleep(PROGRESS_INTERVAL)
+
+    async def refresh(self):
+        try:
+            if not self._sent_first and self.first_matches:
+                self._sent_first = True
+                lines = [f"✨ Primeros resultados para '{self.search_term}':"]
+                for product in self.first_matches:
+                    lines.append(f"• {product.title} - {product.price}€\n{product.link}")
+                await reply(self.update, "\n\n".join(lines), priority=PROGRESS, disable_web_page_preview=True)
+            if self.found != self._shown:
+                self._shown = self.found
+                await dispatcher.edit_message_text(
+                    self.status_message.chat_id, self.status_message.message_id,
+                    f"🔍 Buscando: {self.search_term}... {self.found} productos encontrados"
+                )
+        except TelegramError as e:
+            logger.warning(f"No se pudo actualizar el progreso: {str(e)}")
 
 async def search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Comando /buscar - Inicia una búsqueda en Wallapop"""
     user_id = update.effective_user.id
     
     if not context.args:
-        await update.message.reply_text("Por favor, especifica qué quieres buscar. Ejemplo: /buscar iphone")
+        await reply(update, "Por favor, especifica qué quieres buscar. Ejemplo: /buscar iphone")
         return
     
     search_term = ' '.join(context.args)
-    await update.message.reply_text(f"🔍 Buscando: {search_term}...")
+    status_message = await reply(update, f"🔍 Buscando: {search_term}...")
     
     # Obtener configuración del usuario
     user_config = active_searches.get(user_id, {})
     location = user_config.get('location', 'madrid')
     price_min = user_config.get('price_min', None)
     price_max = user_config.get('price_max', None)
+    max_scrolls = user_config.get('max_scrolls', 3)  # Usar valor configurado o 3 por defecto
+    backend = user_config.get('backend', SEARCH_BACKEND)
+    outcome = {}  # Lo rellena run_scrape: si la búsqueda terminó completa
     
-    try:
+    async def run_scrape():
+        """Lanza el scraping a través del planificador y devuelve los resultados"""
         # Configurar el scraper
         scraper = WallapopScraper(
             search_term=search_term,
-            location=location
+            location=location,
+            pool=driver_pool
         )
         
         # Configurar opciones adicionales después de crear la instancia
         scraper.headless = True
-        scraper.max_scrolls = user_config.get('max_scrolls', 3)  # Usar valor configurado o 3 por defecto
-        scraper.save_directory = f"resultados_{user_id}"
+        scraper.max_scrolls = max_scrolls
         scraper.load_images = False
         scraper.price_min = price_min
         scraper.price_max = price_max
         scraper.debug = False  # Desactivar modo debug para mayor velocidad
+        scraper.backend = backend
+        scraper.store = item_store
+        scraper.deadline = SEARCH_DEADLINE
+        scraper.phase_timeout = PHASE_TIMEOUT
+        scraper.prune_dom = PRUNE_DOM
+        scraper.enrich_workers = ENRICH_WORKERS
+        scraper.detail_cache_path = DETAILS_DB
         
-        # Ejecutar búsqueda en un thread separado
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, scraper.scrape)
+        # Consumir el scraping en el hilo del planificador, pasando cada producto al bucle de eventos
+        progress = SearchProgress(update, status_message, search_term)
+        loop = asyncio.get_running_loop()
+
+        def consume():
+            for product in scraper.iter_scrape():
+                loop.call_soon_threadsafe(progress.add, product)
+            if ENRICH_DETAILS and not scraper.stopped:
+                scraper.enrich_results()
+
+        # Encolar la búsqueda en el planificador
+        job = scheduler.submit(user_id, consume, on_cancel=scraper.stop)
+
+        position = scheduler.position(job)
+        if position:
+            await reply(update,
+                f"⏳ Tu búsqueda está en cola (posición {position}). Usa /cancelar para cancelarla."
+            )
+            await job.started.wait()
+            if job.state == "running":
+                await reply(update, f"🔍 Empezando la búsqueda: {search_term}...")
+
+        progress_task = asyncio.create_task(progress.run())
+        try:
+            await job.wait()
+        finally:
+            progress_task.cancel()
+        # Cortada por el plazo o por una fase lenta, o con ubicaciones fallidas: no es completa
+        outcome['complete'] = not (scraper.stopped or scraper.stop_reason or scraper.failed_locations)
+        return scraper.results
+
+    try:
+        # Búsquedas idénticas recientes o en curso comparten el mismo scraping
+        key = search_key(search_term, location, price_min, price_max, max_scrolls, backend)
+        try:
+            # Los resultados parciales se entregan a quien los pidió, pero no se guardan en la caché
+            results = await search_cache.get_or_compute(
+                key, run_scrape, cacheable=lambda results: outcome.get('complete', False)
+            )
+        except QueueFullError:
+            await reply(update,
+                f"⏳ Ya tienes {scheduler.per_user_limit} búsquedas en marcha. Espera a que terminen o usa /cancelar."
+            )
+            return
+        except JobCancelledError:
+            await reply(update, f"🛑 Búsqueda cancelada: {search_term}")
+            return
+        except JobTimeoutError:
+            await reply(update,
+                f"⌛ La búsqueda '{search_term}' tardó demasiado y se detuvo. Prueba con menos scrolls."
+            )
+            return
+        logger.info(f"Caché de búsquedas: {search_cache.stats()}")
+        # /filtrar busca por defecto entre los resultados de esta búsqueda
+        active_searches.setdefault(user_id, {})['last_search'] = search_term
         
         # Enviar resultados
-        if scraper.results:
-            # Guardar resultados en CSV
-            csv_file = scraper.save_results()
-            
-            if csv_file and os.path.exists(csv_file):
-                # Enviar archivo CSV
-                await update.message.reply_text(f"✅ Búsqueda completada! Encontrados: {len(scraper.results)} productos")
-                await update.message.reply_document(
-                    document=open(csv_file, 'rb'),
-                    filename=f"wallapop_{search_term}.csv",
-                    caption=f"📊 Resultados de la búsqueda: {search_term}"
-                )
-            else:
-                await update.message.reply_text("❌ Error al generar el archivo CSV")
+        if results:
+            # Serializar en memoria y enviar el buffer directamente, sin ficheros temporales
+            fmt = user_config.get('format', RESULT_FORMAT)
+            try:
+                buffer = await asyncio.to_thread(to_buffer, results, fmt)
+            except ImportError as e:
+                logger.error(f"No se pudo generar el fichero {fmt}: {str(e)}")
+                await reply(update, f"❌ El formato {fmt} no está disponible. Prueba con /formato csv")
+                return
+            if SAVE_RESULTS:
+                await asyncio.to_thread(persist_results, user_id, search_term, buffer.getvalue(), fmt)
+
+            await reply(update, f"✅ Búsqueda completada! Encontrados: {len(results)} productos")
+            await dispatcher.send_document(
+                update.effective_chat.id,
+                buffer,
+                filename=f"wallapop_{search_term}.{FORMATS[fmt]}",
+                caption=f"📊 Resultados de la búsqueda: {search_term}"
+            )
         else:
-            await update.message.reply_text("❌ No se encontraron productos que coincidan con tu búsqueda.")
+            await reply(update, "❌ No se encontraron productos que coincidan con tu búsqueda.")
             
     except Exception as e:
         logger.error(f"Error durante la búsqueda: {str(e)}")
-        await update.message.reply_text("❌ Ocurrió un error durante la búsqueda. Por favor, intenta de nuevo más tarde.")
+        await reply(update, "❌ Ocurrió un error durante la búsqueda. Por favor, intenta de nuevo más tarde.")
+
+async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /estado - Muestra la carga del bot y el uso de la caché"""
+    stats = search_cache.stats()
+    await reply(update,
+        f"📈 Búsquedas en curso: {scheduler.active}\n"
+        f"⏳ Búsquedas en cola: {scheduler.queue_depth}\n"
+        f"🗂 Caché: {stats['hits']} aciertos, {stats['misses']} fallos, "
+        f"{stats['coalesced']} agrupadas, {stats['entries']} entradas"
+    )
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /estadisticas - Estadísticas de precios del histórico de una búsqueda"""
+    if not context.args:
+        await reply(update, "Por favor, especifica una búsqueda. Ejemplo: /estadisticas iphone 12")
+        return
+
+    search_term = ' '.join(context.args)
+    report = await asyncio.to_thread(price_history.report, search_term)
+    if report is None:
+        await reply(update,
+            f"No hay histórico de '{search_term}'. Usa /buscar {search_term} o /seguir {search_term} para empezar a acumularlo."
+        )
+        return
+    await reply(update, format_report(search_term, report))
+
+def parse_filter_args(args):
+    """Separa de /filtrar los límites de precio ("<400", ">100"), "disponibles" y "todos" del texto a buscar"""
+    words, price_min, price_max, available, everything = [], None, None, False, False
+    for arg in args:
+        match = re.fullmatch(r'([<>])(\d+(?:[.,]\d+)?)€?', arg)
+        if match:
+            value = float(match.group(2).replace(',', '.'))
+            if match.group(1) == '<':
+                price_max = value
+            else:
+                price_min = value
+        elif arg.lower() == 'disponibles':
+            available = True
+        elif arg.lower() == 'todos':
+            everything = True
+        else:
+            words.append(arg)
+    return ' '.join(words), price_min, price_max, available, everything
+
+async def filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /filtrar - Busca en el índice local de anuncios ya vistos, sin hacer scraping.
+
+    Por defecto sólo mira los anuncios de la última /buscar del usuario; con
+    "todos", en todo el almacén (búsquedas de otros usuarios y seguimientos).
+    """
+    if not context.args:
+        await reply(update,
+            "Por favor, indica qué buscar entre los anuncios ya encontrados. Ejemplo: /filtrar 256gb -roto <400 disponibles"
+        )
+        return
+
+    user_config = active_searches.get(update.effective_user.id, {})
+    text, price_min, price_max, available, everything = parse_filter_args(context.args)
+    if not text:
+        await reply(update, "Indica al menos una palabra. Ejemplo: /filtrar 256gb -roto <400")
+        return
+    search_term = None if everything else user_config.get('last_search')
+    if search_term is None and not everything:
+        await reply(update,
+            "Aún no has hecho ninguna búsqueda. Usa /buscar primero o añade \"todos\" para filtrar "
+            "entre todos los anuncios guardados."
+        )
+        return
+    if price_min is None:
+        price_min = user_config.get('price_min')
+    if price_max is None:
+        price_max = user_config.get('price_max')
+    rows = await asyncio.to_thread(
+        item_store.search_text, text, search_term=search_term, price_min=price_min, price_max=price_max,
+        include_reserved=not available, limit=FILTER_MAX_RESULTS
+    )
+    scope = "todos los anuncios guardados" if everything else f"tu búsqueda '{search_term}'"
+    if not rows:
+        await reply(update,
+            f"No hay anuncios en {scope} que coincidan con '{text}'. Usa /buscar para encontrar más."
+        )
+        return
+    lines = [f"🔎 {len(rows)} anuncios de {scope} para '{text}':"]
+    for row in rows:
+        reserved = " (reservado)" if row['reserved'] else ""
+        lines.append(f"{row['title']} - {format_cents(row['price_cents'])}€{reserved}\n{row['link']}")
+    await reply(update, "\n\n".join(lines), disable_web_page_preview=True)
+
+async def run_watch_search(search_term, location, known_ids):
+    """Scraping de un grupo de seguimientos. Devuelve los productos encontrados"""
+    scraper = WallapopScraper(
+        search_term=search_term,
+        location=location,
+        pool=driver_pool
+    )
+    scraper.max_scrolls = WATCH_MAX_SCROLLS
+    scraper.load_images = False
+    scraper.backend = SEARCH_BACKEND
+    scraper.store = item_store
+    scraper.newest_first = WATCH_NEWEST_FIRST
+    scraper.known_ids = known_ids  # Lo visto por este grupo, no por cualquier /buscar
+    scraper.deadline = SEARCH_DEADLINE
+    scraper.phase_timeout = PHASE_TIMEOUT
+    scraper.auto_save = False  # Las diferencias las calcula el WatchManager con lo visto por el grupo
+
+    # Cada grupo de seguimientos cuenta como un usuario más en el planificador.
+    # iter_scrape (a diferencia de scrape) deja pasar los errores, para que un
+    # ciclo fallido no cuente como línea base
+    job = scheduler.submit(('seguimiento', search_term, location),
+                           lambda: list(scraper.iter_scrape()), on_cancel=scraper.stop)
+    return await job.wait()
+
+async def notify_watch(watch, new_items, price_drops):
+    """Envía al usuario las novedades de uno de sus seguimientos"""
+    lines = [f"🔔 Novedades en '{watch.search_term}':"]
+    for product in new_items[:WATCH_MAX_ITEMS]:
+        lines.append(f"🆕 {product.title} - {product.price}€\n{product.link}")
+    for product, old_cents in price_drops[:WATCH_MAX_ITEMS]:
+        lines.append(f"📉 {product.title}: {format_cents(old_cents)}€ → {product.price}€\n{product.link}")
+    hidden = max(len(new_items) - WATCH_MAX_ITEMS, 0) + max(len(price_drops) - WATCH_MAX_ITEMS, 0)
+    if hidden:
+        lines.append(f"… y {hidden} más")
+    # Sin esperar: el dispatcher agrupa los avisos seguidos de un mismo chat en un mensaje
+    dispatcher.notify(watch.chat_id, "\n\n".join(lines))
+
+async def follow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /seguir - Repite una búsqueda periódicamente y avisa de las novedades"""
+    user_id = update.effective_user.id
+    if not context.args:
+        await reply(update, "Por favor, especifica qué quieres seguir. Ejemplo: /seguir ps5")
+        return
+
+    search_term = ' '.join(context.args)
+    user_config = active_searches.get(user_id, {})
+    watch = Watch(
+        user_id=user_id,
+        chat_id=update.effective_chat.id,
+        search_term=search_term,
+        location=user_config.get('location', 'madrid'),
+        price_min=user_config.get('price_min', None),
+        price_max=user_config.get('price_max', None)
+    )
+    if not watch_manager.add(watch):
+        await reply(update, f"Ya estás siguiendo '{search_term}'.")
+        return
+    await reply(update,
+        f"👀 Siguiendo '{search_term}' cada {WATCH_INTERVAL // 60} minutos. "
+        "Te avisaré de anuncios nuevos y bajadas de precio. Usa /dejar_de_seguir para parar."
+    )
+
+async def unfollow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /dejar_de_seguir - Deja de seguir una búsqueda (o todas)"""
+    user_id = update.effective_user.id
+    search_term = ' '.join(context.args) if context.args else None
+    removed = watch_manager.remove(user_id, search_term)
+    if removed:
+        await reply(update, f"✅ Seguimientos eliminados: {removed}")
+    else:
+        await reply(update, "No tienes seguimientos que coincidan.")
+
+async def list_follows_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /seguimientos - Lista las búsquedas que sigue el usuario"""
+    watches = watch_manager.watches_for(update.effective_user.id)
+    if not watches:
+        await reply(update, "No estás siguiendo ninguna búsqueda. Ejemplo: /seguir ps5")
+        return
+    lines = [f"• {w.search_term} ({w.location})" for w in watches]
+    await reply(update, "👀 Tus seguimientos:\n" + "\n".join(lines))
+
+async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Comando /cancelar - Cancela las búsquedas pendientes o en curso del usuario"""
+    user_id = update.effective_user.id
+    cancelled = scheduler.cancel_user(user_id)
+    if cancelled:
+        await reply(update, f"🛑 Búsquedas canceladas: {cancelled}")
+    else:
+        await reply(update, "No tienes búsquedas en marcha.")
 
 async def stop_command(update: Update, context: CallbackContext) -> None:
     """Detiene el bot de forma segura."""
-    await update.message.reply_text("🛑 Deteniendo el bot...")
+    await reply(update, "🛑 Deteniendo el bot...")
+    # Dejar salir lo que quede en la cola de envíos
+    await dispatcher.close()
     # Detener la aplicación
     application.stop()
     # Cerrar la aplicación de forma limpia
     await application.shutdown()
+    # Detener seguimientos y búsquedas y cerrar los navegadores del pool
+    watch_manager.stop()
+    scheduler.shutdown()
+    driver_pool.close()
+
+def register_gauges():
+    """Registra los gauges del estado del bot que se leen al exportar las métricas"""
+    REGISTRY.gauge("wallapop_queue_depth", lambda: scheduler.queue_depth,
+                   help="Búsquedas esperando turno")
+    REGISTRY.gauge("wallapop_active_searches", lambda: scheduler.active,
+                   help="Búsquedas en ejecución")
+    REGISTRY.gauge("wallapop_active_browsers", lambda: driver_pool.active,
+                   help="Navegadores del pool prestados a una búsqueda")
+    REGISTRY.gauge("wallapop_pool_size", lambda: driver_pool.size,
+                   help="Tamaño máximo del pool de navegadores")
+    REGISTRY.gauge("wallapop_cache_entries", lambda: search_cache.stats()["entries"],
+                   help="Búsquedas guardadas en la caché")
+    REGISTRY.gauge("wallapop_cache_hits", lambda: search_cache.stats()["hits"],
+                   help="Búsquedas servidas desde la caché")
+    REGISTRY.gauge("wallapop_cache_misses", lambda: search_cache.stats()["misses"],
+                   help="Búsquedas que no estaban en la caché")
+    REGISTRY.gauge("wallapop_watch_groups", lambda: watch_manager.groups,
+                   help="Búsquedas distintas con seguimiento activo")
+    REGISTRY.gauge("wallapop_telegram_pending", lambda: dispatcher.pending if dispatcher else 0,
+                   help="Envíos a Telegram esperando turno")
 
 def main() -> None:
     """Inicia el bot."""
-    global application
+    global application, driver_pool, scheduler, item_store, watch_manager, price_history, dispatcher
     
+    item_store = ItemStore(WALLAPOP_DB)
+    price_history = PriceHistory(item_store, ANALYTICS_CACHE_DIR)
+    
+    # Precalentar el pool de navegadores en segundo plano
+    driver_pool = DriverPool(
+        size=DRIVER_POOL_SIZE,
+        max_uses=DRIVER_MAX_USES,
+        block_profile=BlockProfile.from_name(BLOCK_PROFILE)
+    )
+    threading.Thread(target=driver_pool.start, daemon=True).start()
+
+    # Limitar las búsquedas simultáneas a los navegadores y a la memoria disponibles
+    max_concurrent = min(DRIVER_POOL_SIZE, max_concurrent_for_memory(BROWSER_MEMORY_MB))
+    scheduler = SearchScheduler(
+        max_concurrent=max_concurrent,
+        per_user_limit=MAX_SEARCHES_PER_USER,
+        timeout=SEARCH_TIMEOUT
+    )
+    watch_manager = WatchManager(run_watch_search, notify_watch, interval=WATCH_INTERVAL, jitter=WATCH_JITTER)
+
+    # Exponer las métricas en formato Prometheus
+    if METRICS_PORT:
+        register_gauges()
+        serve_metrics(METRICS_PORT, host=METRICS_HOST)
+        logger.info(f"Métricas disponibles en http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
     # Crear el bot
-    application = Application.builder().token(os.getenv('TELEGRAM_TOKEN')).build()
+    # Atender varias actualizaciones a la vez: /buscar espera a su búsqueda y, si no,
+    # bloquearía /cancelar, /estado y las búsquedas de los demás usuarios
+    application = Application.builder().token(os.getenv('TELEGRAM_TOKEN')).concurrent_updates(True).build()
+    dispatcher = TelegramDispatcher(
+        application.bot,
+        global_rate=TELEGRAM_GLOBAL_RATE,
+        chat_rate=TELEGRAM_CHAT_RATE
+    )
 
     # Añadir manejadores de comandos
     application.add_handler(CommandHandler("start", start))
@@ -207,10 +696,22 @@ def main() -> None:
     application.add_handler(CommandHandler("precio_max", set_max_price))
     application.add_handler(CommandHandler("ubicacion", set_location))
     application.add_handler(CommandHandler("max_scrolls", set_max_scrolls))
+    application.add_handler(CommandHandler("modo", set_backend))
+    application.add_handler(CommandHandler("formato", set_format))
+    application.add_handler(CommandHandler("seguir", follow_command))
+    application.add_handler(CommandHandler("dejar_de_seguir", unfollow_command))
+    application.add_handler(CommandHandler("seguimientos", list_follows_command))
+    application.add_handler(CommandHandler("cancelar", cancel_command))
+    application.add_handler(CommandHandler("estado", status_command))
+    application.add_handler(CommandHandler("estadisticas", stats_command))
+    application.add_handler(CommandHandler("filtrar", filter_command))
     application.add_handler(CommandHandler("stop", stop_command))
 
     # Iniciar el bot
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    try:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        driver_pool.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from collections import OrderedDict
+from wallapop_store import normalize_term
+
+_FAILED = object()  # La ejecución compartida no terminó bien: quien la esperaba debe reintentar
+
+
+def search_key(search_term, location=None, price_min=None, price_max=None, max_scrolls=None, backend=None):
+    """Clave normalizada de una búsqueda: ignora mayúsculas y espacios sobrantes.
+
+    Incluye el backend (browser o http), que no devuelve exactamente los
+    mismos resultados.
+    """
+    term = normalize_term(search_term)
+    location = ' '.join((location or 'madrid').lower().split())
+    price_min = float(price_min) if price_min is not None else None
+    price_max = float(price_max) if price_max is not None else None
+    return (term, location, price_min, price_max, max_scrolls, backend)
+
+
+class SearchCache:
+    """Caché LRU con caducidad (TTL) de resultados de búsqueda.
+
+    `get_or_compute` agrupa las peticiones idénticas simultáneas para que
+    compartan un único scraping en curso (single-flight).
+    """
+
+    def __init__(self, ttl=600, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # clave -> (caduca_en, resultados)
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Devuelve los resultados en caché o None si no hay o han caducado"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, results = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return results
+
+    def put(self, key, results):
+        """Guarda resultados, expulsando la entrada menos usada si no caben"""
+        self._entries[key] = (time.monotonic() + self.ttl, results)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_compute(self, key, compute, cacheable=None):
+        """Devuelve los resultados de `key`, ejecutando `compute()` sólo si hace falta.
+
+        `compute` es una corrutina sin argumentos. Si ya hay una ejecución en
+        curso para la misma clave, se espera a su resultado en lugar de lanzar
+        otra. Los resultados vacíos no se guardan, ni aquellos para los que
+        `cacheable(resultados)` devuelva False (p. ej. una búsqueda cortada
+        por tiempo, que no debe servirse a otros como si estuviera completa).
+
+        Sólo se comparten los resultados correctos. Los errores son de quien
+        lanzó la ejecución (su límite de búsquedas, su /cancelar...), así que
+        sólo los recibe él; los que esperaban vuelven a intentarlo y el
+        primero pasa a lanzar la ejecución.
+        """
+        waited = False
+        while True:
+            results = self.get(key)
+            if results is not None:
+                self.hits += 1
+                return results
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+            if not waited:
+                self.coalesced += 1
+                waited = True
+            results = await asyncio.shield(in_flight)
+            if results is not _FAILED:
+                return results
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            results = await compute()
+        except BaseException:
+            # Incluida la cancelación de quien la lanzó: los demás reintentan
+            future.set_result(_FAILED)
+            raise
+        else:
+            if results and (cacheable is None or cacheable(results)):
+                self.put(key, results)
+            future.set_result(results)
+            return results
+        finally:
+            del self._in_flight[key]
+
+    def stats(self):
+        """Contadores de uso de la caché"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self._entries),
+        }
@@ -0,0 +1,64 @@
+import gzip
+import json
+import os
+import time
+from wallapop_item import Item
+
+CHECKPOINT_VERSION = 1
+
+
+def item_to_row(item):
+    """Fila compacta de un producto: [título, céntimos, ubicación, enlace, reservado(, ubicación de búsqueda)]"""
+    row = [item.title, item.price_cents, item.location, item.link, 1 if item.reserved else 0]
+    if item.search_location:
+        row.append(item.search_location)
+    return row
+
+
+def row_to_item(row):
+    title, price_cents, location, link, reserved = row[:5]
+    return Item(title, price_cents, location, link, bool(reserved),
+                search_location=row[5] if len(row) > 5 else None)
+
+
+def write_checkpoint(path, search, progress, items):
+    """Guarda el estado de un scraping en un JSON comprimido con gzip.
+
+    `search` identifica la búsqueda (para no reanudar otra distinta),
+    `progress` es la posición alcanzada (scrolls, tarjetas, cursor) e
+    `items` los productos recogidos hasta ahora. La escritura es atómica:
+    un corte a mitad nunca deja el checkpoint anterior corrupto.
+    """
+    state = {
+        "version": CHECKPOINT_VERSION,
+        "saved_at": time.time(),
+        "search": search,
+        "progress": progress,
+        "items": [item_to_row(item) for item in items],
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=5) as f:
+        json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path):
+    """Carga un checkpoint. Devuelve (búsqueda, progreso, productos) o None si no existe"""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return None
+    if state.get("version") != CHECKPOINT_VERSION:
+        raise ValueError(f"Versión de checkpoint no soportada en {path}")
+    return state["search"], state["progress"], [row_to_item(row) for row in state["items"]]
+
+
+def remove_checkpoint(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
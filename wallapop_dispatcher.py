@@ -0,0 +1,316 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from telegram.error import NetworkError, RetryAfter, TelegramError
+from wallapop_metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Prioridades de los envíos: sale antes el número más bajo
+INTERACTIVE = 0  # Respuestas a comandos
+PROGRESS = 1  # Progreso de búsquedas en curso
+ALERT = 2  # Avisos de seguimientos
+
+MAX_MESSAGE_LENGTH = 4096  # Límite de Telegram por mensaje
+ALERT_SEPARATOR = "\n\n"
+
+
+class TokenBucket:
+    """Cubo de fichas: `rate` envíos por segundo con ráfagas de hasta `capacity`"""
+
+    def __init__(self, rate, capacity=1, now=None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        """Segundos hasta que haya una ficha (0 si ya la hay)"""
+        if now < self.updated:
+            return self.updated - now + max(1 - self.tokens, 0) / self.rate
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds, now):
+        """Vacía el cubo y no lo vuelve a llenar hasta dentro de `seconds` (tras un 429)"""
+        self.tokens = 0
+        self.updated = max(self.updated, now + seconds)
+
+
+class Outgoing:
+    """Envío pendiente: método del Bot, argumentos y futuro con el resultado"""
+
+    __slots__ = ('method', 'chat_id', 'priority', 'seq', 'kwargs', 'future', 'not_before', 'attempts',
+                 'coalesce', 'edit_key')
+
+    def __init__(self, method, chat_id, priority, seq, kwargs, future, not_before=0.0, coalesce=False,
+                 edit_key=None):
+        self.method = method
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.kwargs = kwargs
+        self.future = future
+        self.not_before = not_before
+        self.attempts = 0
+        self.coalesce = coalesce
+        self.edit_key = edit_key
+
+
+def _retrieve_exception(future):
+    # Los avisos no los espera nadie: evitar el aviso de "excepción nunca recuperada"
+    if not future.cancelled():
+        future.exception()
+
+
+class TelegramDispatcher:
+    """Cola única de salida hacia la API de Telegram.
+
+    Respeta los límites de envío con cubos de fichas, uno global y otro por
+    chat (más lento en grupos), y atiende antes las respuestas a comandos que
+    el progreso y los avisos. Los avisos pendientes de un mismo chat se
+    agrupan en un solo mensaje y una edición pendiente de un mensaje se
+    sustituye por la más reciente. Ante un 429 se respeta el `retry_after`
+    del chat y se reintenta; los errores de red se reintentan con espera
+    creciente.
+
+    `clock` es el reloj de los límites (time.monotonic); las pruebas pasan
+    uno falso para no depender del tiempo real.
+    """
+
+    # Por defecto, algo por debajo de los límites de Telegram (30/s en total, 1/s por chat y
+    # 20/min por grupo) para que la latencia variable de la red no acerque dos envíos de más
+    def __init__(self, bot, global_rate=25, chat_rate=0.9, chat_burst=3, group_rate=18 / 60,
+                 max_in_flight=8, max_attempts=4, alert_delay=2.0, registry=REGISTRY, clock=time.monotonic):
+        self.bot = bot
+        self.clock = clock
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.alert_delay = alert_delay  # Espera de un aviso para agruparlo con los siguientes
+        self.registry = registry
+        self._global = TokenBucket(global_rate, global_rate, now=clock())
+        self._chats = {}  # chat_id -> TokenBucket
+        self._heap = []  # (prioridad, orden, envío)
+        self._seq = itertools.count()
+        self._edits = {}  # (chat_id, message_id) -> edición pendiente
+        self._busy_chats = set()  # Chats con un envío en curso: se respeta el orden de sus mensajes
+        self._in_flight = set()
+        self._wakeup = None
+        self._worker = None
+
+    @property
+    def pending(self):
+        """Envíos esperando turno"""
+        return sum(1 for _, _, item in self._heap if not item.future.done())
+
+    def _count(self, name, help_text, value=1):
+        if self.registry is not None:
+            self.registry.inc(f"wallapop_telegram_{name}_total", value, help=help_text)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Los grupos (id negativo) tienen un límite mucho más bajo que los chats privados
+            is_group = isinstance(chat_id, int) and chat_id < 0
+            rate = self.group_rate if is_group else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, 1 if is_group else self.chat_burst, now=self.clock())
+        return bucket
+
+    def _enqueue(self, method, chat_id, priority, kwargs, delay=0.0, coalesce=False, edit_key=None):
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = loop.create_task(self._run())
+        item = Outgoing(method, chat_id, priority, next(self._seq), kwargs, loop.create_future(),
+                        not_before=self.clock() + delay, coalesce=coalesce, edit_key=edit_key)
+        heapq.heappush(self._heap, (priority, item.seq, item))
+        self._wakeup.set()
+        return item
+
+    async def send_message(self, chat_id, text, priority=INTERACTIVE, **kwargs):
+        """Envía un mensaje y devuelve el Message de Telegram cuando sale"""
+        item = self._enqueue("send_message", chat_id, priority, dict(chat_id=chat_id, text=text, **kwargs))
+        return await asyncio.shield(item.future)
+
+    async def send_document(self, chat_id, document, priority=INTERACTIVE, **kwargs):
+        """Envía un fichero (p. ej. un BytesIO) y devuelve el Message cuando sale"""
+        item = self._enqueue("send_document", chat_id, priority, dict(chat_id=chat_id, document=document, **kwargs))
+        return await asyncio.shield(item.future)
+
+    async def edit_message_text(self, chat_id, message_id, text, priority=PROGRESS, **kwargs):
+        """Edita un mensaje. Si ya había una edición pendiente, sólo cuenta la última"""
+        key = (chat_id, message_id)
+        pending = self._edits.get(key)
+        if pending is not None and not pending.future.done():
+            pending.kwargs.update(text=text, **kwargs)
+            self._count("coalesced", "Envíos a Telegram agrupados con otro o sustituidos por uno más reciente")
+            return await asyncio.shield(pending.future)
+        item = self._enqueue("edit_message_text", chat_id, priority,
+                             dict(chat_id=chat_id, message_id=message_id, text=text, **kwargs), edit_key=key)
+        self._edits[key] = item
+        return await asyncio.shield(item.future)
+
+    def notify(self, chat_id, text, **kwargs):
+        """Encola un aviso sin esperar a que salga.
+
+        Los avisos pendientes de un mismo chat se envían juntos en un mensaje
+        (hasta el límite de longitud de Telegram). Devuelve el futuro del envío.
+        """
+        kwargs.setdefault("disable_web_page_preview", True)
+        item = self._enqueue("send_message", chat_id, ALERT, dict(chat_id=chat_id, text=text, **kwargs),
+                             delay=self.alert_delay, coalesce=True)
+        item.future.add_done_callback(_retrieve_exception)
+        return item.future
+
+    def _absorb(self, item):
+        """Añade a un aviso los demás avisos pendientes del mismo chat que quepan en el mensaje"""
+        text = item.kwargs["text"]
+        absorbed = []
+        for _, _, other in sorted(self._heap):
+            if (other is item or not other.coalesce or other.chat_id != item.chat_id
+                    or other.future.done() or other.kwargs.keys() != item.kwargs.keys()):
+                continue
+            candidate = text + ALERT_SEPARATOR + other.kwargs["text"]
+            if len(candidate) > MAX_MESSAGE_LENGTH:
+                break
+            text = candidate
+            absorbed.append(other)
+        if not absorbed:
+            return
+        item.kwargs["text"] = text
+        for other in absorbed:
+            # El envío agrupado resuelve también los futuros de los avisos que incluye
+            item.future.add_done_callback(lambda done, other=other: _chain(done, other.future))
+        absorbed_ids = {id(other) for other in absorbed}
+        self._heap = [entry for entry in self._heap if id(entry[2]) not in absorbed_ids]
+        heapq.heapify(self._heap)
+        self._count("coalesced", "Envíos a Telegram agrupados con otro o sustituidos por uno más reciente",
+                    len(absorbed))
+
+    def _dispatch_ready(self):
+        """Lanza los envíos que permiten los límites. Devuelve los segundos hasta el siguiente o None"""
+        now = self.clock()
+        deferred = []
+        next_delay = None
+        while self._heap and len(self._in_flight) < self.max_in_flight:
+            entry = heapq.heappop(self._heap)
+            item = entry[2]
+            if item.future.done():
+                continue
+            if item.chat_id in self._busy_chats:
+                deferred.append(entry)  # Se reintenta al terminar el envío en curso del chat
+                continue
+            bucket = self._chat_bucket(item.chat_id)
+            wait = max(item.not_before - now, bucket.wait_time(now))
+            if wait <= 0:
+                wait = self._global.wait_time(now)
+                if wait > 0:
+                    deferred.append(entry)
+                    next_delay = wait if next_delay is None else min(next_delay, wait)
+                    break  # Sin fichas globales no puede salir nada más
+            if wait > 0:
+                deferred.append(entry)
+                next_delay = wait if next_delay is None else min(next_delay, wait)
+                continue
+            self._global.take(now)
+            bucket.take(now)
+            if item.coalesce:
+                self._absorb(item)
+            if item.edit_key is not None and self._edits.get(item.edit_key) is item:
+                del self._edits[item.edit_key]  # Las ediciones posteriores ya no pueden sustituir a ésta
+            self._busy_chats.add(item.chat_id)
+            task = asyncio.get_running_loop().create_task(self._deliver(item))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+        for entry in deferred:
+            heapq.heappush(self._heap, entry)
+        return next_delay
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._dispatch_ready()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _deliver(self, item):
+        item.attempts += 1
+        requeue_after = None
+        try:
+            document = item.kwargs.get("document")
+            if hasattr(document, "seek"):
+                document.seek(0)  # En un reintento, el buffer ya se había leído
+            result = await getattr(self.bot, item.method)(**item.kwargs)
+        except RetryAfter as e:
+            # Telegram pide esperar: se pausa el chat y se reintenta el mismo envío
+            retry_after = e.retry_after
+            seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+            self._chat_bucket(item.chat_id).pause(seconds, self.clock())
+            self._count("retry_after", "Respuestas 429 de Telegram (se respeta retry_after)")
+            logger.warning(f"Telegram pide esperar {seconds:.0f}s antes de escribir al chat {item.chat_id}")
+            if item.attempts < self.max_attempts:
+                requeue_after = 0.0
+            else:
+                self._count("failed", "Envíos a Telegram descartados tras un error")
+                item.future.set_exception(e)
+        except NetworkError as e:
+            # Incluye TimedOut: reintentar con espera creciente
+            if item.attempts < self.max_attempts:
+                requeue_after = 0.5 * 2 ** (item.attempts - 1)
+                logger.warning(f"Error de red enviando a Telegram, reintento en {requeue_after:.1f}s: {str(e)}")
+            else:
+                self._count("failed", "Envíos a Telegram descartados tras un error")
+                item.future.set_exception(e)
+        except TelegramError as e:
+            self._count("failed", "Envíos a Telegram descartados tras un error")
+            logger.warning(f"No se pudo enviar a Telegram ({item.method}): {str(e)}")
+            item.future.set_exception(e)
+        except Exception as e:
+            item.future.set_exception(e)
+        else:
+            self._count("sent", "Mensajes enviados a Telegram")
+            item.future.set_result(result)
+        finally:
+            self._busy_chats.discard(item.chat_id)
+            if requeue_after is not None:
+                # Conserva su orden original: vuelve a salir antes que lo encolado después
+                item.not_before = self.clock() + requeue_after
+                heapq.heappush(self._heap, (item.priority, item.seq, item))
+            self._wakeup.set()
+
+    async def close(self, timeout=10):
+        """Espera (como mucho `timeout` segundos) a que salga lo pendiente y para el envío"""
+        deadline = time.monotonic() + timeout
+        while (self.pending or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+
+def _chain(source, target):
+    """Copia en `target` el resultado (o el error) de `source`"""
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
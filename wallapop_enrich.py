@@ -0,0 +1,244 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from html import unescape
+from wallapop_api import get_session
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS details (
+    link TEXT PRIMARY KEY,
+    modified_at TEXT,
+    last_modified TEXT,
+    etag TEXT,
+    fetched_at REAL NOT NULL,
+    description TEXT,
+    published_at TEXT,
+    seller_id TEXT,
+    shipping INTEGER
+) WITHOUT ROWID;
+"""
+
+UPSERT_SQL = """
+INSERT INTO details (link, modified_at, last_modified, etag, fetched_at, description, published_at, seller_id, shipping)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (link) DO UPDATE SET
+    modified_at = excluded.modified_at,
+    last_modified = excluded.last_modified,
+    etag = excluded.etag,
+    fetched_at = excluded.fetched_at,
+    description = excluded.description,
+    published_at = excluded.published_at,
+    seller_id = excluded.seller_id,
+    shipping = excluded.shipping
+"""
+
+_NEXT_DATA = re.compile(r'<script[^>]+id="__NEXT_DATA__"[^>]*>(.*?)</script>', re.S)
+_META_DESCRIPTION = re.compile(r'<meta[^>]+(?:property|name)="(?:og:)?description"[^>]+content="([^"]*)"', re.S)
+
+# Máximo de parámetros por consulta IN (...) en SQLite
+_CHUNK = 500
+
+
+def _format_date(value):
+    """Fecha ISO a partir de un timestamp (segundos o milisegundos) o de un texto ISO"""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        seconds = value / 1000 if value > 1e11 else value
+        return datetime.fromtimestamp(seconds, tz=timezone.utc).isoformat(timespec="seconds")
+    return str(value)
+
+
+def _find_item(data, depth=0):
+    """Busca en el JSON de la página el objeto del anuncio (el que tiene descripción y vendedor)"""
+    if depth > 8:
+        return None
+    if isinstance(data, dict):
+        if "description" in data and ("userId" in data or "user" in data or "seller" in data):
+            return data
+        values = data.values()
+    elif isinstance(data, list):
+        values = data
+    else:
+        return None
+    for value in values:
+        found = _find_item(value, depth + 1)
+        if found is not None:
+            return found
+    return None
+
+
+def parse_detail(html):
+    """Extrae descripción, fecha de publicación, vendedor y envío de la página de un anuncio.
+
+    Usa los datos JSON que la web incrusta en `__NEXT_DATA__`; si no están,
+    se queda al menos con la descripción de las etiquetas meta.
+    """
+    details = {"description": None, "published_at": None, "seller_id": None, "shipping": None}
+    match = _NEXT_DATA.search(html)
+    item = None
+    if match:
+        try:
+            item = _find_item(json.loads(match.group(1)))
+        except ValueError:
+            item = None
+
+    if item is not None:
+        description = item.get("description")
+        if isinstance(description, dict):
+            description = description.get("original") or description.get("translated")
+        details["description"] = description
+        details["published_at"] = _format_date(
+            item.get("creationDate") or item.get("publishDate") or item.get("created_at")
+        )
+        user = item.get("user") or item.get("seller") or {}
+        seller_id = item.get("userId") or (user.get("id") if isinstance(user, dict) else None)
+        details["seller_id"] = str(seller_id) if seller_id is not None else None
+        shipping = item.get("shipping")
+        if isinstance(shipping, dict):
+            details["shipping"] = bool(
+                shipping.get("isItemShippable") and shipping.get("isShippingAllowedByUser", True)
+            )
+        elif shipping is not None:
+            details["shipping"] = bool(shipping)
+    else:
+        meta = _META_DESCRIPTION.search(html)
+        if meta:
+            details["description"] = unescape(meta.group(1))
+    return details
+
+
+class DetailCache:
+    """Caché persistente en SQLite de las páginas de detalle ya descargadas.
+
+    Por enlace guarda los datos extraídos, la última modificación que indicó
+    la búsqueda y las cabeceras Last-Modified/ETag de la respuesta, para no
+    volver a descargar anuncios que no han cambiado.
+    """
+
+    def __init__(self, path="wallapop_details.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_many(self, links):
+        """Entradas guardadas de los enlaces indicados, por enlace"""
+        links = list(links)
+        entries = {}
+        with self._lock:
+            for i in range(0, len(links), _CHUNK):
+                chunk = links[i:i + _CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                for row in self._conn.execute(f"SELECT * FROM details WHERE link IN ({placeholders})", chunk):
+                    entries[row["link"]] = dict(row)
+        return entries
+
+    def put_many(self, entries):
+        """Guarda en una sola transacción una lista de entradas (diccionarios)"""
+        rows = [(
+            entry["link"], entry.get("modified_at"), entry.get("last_modified"), entry.get("etag"),
+            entry.get("fetched_at") or time.time(), entry.get("description"), entry.get("published_at"),
+            entry.get("seller_id"), None if entry.get("shipping") is None else int(entry["shipping"]),
+        ) for entry in entries]
+        with self._lock, self._conn:
+            self._conn.executemany(UPSERT_SQL, rows)
+
+
+def _details_from_entry(entry):
+    shipping = entry.get("shipping")
+    return {
+        "description": entry.get("description"),
+        "published_at": entry.get("published_at"),
+        "seller_id": entry.get("seller_id"),
+        "shipping": None if shipping is None else bool(shipping),
+    }
+
+
+class DetailEnricher:
+    """Completa productos con los datos de su página de detalle, en paralelo.
+
+    Las páginas se descargan con la sesión HTTP compartida (pool de
+    conexiones) desde un número acotado de hilos. Un anuncio cuya última
+    modificación coincide con la guardada no se vuelve a pedir; el resto se
+    pide con If-None-Match / If-Modified-Since y un 304 reutiliza la caché.
+    """
+
+    def __init__(self, cache=None, session=None, workers=8, timeout=15):
+        self.cache = cache
+        self.session = session or get_session()
+        self.workers = workers
+        self.timeout = timeout
+
+    def _fetch(self, item, cached):
+        """Descarga la página de un anuncio. Devuelve la entrada de caché actualizada"""
+        headers = {"Accept": "text/html,application/xhtml+xml"}
+        if cached:
+            if cached.get("etag"):
+                headers["If-None-Match"] = cached["etag"]
+            if cached.get("last_modified"):
+                headers["If-Modified-Since"] = cached["last_modified"]
+        response = self.session.get(item.link, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and cached:
+            entry = dict(cached)
+            not_modified = True
+        else:
+            response.raise_for_status()
+            entry = dict(parse_detail(response.text), link=item.link)
+            not_modified = False
+        entry.update(
+            modified_at=str(item.modified_at) if item.modified_at is not None else entry.get("modified_at"),
+            last_modified=response.headers.get("Last-Modified") or entry.get("last_modified"),
+            etag=response.headers.get("ETag") or entry.get("etag"),
+            fetched_at=time.time(),
+        )
+        return entry, not_modified
+
+    def enrich(self, items, should_stop=None):
+        """Rellena `details` de cada producto. Devuelve un resumen de lo que se ha hecho"""
+        stats = {"cached": 0, "fetched": 0, "not_modified": 0, "failed": 0}
+        cached_entries = self.cache.get_many(item.link for item in items) if self.cache is not None else {}
+
+        pending = []
+        for item in items:
+            cached = cached_entries.get(item.link)
+            if (cached is not None and item.modified_at is not None
+                    and cached.get("modified_at") == str(item.modified_at)):
+                # Sin cambios desde la última descarga: ni siquiera hace falta preguntar
+                item.details = _details_from_entry(cached)
+                stats["cached"] += 1
+            else:
+                pending.append(item)
+
+        updated = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._fetch, item, cached_entries.get(item.link)): item for item in pending}
+            for future in as_completed(futures):
+                item = futures[future]
+                if should_stop is not None and should_stop():
+                    for other in futures:
+                        other.cancel()
+                    break
+                try:
+                    entry, not_modified = future.result()
+                except Exception:
+                    stats["failed"] += 1
+                    continue
+                item.details = _details_from_entry(entry)
+                updated.append(entry)
+                stats["not_modified" if not_modified else "fetched"] += 1
+
+        if self.cache is not None and updated:
+            self.cache.put_many(updated)
+        return stats
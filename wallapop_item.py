@@ -0,0 +1,117 @@
+import re
+
+CSV_FIELDS = ('title', 'price', 'location', 'link', 'reserved')
+# Ubicación de búsqueda en la que apareció el anuncio (búsquedas en varias ubicaciones)
+SEARCH_LOCATION_FIELD = 'search_location'
+# Campos de la página de detalle que añade el enriquecimiento
+DETAIL_FIELDS = ('description', 'published_at', 'seller_id', 'shipping')
+
+# Miles con punto según es-ES: "1.200", "12.345.678"
+_THOUSANDS = re.compile(r'^\d{1,3}(\.\d{3})+$')
+
+
+def parse_price_cents(text):
+    """Convierte un precio en texto a céntimos, con formato es-ES.
+
+    "1.200,50 €" -> 120050, "1.200" -> 120000, "12,5" -> 1250. Devuelve None
+    si el texto no es un precio.
+    """
+    if text is None:
+        return None
+    text = text.replace("€", "").replace("\xa0", "").replace(" ", "").strip()
+    if not text:
+        return None
+    if "," in text:
+        # La coma es el separador decimal; los puntos, de miles
+        text = text.replace(".", "").replace(",", ".")
+    elif _THOUSANDS.match(text):
+        text = text.replace(".", "")
+    try:
+        return round(float(text) * 100)
+    except ValueError:
+        return None
+
+
+def format_cents(cents):
+    """Formatea céntimos como los muestra la web (es-ES): 1.200 o 12,50"""
+    if cents is None:
+        return "0"
+    euros, rest = divmod(int(cents), 100)
+    text = f"{euros:,}".replace(",", ".")
+    if rest:
+        text += f",{rest:02d}"
+    return text
+
+
+class Item:
+    """Anuncio extraído de Wallapop.
+
+    Usa `__slots__` para ocupar poco en búsquedas de miles de anuncios. El
+    precio se guarda una sola vez, ya convertido a céntimos. `details` sólo
+    se rellena al enriquecer con la página de detalle, `modified_at` cuando
+    la fuente indica la última modificación del anuncio y `search_location`
+    cuando la búsqueda abarca varias ubicaciones.
+    """
+
+    __slots__ = ('title', 'price_cents', 'location', 'link', 'reserved', 'details', 'modified_at',
+                 'search_location')
+
+    def __init__(self, title, price_cents, location, link, reserved=False, details=None, modified_at=None,
+                 search_location=None):
+        self.title = title
+        self.price_cents = price_cents
+        self.location = location
+        self.link = link
+        self.reserved = reserved
+        self.details = details
+        self.modified_at = modified_at
+        self.search_location = search_location
+
+    @property
+    def price(self):
+        """Precio en texto, con el formato de la web"""
+        return format_cents(self.price_cents)
+
+    @property
+    def euros(self):
+        return self.price_cents / 100 if self.price_cents is not None else None
+
+    def as_row(self):
+        """Fila para CSV en el orden de CSV_FIELDS"""
+        return (self.title, self.price, self.location, self.link, "Sí" if self.reserved else "No")
+
+    def detail_row(self):
+        """Campos de detalle en el orden de DETAIL_FIELDS (vacíos si no se ha enriquecido)"""
+        details = self.details or {}
+        row = []
+        for field in DETAIL_FIELDS:
+            value = details.get(field)
+            if isinstance(value, bool):
+                value = "Sí" if value else "No"
+            row.append("" if value is None else value)
+        return tuple(row)
+
+    def to_dict(self):
+        """Diccionario con el mismo formato que los CSV de resultados"""
+        data = dict(zip(CSV_FIELDS, self.as_row()))
+        if self.search_location:
+            data[SEARCH_LOCATION_FIELD] = self.search_location
+        if self.details:
+            data.update(zip(DETAIL_FIELDS, self.detail_row()))
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        """Crea un Item a partir de una fila de CSV o un diccionario equivalente"""
+        reserved = data.get('reserved')
+        return cls(
+            title=data['title'],
+            price_cents=parse_price_cents(str(data.get('price', ''))),
+            location=data.get('location'),
+            link=data['link'],
+            reserved=reserved is True or reserved == "Sí",
+            search_location=data.get(SEARCH_LOCATION_FIELD) or None,
+        )
+
+    def __repr__(self):
+        return f"Item({self.title!r}, {self.price}€, {self.link!r})"
@@ -0,0 +1,149 @@
+import re
+import unicodedata
+
+# Coordenadas (latitud, longitud) de capitales de provincia, provincias y
+# ciudades grandes de España. Las provincias apuntan a su capital.
+LOCATIONS = {
+    "madrid": (40.4168, -3.7038),
+    "barcelona": (41.3874, 2.1686),
+    "valencia": (39.4699, -0.3763),
+    "sevilla": (37.3891, -5.9845),
+    "zaragoza": (41.6488, -0.8891),
+    "malaga": (36.7213, -4.4214),
+    "murcia": (37.9922, -1.1307),
+    "bilbao": (43.2630, -2.9350),
+    "alicante": (38.3452, -0.4810),
+    "cordoba": (37.8882, -4.7794),
+    "valladolid": (41.6523, -4.7245),
+    "vitoria": (42.8467, -2.6716),
+    "vitoria gasteiz": (42.8467, -2.6716),
+    "albacete": (38.9943, -1.8585),
+    "almeria": (36.8340, -2.4637),
+    "oviedo": (43.3614, -5.8494),
+    "avila": (40.6565, -4.6818),
+    "badajoz": (38.8794, -6.9707),
+    "burgos": (42.3439, -3.6969),
+    "caceres": (39.4753, -6.3724),
+    "cadiz": (36.5271, -6.2886),
+    "santander": (43.4623, -3.8099),
+    "castellon": (39.9864, -0.0513),
+    "castellon de la plana": (39.9864, -0.0513),
+    "ciudad real": (38.9848, -3.9274),
+    "cuenca": (40.0704, -2.1374),
+    "girona": (41.9794, 2.8214),
+    "gerona": (41.9794, 2.8214),
+    "granada": (37.1773, -3.5986),
+    "guadalajara": (40.6329, -3.1664),
+    "san sebastian": (43.3183, -1.9812),
+    "donostia": (43.3183, -1.9812),
+    "huelva": (37.2614, -6.9447),
+    "huesca": (42.1401, -0.4089),
+    "palma": (39.5696, 2.6502),
+    "palma de mallorca": (39.5696, 2.6502),
+    "jaen": (37.7796, -3.7849),
+    "a coruna": (43.3623, -8.4115),
+    "la coruna": (43.3623, -8.4115),
+    "coruna": (43.3623, -8.4115),
+    "logrono": (42.4627, -2.4450),
+    "las palmas": (28.1235, -15.4363),
+    "las palmas de gran canaria": (28.1235, -15.4363),
+    "leon": (42.5987, -5.5671),
+    "lleida": (41.6176, 0.6200),
+    "lerida": (41.6176, 0.6200),
+    "lugo": (43.0097, -7.5568),
+    "pamplona": (42.8125, -1.6458),
+    "ourense": (42.3358, -7.8639),
+    "orense": (42.3358, -7.8639),
+    "palencia": (42.0095, -4.5288),
+    "pontevedra": (42.4310, -8.6444),
+    "salamanca": (40.9701, -5.6635),
+    "santa cruz de tenerife": (28.4636, -16.2518),
+    "segovia": (40.9429, -4.1088),
+    "soria": (41.7666, -2.4790),
+    "tarragona": (41.1189, 1.2445),
+    "teruel": (40.3456, -1.1065),
+    "toledo": (39.8628, -4.0273),
+    "zamora": (41.5033, -5.7446),
+    "ceuta": (35.8894, -5.3213),
+    "melilla": (35.2923, -2.9381),
+    # Provincias y comunidades uniprovinciales
+    "alava": (42.8467, -2.6716),
+    "araba": (42.8467, -2.6716),
+    "asturias": (43.3614, -5.8494),
+    "cantabria": (43.4623, -3.8099),
+    "gipuzkoa": (43.3183, -1.9812),
+    "guipuzcoa": (43.3183, -1.9812),
+    "bizkaia": (43.2630, -2.9350),
+    "vizcaya": (43.2630, -2.9350),
+    "baleares": (39.5696, 2.6502),
+    "islas baleares": (39.5696, 2.6502),
+    "illes balears": (39.5696, 2.6502),
+    "la rioja": (42.4627, -2.4450),
+    "navarra": (42.8125, -1.6458),
+    "tenerife": (28.4636, -16.2518),
+    "gran canaria": (28.1235, -15.4363),
+    # Otras ciudades grandes
+    "vigo": (42.2406, -8.7207),
+    "gijon": (43.5322, -5.6611),
+    "hospitalet": (41.3596, 2.0997),
+    "l hospitalet de llobregat": (41.3596, 2.0997),
+    "hospitalet de llobregat": (41.3596, 2.0997),
+    "elche": (38.2699, -0.7126),
+    "elx": (38.2699, -0.7126),
+    "cartagena": (37.6257, -0.9966),
+    "jerez": (36.6850, -6.1261),
+    "jerez de la frontera": (36.6850, -6.1261),
+    "marbella": (36.5101, -4.8825),
+    "algeciras": (36.1408, -5.4562),
+    "dos hermanas": (37.2828, -5.9209),
+    "alcala de henares": (40.4820, -3.3635),
+    "mostoles": (40.3223, -3.8649),
+    "fuenlabrada": (40.2842, -3.7942),
+    "leganes": (40.3272, -3.7635),
+    "getafe": (40.3057, -3.7329),
+    "alcorcon": (40.3458, -3.8249),
+    "torrejon de ardoz": (40.4553, -3.4697),
+    "terrassa": (41.5610, 2.0089),
+    "sabadell": (41.5463, 2.1086),
+    "badalona": (41.4500, 2.2474),
+    "mataro": (41.5381, 2.4445),
+    "santiago de compostela": (42.8782, -8.5448),
+    "benidorm": (38.5411, -0.1225),
+}
+
+DEFAULT_LOCATION = "madrid"
+
+_COORDINATES = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+
+def normalize_location(name):
+    """Minúsculas, sin tildes y con separadores unificados: "Alcalá-de Henares" -> "alcala de henares" """
+    text = unicodedata.normalize('NFKD', name.lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(re.sub(r"[-_'’.]", ' ', text).split())
+
+
+def resolve_location(name):
+    """Devuelve (latitud, longitud) de una ubicación o None si no se conoce.
+
+    Acepta nombres de ciudades y provincias o coordenadas "lat,lon".
+    """
+    match = _COORDINATES.match(name or "")
+    if match:
+        return float(match.group(1)), float(match.group(2))
+    return LOCATIONS.get(normalize_location(name or ""))
+
+
+def split_locations(text):
+    """Separa varias ubicaciones por comas: "Madrid, Barcelona" -> ["Madrid", "Barcelona"].
+
+    Unas coordenadas "lat,lon" cuentan como una sola ubicación. Las repetidas
+    se quedan una vez, en el orden en que aparecen.
+    """
+    if _COORDINATES.match(text or ""):
+        return [text.strip()]
+    parts = [part.strip() for part in (text or "").split(",") if part.strip()]
+    unique = {}
+    for part in parts:
+        unique.setdefault(normalize_location(part), part)
+    return list(unique.values())
@@ -0,0 +1,199 @@
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites (segundos) de los buckets del histograma de duración de las fases
+PHASE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Registro de métricas en memoria con exportación en formato texto de Prometheus.
+
+    Tiene contadores y sumas con etiquetas, histogramas de duración y gauges
+    que se calculan al exportar llamando a una función. Es seguro usarlo
+    desde varios hilos.
+    """
+
+    def __init__(self, buckets=PHASE_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}  # nombre -> {etiquetas: valor}
+        self._histograms = {}  # nombre -> {etiquetas: [cuentas por bucket, suma, total]}
+        self._gauges = {}  # nombre -> función
+
+    def inc(self, name, value=1, help="", **labels):
+        """Suma `value` al contador `name` con las etiquetas indicadas"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def value(self, name, **labels):
+        """Valor actual del contador `name` con esas etiquetas (0 si no existe)"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            return self._counters.get(name, {}).get(key, 0)
+
+    def observe(self, name, seconds, help="", **labels):
+        """Registra una duración en el histograma `name`"""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._help.setdefault(name, help)
+            series = self._histograms.setdefault(name, {})
+            entry = series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    entry[0][i] += 1
+            entry[1] += seconds
+            entry[2] += 1
+
+    def gauge(self, name, func, help=""):
+        """Registra un gauge cuyo valor se obtiene llamando a `func` al exportar"""
+        with self._lock:
+            self._help[name] = help
+            self._gauges[name] = func
+
+    def render(self):
+        """Exporta todas las métricas en el formato de texto de Prometheus"""
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {name: {key: [list(entry[0]), entry[1], entry[2]] for key, entry in series.items()}
+                          for name, series in self._histograms.items()}
+            gauges = dict(self._gauges)
+            help_text = dict(self._help)
+
+        lines = []
+        for name, series in sorted(counters.items()):
+            lines.append(f"# HELP {name} {help_text.get(name, '')}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_labels(key)} {_number(value)}")
+
+        for name, series in sorted(histograms.items()):
+            lines.append(f"# HELP {name} {help_text.get(name, '')}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, (counts, total, count) in sorted(series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{name}_bucket{_labels(key + (('le', bound),))} {bucket_count}")
+                lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_labels(key)} {total!r}")
+                lines.append(f"{name}_count{_labels(key)} {count}")
+
+        for name, func in sorted(gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue  # Un gauge que falla no debe romper la exportación
+            if value is None:
+                continue
+            lines.append(f"# HELP {name} {help_text.get(name, '')}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Registro global del proceso
+REGISTRY = Metrics()
+
+COUNTER_HELP = {
+    "webdriver_commands": "Comandos WebDriver enviados",
+    "cards_seen": "Tarjetas de producto leídas de la página o de la API",
+    "items": "Productos añadidos a los resultados",
+    "duplicates": "Productos descartados por estar ya en los resultados",
+    "price_filtered": "Productos descartados por los filtros de precio",
+    "invalid_cards": "Tarjetas sin título o enlace",
+    "scrapes": "Scrapings terminados",
+    "budget_stops": "Scrapings terminados por un límite (productos, tiempo o anuncios ya vistos)",
+    "known_items": "Anuncios ya guardados encontrados en el modo por novedad",
+    "details_fetched": "Páginas de detalle descargadas",
+    "details_cached": "Páginas de detalle servidas desde la caché o sin cambios (304)",
+    "details_failed": "Páginas de detalle que no se pudieron descargar",
+}
+
+
+class PhaseTimer:
+    """Tiempos y contadores de un scraping, volcados también al registro global.
+
+    `timings` guarda por fase [veces, segundos totales] y `counters` los
+    contadores propios de la ejecución.
+    """
+
+    def __init__(self, registry=REGISTRY):
+        self.registry = registry
+        self.timings = {}
+        self.counters = {}
+
+    @contextmanager
+    def span(self, phase):
+        """Mide la duración del bloque como una ejecución de la fase `phase`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            entry = self.timings.setdefault(phase, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+            if self.registry is not None:
+                self.registry.observe("wallapop_phase_seconds", elapsed,
+                                      help="Duración de cada fase del scraping", phase=phase)
+
+    def count(self, name, value=1):
+        """Suma `value` al contador `name` de la ejecución y al contador global"""
+        self.counters[name] = self.counters.get(name, 0) + value
+        if self.registry is not None:
+            self.registry.inc(f"wallapop_{name}_total", value, help=COUNTER_HELP.get(name, ""))
+
+    def merge(self, other):
+        """Suma los tiempos y contadores de otra ejecución (ya volcados al registro por ella)"""
+        for phase, (count, total) in other.timings.items():
+            entry = self.timings.setdefault(phase, [0, 0.0])
+            entry[0] += count
+            entry[1] += total
+        for name, value in other.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def summary(self):
+        """Líneas de texto con el tiempo por fase, de mayor a menor"""
+        lines = []
+        for phase, (count, total) in sorted(self.timings.items(), key=lambda entry: -entry[1][1]):
+            lines.append(f"{phase}: {total:.2f}s" + (f" ({count}x)" if count > 1 else ""))
+        return lines
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_metrics(port, host="127.0.0.1", registry=REGISTRY):
+    """Sirve /metrics en un hilo en segundo plano. Devuelve el servidor"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,135 @@
+import csv
+import gzip
+import io
+import json
+from wallapop_item import CSV_FIELDS, DETAIL_FIELDS, SEARCH_LOCATION_FIELD
+
+# Formato -> extensión del fichero
+FORMATS = {
+    "csv": "csv",
+    "csv.gz": "csv.gz",
+    "jsonl": "jsonl",
+    "parquet": "parquet",
+}
+
+
+def _has_details(items):
+    return any(item.details for item in items)
+
+
+def _has_search_location(items):
+    return any(item.search_location for item in items)
+
+
+def _write_csv(items, binary):
+    text = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    located = _has_search_location(items)
+    enriched = _has_details(items)
+    # Columnas opcionales a continuación de las habituales: ubicación de búsqueda y detalle
+    writer.writerow(CSV_FIELDS + ((SEARCH_LOCATION_FIELD,) if located else ()) + (DETAIL_FIELDS if enriched else ()))
+    if not located and not enriched:
+        writer.writerows(item.as_row() for item in items)
+    else:
+        for item in items:
+            row = item.as_row()
+            if located:
+                row += (item.search_location or "",)
+            if enriched:
+                row += item.detail_row()
+            writer.writerow(row)
+    text.flush()
+    text.detach()  # Cerrar el envoltorio de texto sin cerrar el buffer
+
+
+def _parquet_bytes(items):
+    """Parquet con tipos nativos (precio en céntimos, reservado booleano). Necesita pyarrow"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("El formato parquet necesita pyarrow: pip install pyarrow")
+    columns = {
+        "title": pa.array([item.title for item in items], pa.string()),
+        "price_cents": pa.array([item.price_cents for item in items], pa.int64()),
+        "location": pa.array([item.location for item in items], pa.string()),
+        "link": pa.array([item.link for item in items], pa.string()),
+        "reserved": pa.array([bool(item.reserved) for item in items], pa.bool_()),
+    }
+    if _has_search_location(items):
+        columns[SEARCH_LOCATION_FIELD] = pa.array([item.search_location for item in items], pa.string())
+    if _has_details(items):
+        details = [item.details or {} for item in items]
+        columns["description"] = pa.array([d.get("description") for d in details], pa.string())
+        columns["published_at"] = pa.array([d.get("published_at") for d in details], pa.string())
+        columns["seller_id"] = pa.array([d.get("seller_id") for d in details], pa.string())
+        columns["shipping"] = pa.array([d.get("shipping") for d in details], pa.bool_())
+    table = pa.table(columns)
+    sink = io.BytesIO()
+    pq.write_table(table, sink, compression="snappy")
+    return sink.getvalue()
+
+
+def to_buffer(items, fmt="csv"):
+    """Serializa los productos en memoria en el formato indicado.
+
+    Devuelve un BytesIO posicionado al principio, listo para enviarse o
+    escribirse en disco sin pasar por ficheros temporales.
+    """
+    buffer = io.BytesIO()
+    if fmt == "csv":
+        _write_csv(items, buffer)
+    elif fmt == "csv.gz":
+        # mtime=0 para que el mismo contenido produzca los mismos bytes
+        with gzip.GzipFile(fileobj=buffer, mode='wb', mtime=0) as compressed:
+            _write_csv(items, compressed)
+    elif fmt == "jsonl":
+        for item in items:
+            buffer.write(json.dumps(item.to_dict(), ensure_ascii=False).encode('utf-8'))
+            buffer.write(b"\n")
+    elif fmt == "parquet":
+        buffer.write(_parquet_bytes(items))
+    else:
+        raise ValueError(f"Formato no soportado: {fmt}")
+    buffer.seek(0)
+    return buffer
+
+
+class ResultWriter:
+    """Escribe resultados en disco fila a fila (CSV o JSONL), vaciando el buffer en cada escritura.
+
+    Permite que un scraping largo deje en disco lo que lleva extraído aunque
+    se interrumpa, sin acumular filas en memoria. Con `located` el CSV lleva
+    además la ubicación de búsqueda de cada producto.
+    """
+
+    def __init__(self, path, fmt="csv", located=False):
+        self.path = path
+        self.fmt = fmt
+        self.located = located
+        self.rows = 0
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        if fmt == "csv":
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(CSV_FIELDS + ((SEARCH_LOCATION_FIELD,) if located else ()))
+        elif fmt != "jsonl":
+            raise ValueError(f"Formato no soportado: {fmt}")
+
+    def write(self, item):
+        """Añade un producto al final del fichero"""
+        if self.fmt == "csv":
+            self._writer.writerow(item.as_row() + ((item.search_location or "",) if self.located else ()))
+        else:
+            self._file.write(json.dumps(item.to_dict(), ensure_ascii=False))
+            self._file.write("\n")
+        self._file.flush()
+        self.rows += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
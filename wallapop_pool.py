@@ -0,0 +1,293 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException, ElementClickInterceptedException
+import undetected_chromedriver as uc
+
+BASE_URL = "https://es.wallapop.com"
+
+
+def create_driver(load_images=False, block_profile=None):
+    """Lanza un navegador Chromium configurado para el scraping.
+
+    Si se indica un BlockProfile, se aplica por CDP y se activa el registro
+    de red para poder contar lo bloqueado.
+    """
+    options = uc.ChromeOptions()
+    options.binary_location = os.getenv('CHROME_BIN', '/usr/bin/chromium')
+    options.add_argument('--headless')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+
+    if not load_images:
+        prefs = {"profile.managed_default_content_settings.images": 2}
+        options.add_experimental_option("prefs", prefs)
+    if block_profile is not None:
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+    driver = uc.Chrome(
+        driver_executable_path=os.getenv('CHROMEDRIVER_PATH', '/usr/bin/chromedriver'),
+        options=options,
+        version_main=119  # Especificar versión para evitar warning
+    )
+    if block_profile is not None:
+        block_profile.apply(driver)
+    return count_commands(driver)
+
+
+def count_commands(driver):
+    """Cuenta los comandos WebDriver enviados por el driver en `driver.command_count`.
+
+    Todas las llamadas (incluidas las de WebElement) pasan por `driver.execute`,
+    así que basta con envolverlo en la instancia.
+    """
+    execute = driver.execute
+    driver.command_count = 0
+
+    def counted_execute(driver_command, params=None):
+        driver.command_count += 1
+        return execute(driver_command, params)
+
+    driver.execute = counted_execute
+    return driver
+
+
+def _children_map():
+    """Hijos de cada proceso según /proc (sólo Linux)"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # El nombre del proceso va entre paréntesis y puede contener espacios
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    return children
+
+
+def process_tree_rss(pids):
+    """RSS total en bytes de los procesos indicados y todos sus descendientes"""
+    if not os.path.isdir("/proc"):
+        return None
+    children = _children_map()
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    seen = set()
+    pending = [pid for pid in pids if pid]
+    total = 0
+    while pending:
+        pid = pending.pop()
+        if pid in seen:
+            continue
+        seen.add(pid)
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+        pending.extend(children.get(pid, []))
+    return total
+
+
+def browser_pids(driver):
+    """Procesos raíz del navegador: Chromium (undetected_chromedriver) y chromedriver"""
+    pids = [getattr(driver, "browser_pid", None)]
+    process = getattr(getattr(driver, "service", None), "process", None)
+    if process is not None:
+        pids.append(process.pid)
+    return [pid for pid in pids if pid]
+
+
+def accept_cookie_banner(driver, timeout=10):
+    """Acepta el diálogo de cookies de OneTrust. Devuelve True si se aceptó"""
+    try:
+        cookie_button = WebDriverWait(driver, timeout).until(
+            EC.element_to_be_clickable((By.ID, "onetrust-accept-btn-handler"))
+        )
+    except TimeoutException:
+        return False
+    try:
+        cookie_button.click()
+    except ElementClickInterceptedException:
+        # Si falla el click normal, intentar con JavaScript
+        driver.execute_script("arguments[0].click();", cookie_button)
+    return True
+
+
+class PooledDriver:
+    """Navegador prestado por el pool"""
+
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.cookies_accepted = False
+        self.created_at = time.time()
+
+
+class DriverPool:
+    """Pool de navegadores Chromium precalentados compartidos entre búsquedas.
+
+    Los navegadores se lanzan con las cookies ya aceptadas, se limpian entre
+    trabajos y se reciclan tras `max_uses` usos o si dejan de responder.
+    """
+
+    def __init__(self, size=2, max_uses=20, base_url=BASE_URL, load_images=False, block_profile=None, debug=False):
+        self.size = size
+        self.max_uses = max_uses
+        self.base_url = base_url
+        self.load_images = load_images
+        self.block_profile = block_profile
+        self.debug = debug
+        self._idle = []
+        self._created = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _launch(self):
+        """Lanza un navegador nuevo y acepta las cookies"""
+        pooled = PooledDriver(create_driver(load_images=self.load_images, block_profile=self.block_profile))
+        try:
+            pooled.driver.get(self.base_url)
+            pooled.cookies_accepted = accept_cookie_banner(pooled.driver)
+        except Exception as e:
+            if self.debug:
+                print(f"⚠️ Error al precalentar el navegador: {str(e)}")
+        if self.debug:
+            print("✓ Navegador del pool inicializado")
+        return pooled
+
+    def _discard(self, pooled):
+        """Cierra un navegador y libera su hueco en el pool"""
+        try:
+            pooled.driver.quit()
+        except Exception:
+            pass
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def _is_alive(self, pooled):
+        try:
+            pooled.driver.current_url
+            return True
+        except Exception:
+            return False
+
+    def _reset(self, pooled):
+        """Deja el navegador limpio para el siguiente trabajo conservando las cookies"""
+        driver = pooled.driver
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+        driver.execute_script("window.sessionStorage.clear();")
+        driver.get("about:blank")
+
+    def start(self):
+        """Lanza todos los navegadores del pool por adelantado"""
+        for _ in range(self.size):
+            with self._cond:
+                if self._closed or self._created >= self.size:
+                    return
+                self._created += 1
+            try:
+                pooled = self._launch()
+            except Exception as e:
+                print(f"Error al inicializar el driver: {str(e)}")
+                with self._cond:
+                    self._created -= 1
+                raise
+            with self._cond:
+                self._idle.append(pooled)
+                self._cond.notify()
+
+    def acquire(self, timeout=None):
+        """Presta un navegador, lanzando uno nuevo si hay hueco libre"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("El pool de navegadores está cerrado")
+                    if self._idle:
+                        pooled = self._idle.pop()
+                        break
+                    if self._created < self.size:
+                        self._created += 1
+                        pooled = None
+                        break
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutException("No hay navegadores libres en el pool")
+                    self._cond.wait(remaining)
+
+            if pooled is None:
+                try:
+                    pooled = self._launch()
+                except Exception:
+                    with self._cond:
+                        self._created -= 1
+                        self._cond.notify()
+                    raise
+            elif not self._is_alive(pooled):
+                # El navegador se ha caído mientras estaba libre: reemplazarlo
+                self._discard(pooled)
+                continue
+
+            pooled.uses += 1
+            return pooled
+
+    def release(self, pooled, broken=False):
+        """Devuelve un navegador al pool, reciclándolo si está gastado o roto"""
+        if not broken and pooled.uses < self.max_uses and not self._closed:
+            try:
+                self._reset(pooled)
+            except Exception:
+                broken = True
+        else:
+            broken = True
+
+        if broken:
+            if self.debug:
+                print(f"→ Reciclando navegador tras {pooled.uses} usos")
+            self._discard(pooled)
+            return
+
+        with self._cond:
+            self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """Context manager que presta un navegador y lo devuelve al terminar"""
+        pooled = self.acquire(timeout)
+        broken = False
+        try:
+            yield pooled
+        except Exception:
+            broken = not self._is_alive(pooled)
+            raise
+        finally:
+            self.release(pooled, broken=broken)
+
+    @property
+    def active(self):
+        """Número de navegadores prestados en este momento"""
+        with self._cond:
+            return self._created - len(self._idle)
+
+    def close(self):
+        """Cierra todos los navegadores libres y rechaza nuevos préstamos"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for pooled in idle:
+            self._discard(pooled)
@@ -0,0 +1,180 @@
+import asyncio
+import itertools
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """El usuario ya tiene demasiadas búsquedas pendientes"""
+
+
+class JobCancelledError(Exception):
+    """La búsqueda se canceló antes de terminar"""
+
+
+class JobTimeoutError(Exception):
+    """La búsqueda superó el tiempo máximo permitido"""
+
+
+def max_concurrent_for_memory(per_job_mb, reserve_mb=256):
+    """Calcula cuántos trabajos caben en la memoria disponible (mínimo 1)"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    available_mb = int(line.split()[1]) // 1024
+                    return max(1, (available_mb - reserve_mb) // per_job_mb)
+    except OSError:
+        pass
+    return 1
+
+
+class SearchJob:
+    """Búsqueda encolada en el planificador"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, user_id, func, on_cancel=None):
+        self.id = next(self._ids)
+        self.user_id = user_id
+        self.func = func
+        self.on_cancel = on_cancel
+        self.state = "queued"  # queued, running, done, cancelled, timeout, failed
+        loop = asyncio.get_running_loop()
+        self.started = asyncio.Event()  # Se activa al arrancar o al terminar sin haber arrancado
+        self._result = loop.create_future()
+
+    async def wait(self):
+        """Espera al resultado de la búsqueda"""
+        return await asyncio.shield(self._result)
+
+    def _finish(self, state, result=None, exc=None):
+        if self._result.done():
+            return
+        self.state = state
+        # Quien espera a que arranque no debe quedarse colgado si se cancela en la cola
+        self.started.set()
+        if exc is not None:
+            self._result.set_exception(exc)
+        else:
+            self._result.set_result(result)
+
+
+class SearchScheduler:
+    """Planificador de búsquedas con límite global de concurrencia y colas justas por usuario.
+
+    Los trabajos de cada usuario se atienden por turnos (round-robin), así que
+    un usuario con varias búsquedas no bloquea a los demás.
+    """
+
+    def __init__(self, max_concurrent=2, per_user_limit=3, timeout=300):
+        self.max_concurrent = max_concurrent
+        self.per_user_limit = per_user_limit
+        self.timeout = timeout
+        self._queues = OrderedDict()  # user_id -> deque de trabajos, en orden de turno
+        self._running = set()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="search")
+
+    @property
+    def queue_depth(self):
+        """Número de trabajos esperando turno"""
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def active(self):
+        """Número de trabajos en ejecución"""
+        return len(self._running)
+
+    def _user_jobs(self, user_id):
+        queued = len(self._queues.get(user_id, ()))
+        running = sum(1 for job in self._running if job.user_id == user_id)
+        return queued + running
+
+    def submit(self, user_id, func, on_cancel=None):
+        """Encola `func` (bloqueante) para el usuario y devuelve el trabajo"""
+        if self._user_jobs(user_id) >= self.per_user_limit:
+            raise QueueFullError(f"Máximo de {self.per_user_limit} búsquedas simultáneas por usuario")
+        job = SearchJob(user_id, func, on_cancel)
+        self._queues.setdefault(user_id, deque()).append(job)
+        self._dispatch()
+        return job
+
+    def position(self, job):
+        """Posición en la cola (1 = el siguiente en ejecutarse, 0 = ya en marcha o terminado)"""
+        if job.state != "queued":
+            return 0
+        queues = [list(queue) for queue in self._queues.values()]
+        position = 0
+        for round_jobs in itertools.zip_longest(*queues):
+            for queued in round_jobs:
+                if queued is None:
+                    continue
+                position += 1
+                if queued is job:
+                    return position
+        return 0
+
+    def cancel(self, job):
+        """Cancela un trabajo encolado o pide que se detenga si ya está en marcha"""
+        if job.state == "queued":
+            queue = self._queues.get(job.user_id)
+            if queue is not None and job in queue:
+                queue.remove(job)
+                if not queue:
+                    del self._queues[job.user_id]
+            job._finish("cancelled", exc=JobCancelledError())
+            return True
+        if job.state == "running":
+            if job.on_cancel:
+                job.on_cancel()
+            job._finish("cancelled", exc=JobCancelledError())
+            return True
+        return False
+
+    def cancel_user(self, user_id):
+        """Cancela todos los trabajos del usuario. Devuelve cuántos se cancelaron"""
+        jobs = list(self._queues.get(user_id, ())) + [job for job in self._running if job.user_id == user_id]
+        return sum(1 for job in jobs if self.cancel(job))
+
+    def _dispatch(self):
+        """Arranca trabajos por turnos mientras haya huecos libres"""
+        while len(self._running) < self.max_concurrent and self._queues:
+            user_id, queue = next(iter(self._queues.items()))
+            job = queue.popleft()
+            # El usuario pasa al final del turno
+            del self._queues[user_id]
+            if queue:
+                self._queues[user_id] = queue
+            self._running.add(job)
+            job.state = "running"
+            job.started.set()
+            asyncio.get_running_loop().create_task(self._run(job))
+
+    async def _run(self, job):
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, job.func)
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            job._finish("done", result=result)
+        except asyncio.TimeoutError:
+            if job.on_cancel:
+                job.on_cancel()
+            job._finish("timeout", exc=JobTimeoutError(f"La búsqueda superó {self.timeout}s"))
+        except Exception as e:
+            job._finish("failed", exc=e)
+        finally:
+            # El hueco no se libera hasta que el hilo termina de verdad
+            try:
+                await future
+            except Exception:
+                pass
+            self._running.discard(job)
+            self._dispatch()
+
+    def shutdown(self):
+        """Cancela lo pendiente y detiene los trabajos en marcha"""
+        for user_id in list(self._queues):
+            self.cancel_user(user_id)
+        for job in list(self._running):
+            self.cancel(job)
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,396 @@
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    item_id TEXT PRIMARY KEY,
+    link TEXT NOT NULL,
+    title TEXT NOT NULL,
+    location TEXT,
+    search_term TEXT,
+    price_cents INTEGER,
+    previous_price_cents INTEGER,
+    reserved INTEGER NOT NULL DEFAULT 0,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    price_changed_at REAL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_items_term_first_seen ON items (search_term, first_seen);
+CREATE INDEX IF NOT EXISTS idx_items_first_seen ON items (first_seen);
+CREATE INDEX IF NOT EXISTS idx_items_price_changed ON items (price_changed_at)
+    WHERE price_changed_at IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    search_term TEXT NOT NULL,
+    started_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_term_started ON runs (search_term, started_at);
+
+-- Términos con los que ha aparecido cada anuncio. items.search_term sólo
+-- guarda el primero; un anuncio encontrado con "iphone" y luego con
+-- "iphone 12" pertenece a las dos búsquedas.
+CREATE TABLE IF NOT EXISTS item_terms (
+    search_term TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    PRIMARY KEY (search_term, item_id)
+) WITHOUT ROWID;
+
+-- Índice de texto completo de títulos y descripciones. La tabla items no
+-- tiene rowid, así que search_docs asigna a cada anuncio el rowid de su
+-- documento en el índice.
+CREATE TABLE IF NOT EXISTS search_docs (
+    doc INTEGER PRIMARY KEY,
+    item_id TEXT NOT NULL UNIQUE
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+    title, description, tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+UPSERT_SQL = """
+INSERT INTO items (item_id, link, title, location, search_term, price_cents, reserved, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (item_id) DO UPDATE SET
+    link = excluded.link,
+    title = excluded.title,
+    location = excluded.location,
+    reserved = excluded.reserved,
+    last_seen = excluded.last_seen,
+    previous_price_cents = CASE WHEN excluded.price_cents IS NOT items.price_cents
+                                THEN items.price_cents ELSE items.previous_price_cents END,
+    price_changed_at = CASE WHEN excluded.price_cents IS NOT items.price_cents
+                            THEN excluded.last_seen ELSE items.price_changed_at END,
+    price_cents = excluded.price_cents
+"""
+
+ITEM_COLUMNS = "item_id, link, title, location, search_term, price_cents, previous_price_cents, reserved, first_seen, last_seen"
+
+# Máximo de parámetros por consulta IN (...) en SQLite
+_CHUNK = 500
+
+# Peso de cada columna del índice en la relevancia (bm25): el título cuenta más
+_BM25_WEIGHTS = "3.0, 1.0"
+
+# Condición "el anuncio pertenece a la búsqueda ?" (por item_terms, no por items.search_term)
+_IN_TERM = "EXISTS (SELECT 1 FROM item_terms t WHERE t.search_term = ? AND t.item_id = {alias}.item_id)"
+
+_QUERY_TOKENS = re.compile(r'(-?)(?:"([^"]*)"|(\S+))')
+
+
+def fts_query(text):
+    """Traduce una búsqueda de usuario a FTS5. Devuelve (incluir, excluir), cada uno o None.
+
+    Las palabras sueltas casan por prefijo ("256" encuentra "256gb"), lo que
+    va entre comillas se busca como frase y lo precedido de "-" se excluye:
+    'iphone "pro max" -roto' -> ('"iphone"* AND "pro max"', '"roto"*').
+    """
+    include, exclude = [], []
+    for negated, phrase, word in _QUERY_TOKENS.findall(text or ""):
+        if phrase:
+            term = '"' + phrase.replace('"', '""') + '"'
+        else:
+            word = word.strip('"')
+            if not re.search(r'\w', word):
+                continue
+            term = '"' + word.replace('"', '""') + '"*'
+        (exclude if negated else include).append(term)
+    return (" AND ".join(include) or None), (" OR ".join(exclude) or None)
+
+
+def normalize_term(search_term):
+    """Término de búsqueda normalizado: sin mayúsculas ni espacios sobrantes"""
+    return ' '.join(search_term.lower().split())
+
+
+def item_id_from_link(link):
+    """Identificador estable de un anuncio: el slug final de su URL"""
+    return urlparse(link).path.rstrip('/').rsplit('/', 1)[-1]
+
+
+class ItemStore:
+    """Almacén persistente en SQLite de los anuncios vistos entre ejecuciones.
+
+    Guarda por anuncio la primera y la última vez que se vio, el precio
+    actual y el anterior, y si está reservado. Permite consultar qué hay de
+    nuevo desde la última ejecución y qué ha bajado de precio.
+
+    Los términos de búsqueda se guardan y consultan normalizados
+    (normalize_term), así que "iPhone 12" e "iphone  12" son la misma búsqueda.
+    """
+
+    def __init__(self, path="wallapop.db"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._normalize_terms()
+        self._backfill_terms()
+        self._backfill_index()
+
+    def _normalize_terms(self):
+        """Normaliza los términos guardados antes de que se normalizaran al escribir"""
+        with self._lock, self._conn:
+            for table in ("items", "runs"):
+                terms = [row[0] for row in self._conn.execute(
+                    f"SELECT DISTINCT search_term FROM {table} WHERE search_term IS NOT NULL"
+                )]
+                self._conn.executemany(
+                    f"UPDATE {table} SET search_term = ? WHERE search_term = ?",
+                    [(normalize_term(term), term) for term in terms if normalize_term(term) != term]
+                )
+
+    def _backfill_terms(self):
+        """Enlaza con su término los anuncios guardados antes de que existiera item_terms"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO item_terms (search_term, item_id) "
+                "SELECT search_term, item_id FROM items WHERE search_term IS NOT NULL"
+            )
+
+    def _backfill_index(self):
+        """Indexa los anuncios guardados antes de que existiera el índice de texto"""
+        with self._lock, self._conn:
+            missing = self._conn.execute(
+                "SELECT item_id, title FROM items WHERE item_id NOT IN (SELECT item_id FROM search_docs)"
+            ).fetchall()
+            if missing:
+                self._index_rows([(row[0], row[1], None) for row in missing])
+
+    def _index_rows(self, rows):
+        """(Re)indexa filas (item_id, título, descripción).
+
+        Hay que llamarla con el lock tomado y dentro de una transacción.
+        """
+        self._conn.executemany("INSERT OR IGNORE INTO search_docs (item_id) VALUES (?)", [(r[0],) for r in rows])
+        docs = {}
+        ids = [r[0] for r in rows]
+        for i in range(0, len(ids), _CHUNK):
+            chunk = ids[i:i + _CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            docs.update(self._conn.execute(
+                f"SELECT item_id, doc FROM search_docs WHERE item_id IN ({placeholders})", chunk
+            ))
+        # Sin descripción nueva se conserva la ya indexada (de un enriquecimiento anterior)
+        described = {}
+        keep = [docs[r[0]] for r in rows if r[2] is None]
+        for i in range(0, len(keep), _CHUNK):
+            chunk = keep[i:i + _CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            described.update(self._conn.execute(
+                f"SELECT rowid, description FROM items_fts WHERE rowid IN ({placeholders})", chunk
+            ))
+        self._conn.executemany("DELETE FROM items_fts WHERE rowid = ?", [(docs[r[0]],) for r in rows])
+        self._conn.executemany(
+            "INSERT INTO items_fts (rowid, title, description) VALUES (?, ?, ?)",
+            [(docs[r[0]], r[1], r[2] if r[2] is not None else described.get(docs[r[0]])) for r in rows]
+        )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def start_run(self, search_term, started_at=None):
+        """Registra el inicio de una ejecución y devuelve su id"""
+        started_at = started_at or time.time()
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (search_term, started_at) VALUES (?, ?)", (normalize_term(search_term), started_at)
+            )
+            return cursor.lastrowid
+
+    def finish_run(self, run_id):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def previous_run_start(self, search_term, before=None):
+        """Inicio de la última ejecución terminada de la búsqueda, o None"""
+        before = before or time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(started_at) FROM runs "
+                "WHERE search_term = ? AND started_at < ? AND finished_at IS NOT NULL",
+                (normalize_term(search_term), before)
+            ).fetchone()
+        return row[0]
+
+    def _existing_prices(self, item_ids):
+        """Precios guardados de los anuncios que ya existen, por id"""
+        prices = {}
+        for i in range(0, len(item_ids), _CHUNK):
+            chunk = item_ids[i:i + _CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT item_id, price_cents FROM items WHERE item_id IN ({placeholders})", chunk
+            )
+            prices.update(rows)
+        return prices
+
+    def upsert_many(self, products, search_term, seen_at=None):
+        """Inserta o actualiza un lote de productos en una sola transacción.
+
+        Devuelve (nuevos, bajadas) donde `nuevos` son los productos que no
+        estaban en el almacén y `bajadas` una lista de (producto, precio
+        anterior en céntimos) para los que han bajado de precio.
+        """
+        if not products:
+            return [], []
+        seen_at = seen_at or time.time()
+        rows = []
+        for product in products:
+            rows.append((
+                item_id_from_link(product.link),
+                product.link,
+                product.title,
+                product.location,
+                normalize_term(search_term),
+                product.price_cents,
+                1 if product.reserved else 0,
+                seen_at,
+                seen_at,
+            ))
+
+        new_items, price_drops = [], []
+        with self._lock, self._conn:
+            existing = self._existing_prices([row[0] for row in rows])
+            for product, row in zip(products, rows):
+                if row[0] not in existing:
+                    new_items.append(product)
+                else:
+                    old_cents = existing[row[0]]
+                    if old_cents is not None and row[5] is not None and row[5] < old_cents:
+                        price_drops.append((product, old_cents))
+            self._conn.executemany(UPSERT_SQL, rows)
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO item_terms (search_term, item_id) VALUES (?, ?)",
+                [(row[4], row[0]) for row in rows]
+            )
+            self._index_rows([
+                (row[0], row[2], (product.details or {}).get("description"))
+                for product, row in zip(products, rows)
+            ])
+        return new_items, price_drops
+
+    def index_descriptions(self, products):
+        """Añade al índice de texto las descripciones de productos ya guardados (tras enriquecerlos)"""
+        rows = [
+            (item_id_from_link(product.link), product.title, product.details["description"])
+            for product in products if product.details and product.details.get("description")
+        ]
+        if not rows:
+            return 0
+        with self._lock, self._conn:
+            self._index_rows(rows)
+        return len(rows)
+
+    def search_text(self, text, search_term=None, price_min=None, price_max=None,
+                    include_reserved=True, limit=20):
+        """Busca en los títulos y descripciones guardados, del más al menos relevante.
+
+        `text` admite palabras (por prefijo), frases entre comillas y
+        exclusiones con "-". Los precios van en euros. Sin palabras que
+        incluir, devuelve los anuncios que no tienen las excluidas, por precio.
+        """
+        include, exclude = fts_query(text)
+        if include is None and exclude is None:
+            return []
+        params = []
+        if include is not None:
+            sql = (f"SELECT {', '.join('i.' + c for c in ITEM_COLUMNS.split(', '))}, "
+                   f"bm25(items_fts, {_BM25_WEIGHTS}) AS rank "
+                   "FROM items_fts JOIN search_docs d ON d.doc = items_fts.rowid "
+                   "JOIN items i ON i.item_id = d.item_id WHERE items_fts MATCH ?")
+            params.append(include if exclude is None else f"({include}) NOT ({exclude})")
+            order = "rank"
+        else:
+            sql = (f"SELECT {', '.join('i.' + c for c in ITEM_COLUMNS.split(', '))}, NULL AS rank "
+                   "FROM items i WHERE i.item_id NOT IN ("
+                   "SELECT d.item_id FROM items_fts JOIN search_docs d ON d.doc = items_fts.rowid "
+                   "WHERE items_fts MATCH ?)")
+            params.append(exclude)
+            order = "i.price_cents"
+        if search_term is not None:
+            sql += f" AND {_IN_TERM.format(alias='i')}"
+            params.append(normalize_term(search_term))
+        if price_min is not None:
+            sql += " AND i.price_cents >= ?"
+            params.append(round(price_min * 100))
+        if price_max is not None:
+            sql += " AND i.price_cents <= ?"
+            params.append(round(price_max * 100))
+        if not include_reserved:
+            sql += " AND i.reserved = 0"
+        sql += f" ORDER BY {order} LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def new_since(self, since, search_term=None, limit=None):
+        """Anuncios vistos por primera vez a partir de `since` (timestamp)"""
+        sql = f"SELECT {ITEM_COLUMNS} FROM items WHERE first_seen >= ?"
+        params = [since]
+        if search_term is not None:
+            sql += f" AND {_IN_TERM.format(alias='items')}"
+            params.append(normalize_term(search_term))
+        sql += " ORDER BY first_seen"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def price_drops_since(self, since, search_term=None, limit=None):
+        """Anuncios cuyo precio ha bajado a partir de `since` (timestamp)"""
+        sql = (f"SELECT {ITEM_COLUMNS} FROM items "
+               "WHERE price_changed_at >= ? AND price_cents < previous_price_cents")
+        params = [since]
+        if search_term is not None:
+            sql += f" AND {_IN_TERM.format(alias='items')}"
+            params.append(normalize_term(search_term))
+        sql += " ORDER BY price_changed_at"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def data_version(self, search_term):
+        """Última vez que se vio alguno de los anuncios de la búsqueda (0 si no tiene ninguno).
+
+        Cualquier ejecución que toque esos anuncios, sea cual sea su término,
+        la cambia. Sirve para saber si hay que recargar una caché derivada del
+        almacén.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(i.last_seen) FROM item_terms t JOIN items i ON i.item_id = t.item_id "
+                "WHERE t.search_term = ?", (normalize_term(search_term),)
+            ).fetchone()
+        return row[0] or 0.0
+
+    def history_rows(self, search_term):
+        """Filas (céntimos o -1, reservado, primera vez, última vez) de una búsqueda, por antigüedad"""
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.row_factory = None  # Tuplas simples: bastante más rápidas que sqlite3.Row
+            return cursor.execute(
+                "SELECT COALESCE(i.price_cents, -1), i.reserved, i.first_seen, i.last_seen "
+                "FROM item_terms t JOIN items i ON i.item_id = t.item_id "
+                "WHERE t.search_term = ? ORDER BY i.first_seen", (normalize_term(search_term),)
+            ).fetchall()
+
+    def known_ids(self, item_ids):
+        """Subconjunto de `item_ids` que ya están en el almacén"""
+        with self._lock:
+            return set(self._existing_prices(list(item_ids)))
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
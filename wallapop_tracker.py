@@ -1,77 +1,419 @@
+import heapq
 import os
+import queue
 import time
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, ElementClickInterceptedException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, ElementClickInterceptedException, WebDriverException
 from selenium.webdriver.common.action_chains import ActionChains
-import undetected_chromedriver as uc
+from wallapop_pool import create_driver, browser_pids, process_tree_rss
+from wallapop_blocking import BlockProfile, PROFILES, drain_network_log, network_stats
+from wallapop_api import WallapopApiClient, get_session
+from wallapop_item import Item, parse_price_cents, format_cents
+from wallapop_store import ItemStore, item_id_from_link
+from wallapop_output import ResultWriter, FORMATS, to_buffer
+from wallapop_locations import resolve_location, split_locations, LOCATIONS, DEFAULT_LOCATION
+from wallapop_watch import SeenItems, jittered
+from wallapop_metrics import PhaseTimer
+from wallapop_analytics import price_summary
+from wallapop_checkpoint import write_checkpoint, read_checkpoint, remove_checkpoint
+from wallapop_enrich import DetailCache, DetailEnricher
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import argparse
-import csv
 import traceback
-import json
 import sys
+import threading
+import numpy as np
+import requests
+
+# Vacía las tarjetas [from, to) que no se hayan vaciado ya: quita sus nodos
+# hijos (imágenes incluidas) y fija su tamaño, para que la altura de la página y
+# con ella el scroll infinito no cambien. La tarjeta se queda en el DOM, así que
+# los índices de las tarjetas siguientes no se mueven. Primero se miden todas y
+# después se vacían, para no forzar un layout por tarjeta.
+PRUNE_CARDS_FN = """
+function pruneCards(cards, from, to) {
+    const targets = [];
+    for (let i = from; i < to; i++) {
+        if (!cards[i].dataset.pruned) { targets.push(cards[i]); }
+    }
+    const sizes = targets.map((card) => card.getBoundingClientRect());
+    targets.forEach((card, i) => {
+        card.style.boxSizing = 'border-box';
+        card.style.height = sizes[i].height + 'px';
+        card.style.width = sizes[i].width + 'px';
+        card.replaceChildren();
+        card.dataset.pruned = '1';
+    });
+    return targets.length;
+}
+"""
+
+PRUNE_CARDS_JS = PRUNE_CARDS_FN + """
+return pruneCards(document.querySelectorAll('tsl-public-item-card .ItemCard'), arguments[0], arguments[1]);
+"""
+
+# Tarjetas a partir del índice `arguments[0]` como WebElements, sin pedir las
+# anteriores (con la poda, find_elements devolvería también las vaciadas).
+NEW_CARDS_JS = """
+const cards = document.querySelectorAll('tsl-public-item-card .ItemCard');
+let start = arguments[0] || 0;
+if (start > cards.length) { start = 0; }
+return {start: start, cards: Array.prototype.slice.call(cards, start)};
+"""
+
+# Extrae en una sola llamada a execute_script las tarjetas a partir del índice
+# `arguments[0]`. Replica la lógica de extract_product_info, incluidos los tres
+# métodos para detectar productos reservados. Si la página se ha vuelto a
+# renderizar y hay menos tarjetas que el índice, empieza desde el principio.
+# Con `arguments[1]` (índice de la primera tarjeta sin vaciar) vacía también,
+# en la misma llamada, todas las tarjetas ya extraídas.
+EXTRACT_CARDS_JS = PRUNE_CARDS_FN + """
+const cards = document.querySelectorAll('tsl-public-item-card .ItemCard');
+let start = arguments[0] || 0;
+if (start > cards.length) { start = 0; }
+const out = [];
+for (let i = start; i < cards.length; i++) {
+    const card = cards[i];
+    const titleEl = card.querySelector('p.ItemCard__title');
+    const anchor = card.parentElement ? card.parentElement.closest('a') : null;
+    if (!titleEl || !anchor) {
+        out.push(null);
+        continue;
+    }
+    const priceEl = card.querySelector('span.ItemCard__price');
+    const locationEl = card.querySelector('.ItemCard__location');
+    let reserved = false;
+    for (const badge of card.querySelectorAll('.ItemCard__badge wallapop-badge')) {
+        if (badge.outerHTML.includes('Reservado')) { reserved = true; break; }
+    }
+    if (!reserved) {
+        for (const icon of card.querySelectorAll('walla-icon')) {
+            let sibling = icon.nextElementSibling;
+            while (sibling && sibling.tagName !== 'SPAN') { sibling = sibling.nextElementSibling; }
+            if (sibling && sibling.innerText.includes('Reservado')) { reserved = true; break; }
+        }
+    }
+    if (!reserved && card.innerText.includes('Reservado')) {
+        reserved = true;
+    }
+    out.push({
+        title: titleEl.innerText.trim(),
+        price: priceEl ? priceEl.innerText.trim() : '0',
+        location: locationEl ? locationEl.innerText.trim() : 'Ubicación no disponible',
+        link: anchor.href,
+        reserved: reserved
+    });
+}
+let pruned = 0;
+if (arguments[1] !== null && arguments[1] !== undefined) {
+    pruned = pruneCards(cards, Math.min(arguments[1], start), cards.length);
+}
+return {start: start, cards: out, pruned: pruned};
+"""
+
+# Estado de la página usado por las esperas: número de tarjetas y altura.
+PAGE_STATE_JS = """
+return [document.querySelectorAll('tsl-public-item-card .ItemCard').length,
+        document.documentElement.scrollHeight];
+"""
+
+# Espera dentro del navegador a que cambie el número de tarjetas o la altura de
+# la página (MutationObserver), a que la red quede inactiva (PerformanceObserver)
+# o a que se agote el tiempo. Devuelve el motivo y el estado final.
+WAIT_FOR_CHANGE_JS = """
+const [cards0, height0, timeoutMs, idleMs] = arguments;
+const done = arguments[arguments.length - 1];
+const state = () => [document.querySelectorAll('tsl-public-item-card .ItemCard').length,
+                     document.documentElement.scrollHeight];
+const started = performance.now();
+let lastActivity = started;
+let finished = false;
+let observer = null;
+let perf = null;
+let timer = null;
+const finish = (reason) => {
+    if (finished) { return; }
+    finished = true;
+    if (observer) { observer.disconnect(); }
+    if (perf) { perf.disconnect(); }
+    clearInterval(timer);
+    const [cards, height] = state();
+    done({reason: reason, cards: cards, height: height});
+};
+const check = () => {
+    const [cards, height] = state();
+    if (cards !== cards0 || (height0 !== null && height !== height0)) { finish('changed'); }
+};
+observer = new MutationObserver(() => { lastActivity = performance.now(); check(); });
+observer.observe(document.documentElement, {childList: true, subtree: true});
+try {
+    perf = new PerformanceObserver(() => { lastActivity = performance.now(); });
+    perf.observe({entryTypes: ['resource']});
+} catch (e) {}
+timer = setInterval(() => {
+    const now = performance.now();
+    if (now - started >= timeoutMs) { finish('timeout'); }
+    else if (idleMs !== null && now - lastActivity >= idleMs) { finish('idle'); }
+}, 50);
+check();
+"""
+
+
+# Motivos por los que una búsqueda termina antes de recorrerse entera
+STOP_REASONS = {
+    "max_items": "alcanzado el máximo de productos",
+    "deadline": "agotado el tiempo máximo de la búsqueda",
+    "phase_timeout": "una fase ha superado su tiempo máximo",
+    "known_items": "alcanzados anuncios ya vistos en ejecuciones anteriores",
+}
+
+PAGE_LOAD_TIMEOUT = 300  # El de Chrome por defecto
+FANOUT_FLUSH = 200  # Productos entre escrituras al almacén al combinar varias ubicaciones
+
+# Configuración que las búsquedas por ubicación heredan de la búsqueda en varias ubicaciones
+FANOUT_SETTINGS = (
+    "base_url", "headless", "max_scrolls", "save_directory", "load_images", "block_profile",
+    "allowed_domains", "price_min", "price_max", "debug", "backend", "api_url", "extraction_mode",
+    "wait_timeout", "network_idle", "max_items", "phase_timeout", "prune_dom",
+)
+
+_FANOUT_DONE = object()  # Fin de los productos de una ubicación
+API_TIMEOUT = 15  # Segundos por petición a la API
+
+
+def _price_key(product):
+    """Orden por precio con los productos sin precio al final"""
+    return (product.price_cents is None, product.price_cents or 0)
+
 
 class WallapopScraper:
-    def __init__(self, search_term, location=None):
+    def __init__(self, search_term, location=None, pool=None):
         self.search_term = search_term
         self.location = location if location else "madrid"
         self.base_url = "https://es.wallapop.com"
-        self.search_url = self._build_search_url()
         self.headless = True
         self.driver = None
         self.wait = None
+        self.pool = pool
+        self._lease = None
+        self._commands_at_start = 0  # Comandos que ya llevaba el navegador al obtenerlo
         self.results = []
         self.last_height = 0
         self.no_new_items_count = 0
         self.max_scrolls = 3
         self.save_directory = "resultados"
         self.load_images = False
+        self.block_profile = "minimal"  # Perfil de bloqueo de recursos: none, minimal o aggressive
+        self.allowed_domains = []  # Dominios que nunca se bloquean
+        self.network_stats = None
         self.price_min = None
         self.price_max = None
         self.debug = False
+        self.backend = "browser"  # "browser" (Chromium) o "http" (API JSON)
+        self.api_url = None  # Endpoint de la API; por defecto WALLAPOP_API_URL o el oficial
+        self.extraction_mode = "bulk"  # "bulk" (una llamada JS por página) o "element"
+        self.command_count = 0
+        self._card_index = 0  # Índice de la primera tarjeta aún no extraída
+        self.prune_dom = False  # Vaciar las tarjetas ya extraídas para que el navegador no crezca sin límite
+        self._pruned_index = 0  # Índice de la primera tarjeta aún no vaciada
+        self.memory_samples = []  # (scroll, tarjetas, RSS del navegador en bytes) tras cada scroll
+        self._stop_event = threading.Event()
+        self.store = None  # ItemStore opcional para deduplicar entre ejecuciones
+        self.new_items = []  # Productos que no estaban en el almacén
+        self.price_drops = []  # (producto, precio anterior en céntimos)
+        self._pending = []  # Productos pendientes de guardar en el almacén
+        self.auto_save = True  # Guardar los resultados en disco al terminar scrape()
+        self.output_format = "csv"  # Formato de los resultados: csv, csv.gz, jsonl o parquet
+        self.stream_format = None  # "csv" o "jsonl": escribir en disco según se extrae
+        self.total_scrolls = 0
+        self.wait_timeout = 10  # Máximo de segundos esperando a que cambie la página
+        self.network_idle = 0.5  # Segundos sin actividad para considerar la red inactiva
+        self.metrics = PhaseTimer()  # Tiempo por fase y contadores de la ejecución
+        self.checkpoint_path = None  # Fichero de checkpoint; None desactiva los checkpoints
+        self.checkpoint_every = 5  # Scrolls (o páginas de la API) entre checkpoints
+        self.resume = False  # Reanudar desde el checkpoint si existe
+        self._resume_progress = None  # Progreso recuperado del checkpoint
+        self._resumed = False
+        self._cursor = None  # Cursor de la siguiente página de la API
+        self._api_end = False  # La API ya no tiene más páginas
+        self.enrich = False  # Completar los resultados con su página de detalle
+        self.enrich_workers = 8  # Descargas de páginas de detalle en paralelo
+        self.detail_cache_path = "wallapop_details.db"  # Caché de páginas de detalle; None la desactiva
+        self.max_items = None  # Parar al reunir este número de productos
+        self.deadline = None  # Segundos máximos de la búsqueda completa
+        self.phase_timeout = None  # Segundos máximos de cada fase (carga, espera, petición)
+        self.newest_first = False  # Ordenar por novedad y parar al llegar a anuncios ya vistos
+        self.known_stop = 5  # Anuncios ya vistos seguidos que indican que no queda nada nuevo
+        self.known_ids = None  # Función ids -> ids ya vistos para newest_first; por defecto, los del almacén
+        self.stop_reason = None  # Límite que ha terminado la búsqueda (clave de STOP_REASONS)
+        self._deadline_at = None
+        self._known_streak = 0
+        self.order_by = None  # Orden de Wallapop (p. ej. price_low_to_high); None, por relevancia
+        self.locations = None  # Ubicaciones de la búsqueda; por defecto, las de `location` separadas por comas
+        self.fanout_workers = 4  # Ubicaciones buscadas a la vez
+        self.pool_slots = 1  # Navegadores del pool reservados para esta búsqueda (uno por trabajo del planificador)
+        self.show_progress = True  # Mostrar el contador de productos según se encuentran
+        self._children = []  # Búsquedas por ubicación en curso
+        self.failed_locations = []  # Ubicaciones cuya búsqueda falló
 
-        # Configuración del driver
-        options = uc.ChromeOptions()
-        options.binary_location = os.getenv('CHROME_BIN', '/usr/bin/chromium')
-        options.add_argument('--headless')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        
-        if not self.load_images:
-            prefs = {"profile.managed_default_content_settings.images": 2}
-            options.add_experimental_option("prefs", prefs)
-        
+    def stop(self):
+        """Pide que el scraping en curso termine cuanto antes (desde otro hilo)"""
+        self._stop_event.set()
+        for child in list(self._children):
+            child.stop()
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def _time_left(self, timeout):
+        """Acota el tiempo de una fase por `phase_timeout` y por lo que queda hasta `deadline`"""
+        if self.phase_timeout is not None:
+            timeout = min(timeout, self.phase_timeout)
+        if self._deadline_at is not None:
+            timeout = min(timeout, self._deadline_at - time.monotonic())
+        return max(timeout, 0.1)
+
+    def _budget_exhausted(self):
+        """Comprueba los límites de la búsqueda; anota en `stop_reason` el primero alcanzado"""
+        if self.stop_reason is None:
+            if self.max_items is not None and len(self.results) >= self.max_items:
+                self.stop_reason = "max_items"
+            elif self._deadline_at is not None and time.monotonic() >= self._deadline_at:
+                self.stop_reason = "deadline"
+        return self.stop_reason is not None
+
+    def start_driver(self):
+        """Obtiene un navegador: prestado del pool si existe, o uno propio"""
         try:
-            self.driver = uc.Chrome(
-                driver_executable_path=os.getenv('CHROMEDRIVER_PATH', '/usr/bin/chromedriver'),
-                options=options,
-                version_main=119  # Especificar versión para evitar warning
-            )
-            # Inicializar el wait después de crear el driver
-            self.wait = WebDriverWait(self.driver, 15)
+            with self.metrics.span("driver_start"):
+                if self.pool is not None:
+                    self._lease = self.pool.acquire()
+                    self.driver = self._lease.driver
+                else:
+                    # Los navegadores del pool usan el perfil de bloqueo del pool
+                    profile = BlockProfile.from_name(self.block_profile, self.allowed_domains)
+                    if self.load_images:
+                        # Con imágenes activadas el perfil no debe volver a bloquearlas
+                        profile.resource_types = [t for t in profile.resource_types if t != "images"]
+                    self.driver = create_driver(load_images=self.load_images, block_profile=profile)
+            drain_network_log(self.driver)
+            self._commands_at_start = self.driver.command_count
+            # Inicializar el wait después de obtener el driver
+            self.wait = WebDriverWait(self.driver, self._time_left(15))
+            self.driver.set_script_timeout(self.wait_timeout + 5)
+            self.driver.set_page_load_timeout(self._time_left(PAGE_LOAD_TIMEOUT))
             if self.debug:
                 print("✓ Driver inicializado correctamente")
         except Exception as e:
             print(f"Error al inicializar el driver: {str(e)}")
             raise
 
+    def stop_driver(self, broken=False):
+        """Devuelve el navegador al pool o lo cierra si es propio.
+
+        Sirve también si start_driver falló a medias: el préstamo del pool se
+        devuelve siempre, antes de actualizar los contadores.
+        """
+        driver, lease = self.driver, self._lease
+        self.driver = None
+        self.wait = None
+        self._lease = None
+        commands_at_end = driver.command_count if driver is not None else self._commands_at_start
+        if lease is not None:
+            self.pool.release(lease, broken=broken)
+            print("\n→ Navegador devuelto al pool")
+        elif driver is not None:
+            driver.quit()
+            print("\n→ Navegador cerrado")
+        self.command_count = commands_at_end - self._commands_at_start
+        self.metrics.count("webdriver_commands", self.command_count)
+
+    def _coordinates(self):
+        """Coordenadas de la ubicación de búsqueda, según la tabla local de ubicaciones"""
+        coordinates = resolve_location(self.location)
+        if coordinates is None:
+            print(f"⚠️ Ubicación desconocida '{self.location}', se usa {DEFAULT_LOCATION}")
+            coordinates = LOCATIONS[DEFAULT_LOCATION]
+        return coordinates
+
+    def _search_params(self):
+        """Parámetros de búsqueda comunes a la web y a la API.
+
+        Los límites de precio se envían a Wallapop para que filtre en el
+        servidor; el filtro local de _add_product queda como red de seguridad.
+        """
+        latitude, longitude = self._coordinates()
+        params = {
+            "keywords": self.search_term,
+            "latitude": f"{latitude:.4f}",
+            "longitude": f"{longitude:.4f}",
+        }
+        if self.price_min is not None:
+            params["min_sale_price"] = f"{self.price_min:g}"
+        if self.price_max is not None:
+            params["max_sale_price"] = f"{self.price_max:g}"
+        order_by = "newest" if self.newest_first else self.order_by
+        if order_by:
+            params["order_by"] = order_by
+        return params
+
+    @property
+    def search_url(self):
+        return self._build_search_url()
+
     def _build_search_url(self):
         """Construye la URL de búsqueda con los parámetros especificados"""
-        from urllib.parse import quote
-        search_term_encoded = quote(self.search_term)
-        return f"{self.base_url}/app/search?keywords={search_term_encoded}&latitude=40.4168&longitude=-3.7038"
+        from urllib.parse import urlencode, quote
+        return f"{self.base_url}/app/search?{urlencode(self._search_params(), quote_via=quote)}"
+
+    def page_state(self):
+        """Devuelve (número de tarjetas, altura de la página)"""
+        cards, height = self.driver.execute_script(PAGE_STATE_JS)
+        return cards, height
+
+    def wait_for_change(self, cards, height=None, timeout=None, idle=None):
+        """Espera a que cambie el número de tarjetas o la altura de la página.
+
+        Vuelve en cuanto hay cambios, cuando la red lleva `idle` segundos
+        inactiva (si se indica) o al agotarse `timeout`. Devuelve el nuevo
+        estado (tarjetas, altura).
+        """
+        timeout = self._time_left(self.wait_timeout if timeout is None else timeout)
+        try:
+            state = self.driver.execute_async_script(
+                WAIT_FOR_CHANGE_JS, cards, height, int(timeout * 1000),
+                int(idle * 1000) if idle is not None else None
+            )
+            if self.debug:
+                print(f"  → Espera terminada ({state['reason']})")
+            return state['cards'], state['height']
+        except WebDriverException:
+            # La página ha navegado o el script ha fallado: sondear con backoff
+            return self._poll_for_change(cards, height, timeout)
+
+    def _poll_for_change(self, cards, height, timeout):
+        """Sondea el estado de la página con un intervalo creciente"""
+        deadline = time.monotonic() + timeout
+        delay = 0.1
+        state = self.page_state()
+        while state[0] == cards and (height is None or state[1] == height):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 1.5, 1.0)
+            state = self.page_state()
+        return state
 
     def accept_cookies(self):
         """Acepta las cookies si aparece el diálogo"""
         try:
             # Esperar hasta 10 segundos a que aparezca el botón de cookies
-            cookie_button = WebDriverWait(self.driver, 10).until(
+            cookie_button = WebDriverWait(self.driver, self._time_left(10)).until(
                 EC.element_to_be_clickable((By.ID, "onetrust-accept-btn-handler"))
             )
             # Intentar hacer click
@@ -97,17 +439,15 @@ class WallapopScraper:
         """Hace click en el botón 'Ver más productos' si está disponible"""
         try:
             # Contar productos actuales
-            initial_count = len(self.driver.find_elements(By.CSS_SELECTOR, "tsl-public-item-card .ItemCard"))
+            initial_count, height = self.page_state()
             if self.debug:
                 print(f"  → Productos iniciales: {initial_count}")
 
             # Hacer scroll al 83%
-            height = self.driver.execute_script("return document.documentElement.scrollHeight")
             scroll_to = int(height * 0.83)
             self.driver.execute_script(f"window.scrollTo(0, {scroll_to});")
-            time.sleep(2)  # Esperar a que se estabilice el scroll
 
-            # Encontrar el botón
+            # Encontrar el botón (el wait vuelve en cuanto aparece)
             load_more_button = self.wait.until(
                 EC.presence_of_element_located((By.ID, "btn-load-more"))
             )
@@ -121,10 +461,10 @@ class WallapopScraper:
                 self.driver.execute_script("arguments[0].click();", load_more_button)
             
             print("  → Click en 'Ver más productos'")
-            time.sleep(3)  # Esperar a que carguen los nuevos productos
+            # Esperar a que carguen los nuevos productos
+            current_count, _ = self.wait_for_change(initial_count)
 
             # Verificar si se cargaron nuevos productos
-            current_count = len(self.driver.find_elements(By.CSS_SELECTOR, "tsl-public-item-card .ItemCard"))
             if current_count > initial_count:
                 if self.debug:
                     print(f"  → Nuevos productos cargados: {current_count - initial_count}")
@@ -149,8 +489,8 @@ class WallapopScraper:
             partial (bool): Si es True, hace scroll al 83% para encontrar el botón. Si es False, scroll completo.
         """
         try:
-            # Obtener altura actual
-            last_height = self.driver.execute_script("return document.documentElement.scrollHeight")
+            # Obtener estado actual
+            cards, last_height = self.page_state()
             
             # Hacer scroll
             if partial:
@@ -161,11 +501,10 @@ class WallapopScraper:
                 # Scroll completo
                 self.driver.execute_script("window.scrollTo(0, document.documentElement.scrollHeight);")
             
-            # Esperar a que la página cargue
-            time.sleep(2)
+            # Esperar a que la página cargue nuevos productos o la red quede inactiva
+            _, new_height = self.wait_for_change(cards, last_height, idle=self.network_idle)
             
             # Verificar si el scroll funcionó
-            new_height = self.driver.execute_script("return document.documentElement.scrollHeight")
             if new_height > last_height:
                 if self.debug:
                     print(f"  → Scroll exitoso: altura anterior {last_height}, nueva altura {new_height}")
@@ -252,17 +591,8 @@ class WallapopScraper:
                     print("Falta título o link")
                 return None
 
-            # Limpiar el precio (quitar el símbolo € y espacios)
-            price = price.replace("€", "").strip()
-            
-            # Devolver los campos necesarios incluyendo reserved
-            return {
-                "title": title,
-                "price": price,
-                "location": location,
-                "link": link,
-                "reserved": "Sí" if reserved else "No"
-            }
+            # Devolver los campos necesarios incluyendo reserved, con el precio ya en céntimos
+            return Item(title, parse_price_cents(price), location, link, reserved)
 
         except Exception as e:
             if self.debug:
@@ -271,174 +601,609 @@ class WallapopScraper:
                 print(traceback.format_exc())
             return None
 
+    def extract_products(self):
+        """Extrae la información de las tarjetas añadidas desde la última llamada"""
+        if self.extraction_mode == "element":
+            if self.prune_dom:
+                # Sólo las tarjetas nuevas: las vaciadas no interesan y su número no para de crecer
+                batch = self.driver.execute_script(NEW_CARDS_JS, self._card_index)
+                self._card_index, new_cards = batch['start'], batch['cards']
+                self._pruned_index = min(self._pruned_index, self._card_index)
+            else:
+                cards = self.driver.find_elements(By.CSS_SELECTOR, "tsl-public-item-card .ItemCard")
+                if len(cards) < self._card_index:
+                    # La página se ha vuelto a renderizar: empezar de nuevo
+                    self._card_index = 0
+                new_cards = cards[self._card_index:]
+            self._card_index += len(new_cards)
+            self.metrics.count("cards_seen", len(new_cards))
+            products = [self.extract_product_info(card) for card in new_cards]
+            if self.prune_dom:
+                self.prune_cards(self._card_index)
+            return products
+
+        batch = self.driver.execute_script(EXTRACT_CARDS_JS, self._card_index,
+                                           self._pruned_index if self.prune_dom else None)
+        self._card_index = batch['start'] + len(batch['cards'])
+        self.metrics.count("cards_seen", len(batch['cards']))
+        if self.prune_dom:
+            self._pruned_index = self._card_index
+            self.metrics.count("cards_pruned", batch['pruned'])
+        products = []
+        for raw in batch['cards']:
+            if not raw or not raw['title'] or not raw['link']:
+                if self.debug:
+                    print("Falta título o link")
+                products.append(None)
+                continue
+            products.append(Item(
+                raw['title'], parse_price_cents(raw['price']), raw['location'], raw['link'], raw['reserved']
+            ))
+        return products
+
+    def prune_cards(self, upto):
+        """Vacía las tarjetas cargadas antes del índice `upto` que aún no se hayan vaciado"""
+        pruned = self.driver.execute_script(PRUNE_CARDS_JS, self._pruned_index, upto)
+        self._pruned_index = upto
+        self.metrics.count("cards_pruned", pruned)
+
+    def sample_memory(self):
+        """Anota la memoria del navegador (RSS de Chromium y sus procesos) tras un scroll"""
+        rss = process_tree_rss(browser_pids(self.driver))
+        if not rss:
+            return None  # Sin /proc o sin procesos conocidos del navegador
+        self.memory_samples.append((self.total_scrolls, self._card_index, rss))
+        if self.debug:
+            print(f"  → Memoria del navegador: {rss / 1024 / 1024:.0f} MB con {self._card_index} tarjetas")
+        return rss
+
+    def enrich_results(self):
+        """Completa los resultados con la descripción, fecha, vendedor y envío de su página de detalle"""
+        if not self.results:
+            return None
+        print(f"\n→ Enriqueciendo {len(self.results)} productos con su página de detalle...")
+        cache = DetailCache(self.detail_cache_path) if self.detail_cache_path else None
+        try:
+            with self.metrics.span("enrich"):
+                stats = DetailEnricher(cache, workers=self.enrich_workers).enrich(
+                    self.results, should_stop=lambda: self.stopped
+                )
+        finally:
+            if cache is not None:
+                cache.close()
+        self.metrics.count("details_fetched", stats["fetched"])
+        self.metrics.count("details_cached", stats["cached"] + stats["not_modified"])
+        self.metrics.count("details_failed", stats["failed"])
+        print(f"  Detalles: {stats['fetched']} descargados, {stats['not_modified']} sin cambios, "
+              f"{stats['cached']} desde la caché, {stats['failed']} con error")
+        if self.store is not None:
+            # Las descripciones también se pueden consultar después con "filtrar"
+            self.store.index_descriptions(self.results)
+        return stats
+
+    def to_buffer(self, fmt=None):
+        """Devuelve los resultados serializados en memoria (BytesIO) en el formato indicado"""
+        return to_buffer(self.results, fmt or self.output_format)
+
     def save_results(self):
-        """Guarda los resultados en archivo CSV y devuelve la ruta del archivo"""
+        """Guarda los resultados en disco en `output_format` y devuelve la ruta del archivo"""
         try:
             if not self.results:
                 print("No hay resultados para guardar")
                 return None
 
-            # Crear directorio si no existe
-            os.makedirs(self.save_directory, exist_ok=True)
-            
             # Generar nombre de archivo con timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            csv_filename = os.path.join(self.save_directory, f"wallapop_{self.search_term}_{timestamp}.csv")
-            
-            # Filtrar solo los campos que queremos en el CSV
-            filtered_results = []
-            for result in self.results:
-                filtered_result = {
-                    'title': result['title'],
-                    'price': result['price'],
-                    'location': result['location'],
-                    'link': result['link'],
-                    'reserved': result['reserved']
-                }
-                filtered_results.append(filtered_result)
-            
-            # Guardar en CSV
-            with open(csv_filename, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=['title', 'price', 'location', 'link', 'reserved'])
-                writer.writeheader()
-                writer.writerows(filtered_results)
+            filename = self._output_path(FORMATS[self.output_format])
             
-            print(f"\n✓ Resultados guardados en: {csv_filename}")
+            # Serializar en memoria y escribir de una vez
+            with self.metrics.span("save_results"):
+                data = self.to_buffer().getvalue()
+                with open(filename, 'wb') as f:
+                    f.write(data)
             
-            # Mostrar estadísticas de precios
-            prices = [float(r['price'].replace(',', '.')) for r in self.results if r['price'].replace(',', '.').replace('.', '').isdigit()]
-            if prices:
-                avg_price = sum(prices) / len(prices)
-                min_price = min(prices)
-                max_price = max(prices)
-                print(f"  - Precio promedio: {avg_price:.2f}€")
-                print(f"  - Precio mínimo: {min_price:.2f}€")
-                print(f"  - Precio máximo: {max_price:.2f}€")
+            print(f"\n✓ Resultados guardados en: {filename}")
+            self.print_price_stats()
             
-            return csv_filename
+            return filename
             
         except Exception as e:
             print(f"Error al guardar resultados: {str(e)}")
             return None
 
-    def scrape(self):
-        """Realiza el scraping principal"""
+    def _output_path(self, extension):
+        """Ruta de salida con timestamp dentro del directorio de resultados"""
+        # Crear directorio si no existe
+        os.makedirs(self.save_directory, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        return os.path.join(self.save_directory, f"wallapop_{self.search_term}_{timestamp}.{extension}")
+
+    def print_price_stats(self):
+        """Muestra estadísticas de precios de los resultados"""
+        prices = np.fromiter(
+            (item.price_cents if item.price_cents is not None else -1 for item in self.results),
+            dtype=np.int64, count=len(self.results)
+        )
+        stats = price_summary(prices, [item.reserved for item in self.results])
+        if stats:
+            print(f"  - Precio promedio: {stats['mean']:.2f}€")
+            print(f"  - Precio mediano: {stats['median']:.2f}€ (P25–P75: {stats['p25']:.2f}€ – {stats['p75']:.2f}€)")
+            print(f"  - Precio mínimo: {stats['min']:.2f}€")
+            print(f"  - Precio máximo: {stats['max']:.2f}€")
+            print(f"  - Reservados: {stats['reserved_ratio']:.0%}")
+
+    def _add_product(self, product_info, processed_links):
+        """Añade un producto a los resultados si es nuevo y pasa los filtros de precio"""
         try:
-            print(f"→ Buscando '{self.search_term}' en Wallapop...")
-            
-            self.driver.get(self.search_url)
-            print("✓ Página cargada")
-            
-            self.accept_cookies()
-            
-            # Esperar un momento para que la página se estabilice
-            time.sleep(2)
-            
-            # Realizar 3 clicks exactamente en X:45, Y:220
-            print("→ Realizando clicks iniciales en (45, 220)...")
+            if not product_info:
+                self.metrics.count("invalid_cards")
+                return False
+            if product_info.link in processed_links:
+                self.metrics.count("duplicates")
+                return False
+            # Verificar filtros de precio si están establecidos
+            price = product_info.price_cents
+            if price is not None:
+                if ((self.price_min is not None and price < self.price_min * 100)
+                        or (self.price_max is not None and price > self.price_max * 100)):
+                    self.metrics.count("price_filtered")
+                    return False
+            self.metrics.count("items")
+            self.results.append(product_info)
+            self._pending.append(product_info)
+            processed_links.add(product_info.link)
+            if self.debug:
+                print(f"\nEncontrado: {product_info.title} - {product_info.price}€")
+            elif self.show_progress:
+                print(f"\rBuscando productos: {len(self.results)}", end="", flush=True)
+            return True
+        except Exception as e:
+            if self.debug:
+                print(f"Error al procesar producto: {str(e)}")
+            return False
+
+    def _add_batch(self, products, processed_links):
+        """Añade los productos de una página o un scroll, produciendo los nuevos.
+
+        Corta en cuanto se agota un límite y, en modo `newest_first`, al
+        encontrar `known_stop` anuncios seguidos ya vistos (según `known_ids`
+        o, si no se indica, según el almacén): lo que viene detrás es más
+        antiguo y ya se vio en otra ejecución.
+        """
+        known = set()
+        known_ids = self.known_ids or (self.store.known_ids if self.store is not None else None)
+        if self.newest_first and known_ids is not None:
+            known = known_ids(item_id_from_link(p.link) for p in products if p)
+        for product_info in products:
+            if self._budget_exhausted():
+                break
+            if known and product_info:
+                if item_id_from_link(product_info.link) in known:
+                    self._known_streak += 1
+                    self.metrics.count("known_items")
+                else:
+                    self._known_streak = 0
+            if self._add_product(product_info, processed_links):
+                yield product_info
+            if self._known_streak >= self.known_stop:
+                self.stop_reason = "known_items"
+                break
+        self._flush_store()
+
+    def _flush_store(self):
+        """Guarda en el almacén, en un solo lote, los productos pendientes"""
+        if self.store is None or not self._pending:
+            self._pending = []
+            return
+        new_items, price_drops = self.store.upsert_many(self._pending, self.search_term)
+        self.new_items.extend(new_items)
+        self.price_drops.extend(price_drops)
+        self._pending = []
+
+    def default_checkpoint_path(self):
+        """Ruta estable del checkpoint de esta búsqueda dentro del directorio de resultados.
+
+        Lleva la ubicación para que el mismo término en otra ciudad no lo sobrescriba.
+        """
+        locations = "-".join(self.search_locations())
+        return os.path.join(self.save_directory, f"wallapop_{self.search_term}_{locations}.checkpoint.json.gz")
+
+    def _checkpoint_search(self):
+        """Parámetros que identifican la búsqueda guardada en el checkpoint"""
+        return {
+            "search_term": self.search_term,
+            "location": self.location,
+            "price_min": self.price_min,
+            "price_max": self.price_max,
+            "backend": self.backend,
+            "newest_first": self.newest_first,
+        }
+
+    def save_checkpoint(self):
+        """Guarda los resultados y la posición alcanzada en el fichero de checkpoint"""
+        if not self.checkpoint_path:
+            return
+        progress = {"scrolls": self.total_scrolls, "cards": self._card_index,
+                    "cursor": self._cursor, "end": self._api_end}
+        with self.metrics.span("checkpoint"):
+            write_checkpoint(self.checkpoint_path, self._checkpoint_search(), progress, self.results)
+        if self.debug:
+            print(f"\n  → Checkpoint guardado ({len(self.results)} productos)")
+
+    def restore_checkpoint(self):
+        """Carga el checkpoint si existe y devuelve el número de productos recuperados.
+
+        Los enlaces recuperados se tratan como ya procesados, así que esos
+        productos no se vuelven a producir al continuar.
+        """
+        if self._resumed or not self.checkpoint_path:
+            return 0
+        self._resumed = True
+        loaded = read_checkpoint(self.checkpoint_path)
+        if loaded is None:
+            return 0
+        search, progress, items = loaded
+        if search != self._checkpoint_search():
+            raise ValueError(f"El checkpoint {self.checkpoint_path} corresponde a otra búsqueda: {search}")
+        self.results = items
+        self._resume_progress = progress
+        print(f"→ Reanudando desde el checkpoint: {len(items)} productos, {progress['scrolls']} scrolls")
+        return len(items)
+
+    def _maybe_checkpoint(self):
+        """Guarda un checkpoint cada `checkpoint_every` scrolls"""
+        if self.checkpoint_path and self.checkpoint_every and self.total_scrolls % self.checkpoint_every == 0:
+            self.save_checkpoint()
+
+    def _fast_forward(self, cards):
+        """Al reanudar, hace scroll sin extraer hasta volver a tener `cards` tarjetas cargadas"""
+        print(f"→ Recuperando la posición anterior ({cards} tarjetas)...")
+        stalled = 0
+        with self.metrics.span("fast_forward"):
+            while not self.stopped and stalled < 3 and not self._budget_exhausted():
+                loaded, _ = self.page_state()
+                if loaded >= cards:
+                    break
+                stalled = 0 if self.scroll_to_bottom(partial=False) else stalled + 1
+                if self.prune_dom:
+                    self.prune_cards(min(loaded, cards))
+        # Las tarjetas anteriores ya están en el checkpoint: no volver a extraerlas
+        self._card_index = min(cards, self.page_state()[0])
+
+    def _scrape_browser(self, processed_links):
+        """Recorre la búsqueda con el navegador produciendo cada producto nuevo"""
+        self.start_driver()
+        with self.metrics.span("page_load"):
+            try:
+                self.driver.get(self.search_url)
+            except TimeoutException:
+                if self.phase_timeout is None and self._deadline_at is None:
+                    raise
+                # Seguir con lo que haya cargado: las tarjetas suelen estar antes que el resto
+                print("⚠️ La página no terminó de cargar a tiempo; se continúa con lo cargado")
+        print("✓ Página cargada")
+        
+        # Los navegadores del pool ya llegan con las cookies aceptadas
+        if self._lease is None or not self._lease.cookies_accepted:
+            with self.metrics.span("accept_cookies"):
+                self.accept_cookies()
+        
+        # Esperar a que aparezcan las primeras tarjetas
+        with self.metrics.span("first_cards"):
+            self.wait_for_change(0)
+        
+        # Realizar 3 clicks exactamente en X:45, Y:220
+        print("→ Realizando clicks iniciales en (45, 220)...")
+        with self.metrics.span("initial_clicks"):
             actions = ActionChains(self.driver)
             
             for i in range(3):
                 actions.move_by_offset(45, 220).click().perform()
                 actions.move_by_offset(-45, -220).perform()  # Volver a la posición original
-                time.sleep(0.5)
                 if self.debug:
                     print(f"  ✓ Click {i+1} realizado")
             
             print("✓ Clicks completados")
-            time.sleep(2)
+            # Esperar a que la página se estabilice tras los clicks
+            self.wait_for_change(*self.page_state(), idle=self.network_idle)
 
-            print("\n→ Iniciando búsqueda...")
-            processed_links = set()  # Para evitar duplicados
-            
-            # 1. Procesar productos de la primera página
-            cards = self.driver.find_elements(By.CSS_SELECTOR, "tsl-public-item-card .ItemCard")
-            for card in cards:
-                try:
-                    product_info = self.extract_product_info(card)
-                    if product_info and product_info['link'] not in processed_links:
-                        # Verificar filtros de precio si están establecidos
-                        price = float(product_info['price'].replace(',', '.')) if product_info['price'].replace(',', '.').replace('.', '').isdigit() else None
-                        if price is not None:
-                            if self.price_min is not None and price < self.price_min:
-                                continue
-                            if self.price_max is not None and price > self.price_max:
-                                continue
-                        self.results.append(product_info)
-                        processed_links.add(product_info['link'])
-                        if self.debug:
-                            print(f"\nEncontrado: {product_info['title']} - {product_info['price']}€")
-                        else:
-                            print(f"\rBuscando productos: {len(self.results)}", end="", flush=True)
-                except Exception as e:
-                    if self.debug:
-                        print(f"Error al procesar producto: {str(e)}")
-                    continue
+        print("\n→ Iniciando búsqueda...")
+        self._card_index = 0
+        self._pruned_index = 0
+        self.memory_samples = []
+        
+        # 1. Procesar productos de la primera página
+        with self.metrics.span("extract"):
+            products = self.extract_products()
+        yield from self._add_batch(products, processed_links)
 
-            # 2. Hacer scroll parcial y buscar el botón
-            scroll_count = 0
-            while scroll_count < 3:  # Intentar 3 veces máximo
+        # 2. Hacer scroll parcial y buscar el botón (3 intentos como máximo)
+        for _ in range(3):
+            if self.stopped or self._budget_exhausted():
+                break
+            with self.metrics.span("scroll"):
                 self.scroll_to_bottom(partial=True)  # Scroll parcial para encontrar el botón
-                time.sleep(2)
-                
-                try:
-                    if self.click_load_more():
-                        break
-                except:
-                    scroll_count += 1
-                    continue
+            with self.metrics.span("load_more"):
+                if self.click_load_more():
+                    break
 
-            # 3. Scroll infinito y recolección de productos
-            last_count = len(self.results)
-            no_new_items_count = 0
-            total_scrolls = 0
+        # Al reanudar, volver a cargar las tarjetas que ya se habían recorrido
+        if self._resume_progress:
+            self._fast_forward(self._resume_progress.get("cards", 0))
+
+        # 3. Scroll infinito y recolección de productos
+        last_count = len(self.results)
+        no_new_items_count = 0
+        
+        while not self.stopped and not self._budget_exhausted():
+            # Verificar si hemos alcanzado el límite de scrolls
+            if self.max_scrolls is not None and self.total_scrolls >= self.max_scrolls:
+                print(f"\n\n→ Alcanzado el límite de {self.max_scrolls} scrolls")
+                break
+
+            with self.metrics.span("scroll"):
+                self.scroll_to_bottom(partial=False)  # Scroll completo para cargar más productos
+            self.total_scrolls += 1
+            if self.debug:
+                print(f"\nScroll #{self.total_scrolls}")
             
-            while True:
-                # Verificar si hemos alcanzado el límite de scrolls
-                if self.max_scrolls is not None and total_scrolls >= self.max_scrolls:
-                    print(f"\n\n→ Alcanzado el límite de {self.max_scrolls} scrolls")
+            with self.metrics.span("extract"):
+                products = self.extract_products()
+            self.sample_memory()
+            yield from self._add_batch(products, processed_links)
+            self._maybe_checkpoint()
+            
+            current_count = len(self.results)
+            if current_count > last_count:
+                last_count = current_count
+                no_new_items_count = 0
+            else:
+                no_new_items_count += 1
+                if no_new_items_count >= 3:
+                    print("\n\n→ No se encontraron nuevos productos después de 3 intentos")
                     break
 
-                self.scroll_to_bottom(partial=False)  # Scroll completo para cargar más productos
-                total_scrolls += 1
-                if self.debug:
-                    print(f"\nScroll #{total_scrolls}")
-                time.sleep(2)
-                
-                cards = self.driver.find_elements(By.CSS_SELECTOR, "tsl-public-item-card .ItemCard")
-                for card in cards:
+    def _scrape_http(self, processed_links):
+        """Recorre la búsqueda con la API JSON, sin navegador, produciendo cada producto nuevo"""
+        client = WallapopApiClient(api_url=self.api_url, base_url=self.base_url)
+        print("\n→ Iniciando búsqueda (API)...")
+
+        # La primera página equivale a la carga inicial; cada página extra, a un scroll
+        max_pages = self.max_scrolls + 1 if self.max_scrolls is not None else None
+        pages = 0
+        cursor = None
+        if self._resume_progress is not None and self._resume_progress.get("cursor"):
+            # Continuar desde el cursor guardado tras la última página completa
+            cursor = self._resume_progress["cursor"]
+            pages = self._resume_progress["scrolls"] + 1
+            if max_pages is not None:
+                if pages >= max_pages:
+                    return
+                max_pages -= pages
+        elif self._resume_progress is not None and self._resume_progress.get("end"):
+            return  # Ya se habían recorrido todas las páginas
+        page_iter = client.search_pages(self._search_params(), max_pages=max_pages, cursor=cursor)
+        while not self._budget_exhausted():
+            client.timeout = self._time_left(API_TIMEOUT)
+            # Con el presupuesto justo, sin reintentos: su espera se saldría del límite
+            client.session = get_session(retries=client.timeout >= API_TIMEOUT)
+            try:
+                with self.metrics.span("api_request"):
+                    items = next(page_iter, None)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                # Con reintentos, un timeout de lectura llega como ConnectionError
+                if self.phase_timeout is None and self._deadline_at is None:
+                    raise
+                if not self._budget_exhausted():  # Si se ha agotado el tiempo total, ése es el motivo
+                    self.stop_reason = "phase_timeout"
+                break
+            if items is None:
+                break
+            pages += 1
+            self.metrics.count("cards_seen", len(items))
+            if self.debug:
+                print(f"\nPágina #{pages}: {len(items)} productos")
+            yield from self._add_batch([client.to_product(raw) for raw in items], processed_links)
+            # Progreso de páginas completas: el checkpoint nunca salta productos sin procesar
+            self.total_scrolls = max(pages - 1, 0)
+            self._cursor = client.next_page
+            self._api_end = client.next_page is None
+            self._maybe_checkpoint()
+            if self.stopped:
+                break
+
+        if self.debug:
+            print(f"\n  Peticiones HTTP: {client.requests_made}")
+
+    def search_locations(self):
+        """Ubicaciones en las que se busca: `locations` o las de `location` separadas por comas"""
+        return self.locations or split_locations(self.location)
+
+    def _location_scraper(self, location):
+        """Búsqueda de una sola ubicación con la misma configuración que ésta, ordenada por precio"""
+        child = WallapopScraper(self.search_term, location, pool=self.pool)
+        for name in FANOUT_SETTINGS:
+            setattr(child, name, getattr(self, name))
+        child.order_by = "price_low_to_high"
+        child.auto_save = False
+        child.show_progress = False
+        return child
+
+    def _run_location(self, child, products, errors):
+        """Hilo de una ubicación: pasa sus productos a la cola hasta terminar.
+
+        Si la búsqueda falla, anota (ubicación, excepción) en `errors`.
+        """
+        try:
+            if self.stopped or child.stopped:
+                return
+            if self._deadline_at is not None:
+                # Las ubicaciones que esperan turno sólo tienen lo que queda del tiempo total
+                child.deadline = self._deadline_at - time.monotonic()
+                if child.deadline <= 0:
+                    return
+            for product in child.iter_scrape():
+                product.search_location = child.location
+                products.put(product)
+        except Exception as e:
+            print(f"\nError en la búsqueda de '{child.location}': {str(e)}")
+            errors.append((child.location, e))
+        finally:
+            products.put(_FANOUT_DONE)
+
+    @staticmethod
+    def _drain(products):
+        """Itera la cola de una ubicación hasta su marca de fin"""
+        while True:
+            product = products.get()
+            if product is _FANOUT_DONE:
+                return
+            yield product
+
+    def _scrape_fanout(self, processed_links, locations):
+        """Busca en varias ubicaciones a la vez y combina los resultados por precio.
+
+        Cada ubicación se recorre en su propio hilo, ordenada por precio
+        ascendente en Wallapop, así que una mezcla de k vías (heapq.merge)
+        produce un flujo global ordenado sin esperar a que termine ninguna. Un
+        anuncio que aparece en varias ubicaciones sale una sola vez, con la
+        primera de la lista en la que aparece.
+
+        Si fallan todas las ubicaciones se relanza el primer error; si sólo
+        fallan algunas, quedan en `failed_locations` y la búsqueda no se da
+        por completada.
+        """
+        if self.newest_first:
+            print("⚠️ En varias ubicaciones los resultados se ordenan por precio; se ignora --newest-first")
+        print(f"→ Buscando en {len(locations)} ubicaciones: {', '.join(locations)}")
+        children = [self._location_scraper(location) for location in locations]
+        self._children = children
+        queues = [queue.Queue() for _ in children]
+        errors = []
+        seen_ids = {item_id_from_link(item.link) for item in self.results}
+        workers = min(self.fanout_workers, len(children))
+        if self.pool is not None and self.backend != "http":
+            # Cada ubicación toma un navegador del pool: no usar más de los reservados,
+            # o las ubicaciones se quedarían esperando a los de otras búsquedas
+            workers = min(workers, self.pool_slots)
+        executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        try:
+            for child, products in zip(children, queues):
+                executor.submit(self._run_location, child, products, errors)
+            for product in heapq.merge(*(self._drain(q) for q in queues), key=_price_key):
+                if self.stopped or self._budget_exhausted():
+                    break
+                item_id = item_id_from_link(product.link)
+                if item_id in seen_ids or product.link in processed_links:
+                    self.metrics.count("duplicates")
+                    continue
+                seen_ids.add(item_id)
+                processed_links.add(product.link)
+                self.results.append(product)
+                self._pending.append(product)
+                if self.show_progress:
+                    print(f"\rBuscando productos: {len(self.results)}", end="", flush=True)
+                yield product
+                if len(self._pending) >= FANOUT_FLUSH:
+                    self._flush_store()
+        finally:
+            # Al cortar antes de tiempo, las ubicaciones que siguen en marcha ya no hacen falta
+            for child in children:
+                child.stop()
+            executor.shutdown(wait=True)
+            self._children = []
+            for child in children:
+                self.metrics.merge(child.metrics)
+                self.command_count += child.command_count
+            self.total_scrolls = max(child.total_scrolls for child in children)
+        if self.stop_reason is None:
+            # Una ubicación cortada por un límite (p. ej. phase_timeout) deja la búsqueda incompleta
+            self.stop_reason = next((child.stop_reason for child in children if child.stop_reason), None)
+        self.failed_locations = [location for location, _ in errors]
+        if errors and len(errors) == len(children):
+            raise errors[0][1]
+        if errors:
+            print(f"\n⚠️ Resultados incompletos: falló la búsqueda en {', '.join(self.failed_locations)}")
+
+    def iter_scrape(self):
+        """Realiza el scraping produciendo cada producto en cuanto se extrae.
+
+        Los productos se acumulan también en `self.results`. Si se deja de
+        consumir el generador, el navegador se libera igualmente.
+        """
+        broken = False
+        completed = False
+        if self.resume:
+            self.restore_checkpoint()
+        self.total_scrolls = self._resume_progress["scrolls"] if self._resume_progress else 0
+        processed_links = {item.link for item in self.results}  # Para evitar duplicados
+        self.stop_reason = None
+        self.failed_locations = []
+        self._known_streak = 0
+        self._deadline_at = time.monotonic() + self.deadline if self.deadline else None
+        run_id = self.store.start_run(self.search_term) if self.store is not None else None
+        locations = self.search_locations()
+        try:
+            if len(locations) > 1:
+                yield from self._scrape_fanout(processed_links, locations)
+            elif self.backend == "http":
+                yield from self._scrape_http(processed_links)
+            else:
+                yield from self._scrape_browser(processed_links)
+            self._flush_store()
+            if self.stop_reason:
+                self.metrics.count("budget_stops")
+                print(f"\n\n→ Búsqueda terminada: {STOP_REASONS[self.stop_reason]}")
+            if run_id is not None:
+                self.store.finish_run(run_id)
+            self.metrics.count("scrapes")
+            # Con ubicaciones fallidas se conserva el checkpoint para poder reanudar
+            completed = not self.stopped and not self.failed_locations
+        except Exception as e:
+            broken = isinstance(e, WebDriverException)
+            raise
+        finally:
+            # Terminado: el checkpoint sobra. Fallo, parada o Ctrl+C: guardar lo recogido
+            if self.checkpoint_path:
+                if completed:
+                    remove_checkpoint(self.checkpoint_path)
+                elif self.results:
                     try:
-                        product_info = self.extract_product_info(card)
-                        if product_info and product_info['link'] not in processed_links:
-                            # Verificar filtros de precio si están establecidos
-                            price = float(product_info['price'].replace(',', '.')) if product_info['price'].replace(',', '.').replace('.', '').isdigit() else None
-                            if price is not None:
-                                if self.price_min is not None and price < self.price_min:
-                                    continue
-                                if self.price_max is not None and price > self.price_max:
-                                    continue
-                            self.results.append(product_info)
-                            processed_links.add(product_info['link'])
-                            if self.debug:
-                                print(f"Encontrado: {product_info['title']} - {product_info['price']}€")
-                            else:
-                                print(f"\rBuscando productos: {len(self.results)}", end="", flush=True)
+                        self.save_checkpoint()
+                        print(f"\n→ Checkpoint guardado en {self.checkpoint_path} (usa --resume para continuar)")
                     except Exception as e:
-                        if self.debug:
-                            print(f"Error al procesar producto: {str(e)}")
-                        continue
-                
-                current_count = len(self.results)
-                if current_count > last_count:
-                    last_count = current_count
-                    no_new_items_count = 0
-                else:
-                    no_new_items_count += 1
-                    if no_new_items_count >= 3:
-                        print("\n\n→ No se encontraron nuevos productos después de 3 intentos")
-                        break
-                
-                time.sleep(1)
+                        print(f"\nError al guardar el checkpoint: {str(e)}")
+            if self.driver or self._lease:
+                if self.driver and not broken:
+                    try:
+                        self.network_stats = network_stats(self.driver)
+                    except Exception as e:
+                        print(f"\nError al leer las estadísticas de red: {str(e)}")
+                self.stop_driver(broken=broken)
+
+    def scrape(self):
+        """Realiza el scraping principal"""
+        writer = None
+        try:
+            print(f"→ Buscando '{self.search_term}' en Wallapop...")
+            if self.resume:
+                self.restore_checkpoint()
+            if self.stream_format:
+                # Escribir cada producto en disco según se extrae
+                writer = ResultWriter(self._output_path(self.stream_format), self.stream_format,
+                                      located=len(self.search_locations()) > 1)
+                for product_info in self.results:  # Los recuperados del checkpoint
+                    writer.write(product_info)
+
+            for product_info in self.iter_scrape():
+                if writer is not None:
+                    writer.write(product_info)
+
+            if self.enrich and not self.stopped:
+                self.enrich_results()
+
+            if self.stopped:
+                print(f"\n→ Búsqueda detenida con {len(self.results)} productos")
+                return
 
             print(f"\n✓ Se encontraron {len(self.results)} productos")
             if self.price_min is not None or self.price_max is not None:
@@ -448,9 +1213,37 @@ class WallapopScraper:
                 if self.price_max is not None:
                     print(f"  - Precio máximo: {self.price_max}€")
             if self.max_scrolls is not None:
-                print(f"  Scrolls realizados: {total_scrolls}/{self.max_scrolls}")
+                print(f"  Scrolls realizados: {self.total_scrolls}/{self.max_scrolls}")
+            if self.backend != "http":
+                print(f"  Comandos WebDriver: {self.command_count}")
+            if self.memory_samples:
+                rss = [sample[2] / 1024 / 1024 for sample in self.memory_samples]
+                pruned = self.metrics.counters.get("cards_pruned", 0)
+                print(f"  Memoria del navegador: {rss[0]:.0f} MB tras el primer scroll, {rss[-1]:.0f} MB al final "
+                      f"(máximo {max(rss):.0f} MB)" + (f", tarjetas vaciadas: {pruned}" if pruned else ""))
+            if self.network_stats and self.network_stats["requests"]:
+                stats = self.network_stats
+                by_type = ", ".join(f"{t}: {n}" for t, n in stats["blocked_by_type"].most_common())
+                print(f"  Peticiones de red: {stats['requests']}, bloqueadas: {stats['blocked']}"
+                      + (f" ({by_type})" if by_type else ""))
+                print(f"  Datos transferidos: {stats['bytes'] / 1024:.0f} KB")
+            if self.store is not None:
+                print(f"  Nuevos respecto a ejecuciones anteriores: {len(self.new_items)}")
+                print(f"  Bajadas de precio: {len(self.price_drops)}")
+            counters = self.metrics.counters
+            print(f"  Tarjetas leídas: {counters.get('cards_seen', 0)}, duplicadas: {counters.get('duplicates', 0)}, "
+                  f"fuera de precio: {counters.get('price_filtered', 0)}")
+            print("  Tiempo por fase: " + ", ".join(self.metrics.summary()))
             
-            self.save_results()
+            if writer is not None:
+                print(f"\n✓ Resultados guardados en: {writer.path}")
+                if self.enrich:
+                    # El fichero en streaming no lleva los detalles: guardar también el enriquecido
+                    self.save_results()
+                else:
+                    self.print_price_stats()
+            elif self.auto_save:
+                self.save_results()
 
         except Exception as e:
             print(f"Error durante el scraping: {str(e)}")
@@ -458,11 +1251,167 @@ class WallapopScraper:
                 print("Stacktrace completo:")
                 print(traceback.format_exc())
         finally:
-            if self.driver:
-                self.driver.quit()
-                print("\n→ Navegador cerrado")
+            if writer is not None:
+                writer.close()
+
+def build_scraper(args, store=None):
+    """Crea un scraper configurado con los argumentos de la línea de comandos"""
+    scraper = WallapopScraper(args.search_term, args.location)
+    
+    # Configurar opciones adicionales
+    scraper.headless = args.headless
+    if args.max_scrolls:
+        scraper.max_scrolls = args.max_scrolls
+    scraper.fanout_workers = args.fanout_workers
+    scraper.max_items = args.max_items
+    scraper.deadline = args.deadline
+    scraper.phase_timeout = args.phase_timeout
+    if args.newest_first:
+        scraper.newest_first = True
+        scraper.known_stop = args.known_stop
+    if args.save_dir:
+        scraper.save_directory = args.save_dir
+    if args.images:
+        scraper.load_images = True
+    scraper.block_profile = args.block_profile
+    scraper.allowed_domains = args.allow_domain
+    if args.price_min:
+        scraper.price_min = args.price_min
+    if args.price_max:
+        scraper.price_max = args.price_max
+    if args.debug:
+        scraper.debug = True
+    scraper.extraction_mode = args.extraction
+    scraper.prune_dom = args.prune_dom
+    scraper.backend = args.backend
+    if args.api_url:
+        scraper.api_url = args.api_url
+    if args.base_url:
+        scraper.base_url = args.base_url
+    scraper.stream_format = args.stream
+    scraper.output_format = args.format
+    if args.enrich:
+        scraper.enrich = True
+        scraper.enrich_workers = args.enrich_workers
+        scraper.detail_cache_path = args.details_db
+    if args.checkpoint_every or args.resume:
+        scraper.checkpoint_path = scraper.default_checkpoint_path()
+        scraper.checkpoint_every = args.checkpoint_every
+        scraper.resume = args.resume
+    if store is not None:
+        scraper.store = store
+    elif args.db:
+        scraper.store = ItemStore(args.db)
+    return scraper
+
+def watch(args):
+    """Repite la búsqueda cada cierto tiempo mostrando sólo novedades y bajadas de precio.
+
+    Las novedades se calculan contra lo visto en este seguimiento, no contra
+    --db, que pueden haber rellenado otras búsquedas. La primera ejecución
+    correcta sólo fija la línea base.
+    """
+    store = ItemStore(args.db or ":memory:")
+    seen = SeenItems()
+    interval = args.watch * 60
+    cycle = 0
+    baseline = True
+    print(f"→ Siguiendo '{args.search_term}' cada {args.watch} minutos (Ctrl+C para salir)")
+    while True:
+        cycle += 1
+        scraper = build_scraper(args, store=store)
+        scraper.auto_save = False  # Sólo interesan las diferencias, no el CSV completo
+        scraper.checkpoint_path = None  # Cada ciclo es corto y se repite igualmente
+        scraper.known_ids = seen.known_ids
+        try:
+            # iter_scrape deja pasar los errores: un ciclo fallido no cuenta como línea base
+            products = list(scraper.iter_scrape())
+        except Exception as e:
+            print(f"\n→ Ciclo {cycle}: error durante el scraping: {str(e)}")
+            time.sleep(jittered(interval, 0.1))
+            continue
+
+        new_items, price_drops = seen.diff(products)
+        if baseline:
+            print(f"\n→ Primera ejecución: línea base establecida con {len(products)} productos")
+            baseline = False
+        else:
+            print(f"\n→ Ciclo {cycle}: {len(new_items)} nuevos, {len(price_drops)} bajadas de precio")
+            for product in new_items:
+                print(f"  🆕 {product.title} - {product.price}€ {product.link}")
+            for product, old_cents in price_drops:
+                print(f"  📉 {product.title}: {format_cents(old_cents)}€ → {product.price}€ {product.link}")
+
+        time.sleep(jittered(interval, 0.1))
+
+def filter_main(argv):
+    """Subcomando "filtrar": consulta los anuncios ya guardados sin volver a hacer scraping"""
+    parser = argparse.ArgumentParser(
+        prog="wallapop_tracker.py filtrar",
+        description="Busca en los títulos y descripciones de los anuncios guardados en --db",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos de uso:
+  python wallapop_tracker.py filtrar "256gb -roto" --db wallapop.db
+  python wallapop_tracker.py filtrar '"pro max" -averiado' --search-term iphone --price-max 600 --available
+        """
+    )
+    parser.add_argument(
+        "query",
+        help='Palabras a buscar (por prefijo), frases entre comillas y exclusiones con "-"'
+    )
+    parser.add_argument(
+        "--db",
+        default="wallapop.db",
+        help="Base de datos SQLite con los anuncios acumulados (default: wallapop.db)"
+    )
+    parser.add_argument(
+        "--search-term",
+        help="Limitar a los anuncios de una búsqueda concreta"
+    )
+    parser.add_argument(
+        "--price-min",
+        type=float,
+        help="Precio mínimo"
+    )
+    parser.add_argument(
+        "--price-max",
+        type=float,
+        help="Precio máximo"
+    )
+    parser.add_argument(
+        "--available",
+        action="store_true",
+        help="Excluir los anuncios reservados"
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=20,
+        help="Número máximo de resultados (default: 20)"
+    )
+    args = parser.parse_args(argv)
+    if not os.path.exists(args.db):
+        parser.error(f"no existe la base de datos {args.db}; usa --db con la de tus búsquedas")
+
+    store = ItemStore(args.db)
+    started = time.perf_counter()
+    rows = store.search_text(args.query, search_term=args.search_term, price_min=args.price_min,
+                             price_max=args.price_max, include_reserved=not args.available, limit=args.limit)
+    elapsed = (time.perf_counter() - started) * 1000
+    store.close()
+    for row in rows:
+        reserved = " [Reservado]" if row["reserved"] else ""
+        print(f"{format_cents(row['price_cents']):>10}€  {row['title']} ({row['location']}){reserved}\n"
+              f"{'':>12}{row['link']}")
+    print(f"\n✓ {len(rows)} anuncios en {elapsed:.1f} ms")
+
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "filtrar":
+        filter_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         description="Wallapop Tracker - Rastrea productos en Wallapop",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -470,13 +1419,22 @@ def main():
 Ejemplos de uso:
   python wallapop_tracker.py "iphone" --location "madrid" --headless
   python wallapop_tracker.py "ps5" --max-scrolls 5 --save-dir "./resultados"
-  python wallapop_tracker.py "nintendo switch" --no-images --price-max 200
+  python wallapop_tracker.py "nintendo switch" --images --price-max 200
+  python wallapop_tracker.py "bicicleta" --backend http --max-scrolls 10
+  python wallapop_tracker.py "ps5" --watch 15 --db wallapop.db
+  python wallapop_tracker.py "ps5" --watch 15 --db wallapop.db --newest-first --max-scrolls 50
+  python wallapop_tracker.py "ps5" --location "madrid, barcelona, valencia" --backend http
+  python wallapop_tracker.py "movil" --max-items 300 --deadline 120 --phase-timeout 20
+  python wallapop_tracker.py "bicicleta" --max-scrolls 200 --resume
+  python wallapop_tracker.py --batch consultas.csv --workers 4 --headless
+  python wallapop_tracker.py filtrar "256gb -roto" --db wallapop.db --price-max 400
         """
     )
     
-    # Argumentos obligatorios
+    # Argumentos obligatorios (salvo en modo lote)
     parser.add_argument(
         "search_term",
+        nargs="?",
         help="Término de búsqueda (producto a buscar)"
     )
     
@@ -484,7 +1442,15 @@ Ejemplos de uso:
     parser.add_argument(
         "--location",
         default="madrid",
-        help="Ubicación para la búsqueda (default: madrid)"
+        help="Ubicación para la búsqueda; varias separadas por comas se buscan en paralelo y se "
+             "combinan por precio (default: madrid)"
+    )
+    parser.add_argument(
+        "--fanout-workers",
+        type=int,
+        default=4,
+        metavar="N",
+        help="Ubicaciones buscadas a la vez cuando se indican varias (default: 4)"
     )
     parser.add_argument(
         "--headless",
@@ -497,15 +1463,65 @@ Ejemplos de uso:
         default=None,
         help="Número máximo de scrolls a realizar (default: sin límite)"
     )
+    parser.add_argument(
+        "--max-items",
+        type=int,
+        metavar="N",
+        help="Parar al reunir N productos"
+    )
+    parser.add_argument(
+        "--deadline",
+        type=float,
+        metavar="SEGUNDOS",
+        help="Tiempo máximo de la búsqueda; al agotarse se guarda lo reunido hasta entonces"
+    )
+    parser.add_argument(
+        "--phase-timeout",
+        type=float,
+        metavar="SEGUNDOS",
+        help="Tiempo máximo de cada fase (carga de página, espera de productos, petición a la API)"
+    )
+    parser.add_argument(
+        "--newest-first",
+        action="store_true",
+        help="Ordenar por novedad y parar al llegar a anuncios ya guardados en --db; no ve las bajadas de precio de los anuncios antiguos"
+    )
+    parser.add_argument(
+        "--known-stop",
+        type=int,
+        default=5,
+        metavar="N",
+        help="Con --newest-first, anuncios ya vistos seguidos a partir de los cuales se para (default: 5)"
+    )
     parser.add_argument(
         "--save-dir",
         default="./",
         help="Directorio donde guardar los resultados (default: directorio actual)"
     )
+    parser.add_argument(
+        "--images",
+        action="store_true",
+        help="Cargar las imágenes (por defecto no se cargan para acelerar el scraping)"
+    )
     parser.add_argument(
         "--no-images",
         action="store_true",
-        help="No cargar imágenes para acelerar el scraping"
+        help="Sin efecto: las imágenes ya no se cargan por defecto (se mantiene por compatibilidad)"
+    )
+    parser.add_argument(
+        "--block-profile",
+        choices=sorted(PROFILES),
+        default="minimal",
+        help="Recursos a bloquear: none, minimal (imágenes, fuentes, vídeo) o aggressive "
+             "(además analítica, publicidad y seguimiento) (default: minimal)"
+    )
+    parser.add_argument(
+        "--allow-domain",
+        action="append",
+        default=[],
+        metavar="DOMINIO",
+        help="Dominio exento del bloqueo por dominio (analítica, publicidad); sus imágenes, "
+             "fuentes y vídeos se siguen bloqueando según --block-profile (se puede repetir)"
     )
     parser.add_argument(
         "--price-min",
@@ -517,6 +1533,98 @@ Ejemplos de uso:
         type=float,
         help="Precio máximo para filtrar resultados"
     )
+    parser.add_argument(
+        "--backend",
+        choices=["browser", "http"],
+        default="browser",
+        help="Motor de búsqueda: browser (Chromium) o http (API JSON sin navegador) (default: browser)"
+    )
+    parser.add_argument(
+        "--api-url",
+        help="Endpoint de la API de búsqueda para el backend http (p. ej. un servidor local de pruebas)"
+    )
+    parser.add_argument(
+        "--base-url",
+        help="URL base de la web (p. ej. el servidor de fixtures de benchmarks/) (default: https://es.wallapop.com)"
+    )
+    parser.add_argument(
+        "--extraction",
+        choices=["bulk", "element"],
+        default="bulk",
+        help="Modo de extracción: bulk (una llamada JS por página) o element (default: bulk)"
+    )
+    parser.add_argument(
+        "--prune-dom",
+        action="store_true",
+        help="Vaciar las tarjetas ya extraídas para que la memoria del navegador no crezca en búsquedas largas"
+    )
+    parser.add_argument(
+        "--db",
+        help="Base de datos SQLite donde acumular los anuncios entre ejecuciones"
+    )
+    parser.add_argument(
+        "--format",
+        choices=sorted(FORMATS),
+        default="csv",
+        help="Formato del fichero de resultados (parquet necesita pyarrow) (default: csv)"
+    )
+    parser.add_argument(
+        "--stream",
+        choices=["csv", "jsonl"],
+        help="Escribir cada producto en disco según se extrae, en el formato indicado"
+    )
+    parser.add_argument(
+        "--enrich",
+        action="store_true",
+        help="Completar cada producto con descripción, fecha de publicación, vendedor y envío"
+    )
+    parser.add_argument(
+        "--enrich-workers",
+        type=int,
+        default=8,
+        help="Páginas de detalle descargadas en paralelo (default: 8)"
+    )
+    parser.add_argument(
+        "--details-db",
+        default="wallapop_details.db",
+        help="Caché de páginas de detalle (default: wallapop_details.db)"
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        type=int,
+        default=5,
+        metavar="N",
+        help="Guardar un checkpoint cada N scrolls o páginas para poder reanudar (0 desactiva) (default: 5)"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continuar una búsqueda interrumpida desde su checkpoint"
+    )
+    parser.add_argument(
+        "--watch",
+        type=float,
+        metavar="MINUTOS",
+        help="Repetir la búsqueda cada N minutos mostrando sólo novedades y bajadas de precio"
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FICHERO",
+        help="Fichero de consultas (CSV o JSONL con search_term, location, price_min, price_max, "
+             "o texto con un término por línea) a ejecutar en paralelo"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 2,
+        help="Procesos en paralelo del modo lote, cada uno con su navegador (default: núcleos de CPU)"
+    )
+    parser.add_argument(
+        "--batch-output",
+        choices=["combined", "per-query"],
+        default="combined",
+        help="Un CSV con todas las consultas o uno por consulta (default: combined)"
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -524,6 +1632,13 @@ Ejemplos de uso:
     )
 
     args = parser.parse_args()
+    if not args.search_term and not args.batch:
+        parser.error("indica un término de búsqueda o un fichero con --batch")
+    if args.newest_first and not (args.db or args.watch):
+        print("⚠️ --newest-first necesita --db o --watch para saber qué anuncios ya se vieron; "
+              "se recorrerá la búsqueda completa")
+
+    scraper = None
 
     # Configurar el manejador de señales para Ctrl+C
     def signal_handler(sig, frame):
@@ -535,23 +1650,17 @@ Ejemplos de uso:
     import signal
     signal.signal(signal.SIGINT, signal_handler)
 
+    if args.batch:
+        from wallapop_batch import run_batch
+        run_batch(args)
+        return
+
+    if args.watch:
+        watch(args)
+        return
+
     # Crear instancia del scraper con los argumentos
-    scraper = WallapopScraper(args.search_term, args.location)
-    
-    # Configurar opciones adicionales
-    scraper.headless = args.headless
-    if args.max_scrolls:
-        scraper.max_scrolls = args.max_scrolls
-    if args.save_dir:
-        scraper.save_directory = args.save_dir
-    if args.no_images:
-        scraper.load_images = False
-    if args.price_min:
-        scraper.price_min = args.price_min
-    if args.price_max:
-        scraper.price_max = args.price_max
-    if args.debug:
-        scraper.debug = True
+    scraper = build_scraper(args)
 
     # Ejecutar el scraping
     scraper.scrape()
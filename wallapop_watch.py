@@ -0,0 +1,195 @@
+import asyncio
+import logging
+import random
+from wallapop_cache import search_key
+from wallapop_store import item_id_from_link
+
+logger = logging.getLogger(__name__)
+
+
+def jittered(interval, jitter):
+    """Intervalo con una variación aleatoria de ±jitter (fracción) para repartir las ejecuciones"""
+    return interval * (1 + random.uniform(-jitter, jitter))
+
+
+def within_price(product, price_min=None, price_max=None):
+    """Comprueba si un producto está dentro de los límites de precio (en euros)"""
+    cents = product.price_cents
+    if cents is None:
+        return True
+    if price_min is not None and cents < price_min * 100:
+        return False
+    if price_max is not None and cents > price_max * 100:
+        return False
+    return True
+
+
+class Watch:
+    """Seguimiento de una búsqueda por parte de un usuario"""
+
+    def __init__(self, user_id, chat_id, search_term, location="madrid", price_min=None, price_max=None):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.search_term = search_term
+        self.location = location
+        self.price_min = price_min
+        self.price_max = price_max
+
+    @property
+    def group_key(self):
+        """Los seguimientos con el mismo término y ubicación comparten scraping"""
+        return search_key(self.search_term, self.location)[:2]
+
+    def filter(self, new_items, price_drops):
+        """Aplica los límites de precio del usuario a las novedades del grupo"""
+        new_items = [p for p in new_items if within_price(p, self.price_min, self.price_max)]
+        price_drops = [(p, old) for p, old in price_drops if within_price(p, self.price_min, self.price_max)]
+        return new_items, price_drops
+
+
+class SeenItems:
+    """Anuncios que ha visto un seguimiento y su último precio.
+
+    Las novedades se calculan contra esto y no contra el almacén compartido,
+    que también rellenan otras búsquedas.
+    """
+
+    def __init__(self):
+        self._prices = {}  # id del anuncio -> último precio en céntimos
+
+    def known_ids(self, item_ids):
+        """Ids de anuncios ya vistos, de entre los indicados"""
+        return {item_id for item_id in item_ids if item_id in self._prices}
+
+    def diff(self, products):
+        """Compara los productos con lo ya visto y lo actualiza.
+
+        Devuelve (nuevos, bajadas), con las bajadas como (producto, precio
+        anterior en céntimos).
+        """
+        new_items = []
+        price_drops = []
+        for product in products:
+            item_id = item_id_from_link(product.link)
+            cents = product.price_cents
+            if item_id not in self._prices:
+                new_items.append(product)
+            else:
+                old_cents = self._prices[item_id]
+                if cents is None:
+                    cents = old_cents
+                elif old_cents is not None and cents < old_cents:
+                    price_drops.append((product, old_cents))
+            self._prices[item_id] = cents
+        return new_items, price_drops
+
+
+class WatchManager:
+    """Relanza periódicamente las búsquedas seguidas y notifica sólo las novedades.
+
+    Los seguimientos con el mismo término y ubicación se agrupan en un único
+    scraping por ciclo, y cada grupo se programa con un retardo aleatorio para
+    que no coincidan todos a la vez. La primera ejecución correcta de cada
+    grupo sólo fija la línea base y no notifica.
+
+    Cada grupo guarda los anuncios que ha visto (SeenItems), así que las
+    novedades no dependen de lo que otras búsquedas hayan guardado antes en
+    el almacén compartido.
+
+    `run_search(search_term, location, known_ids)` es una corrutina que
+    devuelve los productos encontrados (`known_ids(ids)` dice cuáles de esos
+    ids ya había visto el grupo) y lanza una excepción si la búsqueda falla;
+    `notify(watch, nuevos, bajadas)` es otra que avisa al usuario.
+    """
+
+    def __init__(self, run_search, notify, interval=900, jitter=0.2):
+        self.run_search = run_search
+        self.notify = notify
+        self.interval = interval
+        self.jitter = jitter
+        self._groups = {}  # clave de grupo -> lista de Watch
+        self._tasks = {}
+        self._seen = {}  # clave de grupo -> SeenItems
+
+    def add(self, watch):
+        """Añade un seguimiento. Devuelve False si el usuario ya lo tenía"""
+        watches = self._groups.setdefault(watch.group_key, [])
+        if any(w.user_id == watch.user_id for w in watches):
+            return False
+        watches.append(watch)
+        if watch.group_key not in self._tasks:
+            self._tasks[watch.group_key] = asyncio.get_running_loop().create_task(
+                self._group_loop(watch.group_key)
+            )
+        return True
+
+    def remove(self, user_id, search_term=None):
+        """Quita los seguimientos del usuario (todos o los de un término). Devuelve cuántos"""
+        removed = 0
+        for key in list(self._groups):
+            if search_term is not None and key[0] != search_key(search_term)[0]:
+                continue
+            watches = self._groups[key]
+            kept = [w for w in watches if w.user_id != user_id]
+            removed += len(watches) - len(kept)
+            if kept:
+                self._groups[key] = kept
+            else:
+                del self._groups[key]
+                self._seen.pop(key, None)
+                task = self._tasks.pop(key, None)
+                if task:
+                    task.cancel()
+        return removed
+
+    def watches_for(self, user_id):
+        return [w for watches in self._groups.values() for w in watches if w.user_id == user_id]
+
+    @property
+    def groups(self):
+        return len(self._groups)
+
+    def known_ids(self, key, item_ids):
+        """Ids de anuncios que el grupo ya ha visto, de entre los indicados"""
+        seen = self._seen.get(key)
+        return seen.known_ids(item_ids) if seen is not None else set()
+
+    async def _group_loop(self, key):
+        """Bucle de un grupo: scraping, diferencias y notificaciones en cada ciclo"""
+        # Repartir el arranque de los grupos dentro del primer intervalo
+        await asyncio.sleep(random.uniform(0, self.interval * self.jitter))
+        baseline = True
+        while key in self._groups:
+            watches = self._groups[key]
+            first = watches[0]
+            try:
+                products = await self.run_search(
+                    first.search_term, first.location, lambda ids: self.known_ids(key, ids)
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en el seguimiento de '{first.search_term}': {str(e)}")
+                await asyncio.sleep(jittered(self.interval, self.jitter))
+                continue
+
+            # Sólo se llega aquí si la búsqueda ha ido bien: un fallo no fija la línea base
+            new_items, price_drops = self._seen.setdefault(key, SeenItems()).diff(products)
+            if not baseline:
+                for watch in list(self._groups.get(key, [])):
+                    user_new, user_drops = watch.filter(new_items, price_drops)
+                    if user_new or user_drops:
+                        try:
+                            await self.notify(watch, user_new, user_drops)
+                        except Exception as e:
+                            logger.error(f"Error al notificar a {watch.user_id}: {str(e)}")
+            baseline = False
+
+            await asyncio.sleep(jittered(self.interval, self.jitter))
+
+    def stop(self):
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._groups.clear()
+        self._seen.clear()